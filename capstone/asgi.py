@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'capstone.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# /events/<store_id> streams count changes, and /export/<store_id>.csv streams CSV, after Django is set up
+from stocklist.events import EventsRouter
+from stocklist.export import ExportRouter
+
+application = ExportRouter(EventsRouter(django_application))
@@ -0,0 +1,23 @@
+"""
+ASGI deployment profile for capstone project.
+
+    pip install gunicorn uvicorn
+    gunicorn -c capstone/gunicorn_asgi.py capstone.asgi:application
+
+The JSON API views are async, so a slow client holds a coroutine rather than a worker thread,
+and /events/<store_id> connections stay open without using one at all.
+"""
+
+import os
+
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Count events are fanned out in-process (stocklist/broadcast.py), so every device viewing
+# a Store must be connected to the same process.
+workers = 1
+
+# Event streams send a keepalive every 15 seconds
+keepalive = 75
+timeout = 120
+graceful_timeout = 30
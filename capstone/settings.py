@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'stocklist.metrics.MetricsMiddleware',
+    'stocklist.timing.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +54,23 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'capstone.urls'
 
+# Request timing: Server-Timing headers and a log line on the stocklist.timing logger, see stocklist/timing.py
+# Off: the middleware is left out. REQUEST_TIMING_VIEWS: url names to time, None for every view
+
+REQUEST_TIMING = True
+REQUEST_TIMING_VIEWS = ['items', 'import_items', 'create_list_item']
+REQUEST_TIMING_SLOW_MS = 500
+REQUEST_TIMING_MAX_QUERIES = 50
+
+# Metrics: /metrics in the Prometheus text format, for INTERNAL_IPS only, see stocklist/metrics.py
+# METRICS_DB: SQLite file every worker process adds its counts to, None to report each process' own counts
+# Keep it outside the source tree, e.g. METRICS_DB = '/var/lib/stocklist/metrics.sqlite3'
+
+METRICS = True
+METRICS_DB = None
+
+INTERNAL_IPS = ['127.0.0.1']
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -122,6 +141,10 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Uploaded files (CSV files waiting for an import job)
+
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
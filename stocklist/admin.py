@@ -1,10 +1,22 @@
 from django.contrib import admin
 
-from stocklist.models import User, Store, List, Item, ListItem
+from stocklist.models import User, Store, List, Item, ItemBalance, ListItem, ImportJob, Deletion, SyncOperation
 
 # Register your models here.
 
 
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'store', 'status', 'rows_processed', 'rows_skipped', 'date_added', 'date_finished')
+
+class SyncOperationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'store', 'op_id', 'status', 'list_id', 'item_id', 'amount', 'date_counted', 'date_added')
+
+class DeletionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'store', 'model', 'object_id', 'version')
+
+class ItemBalanceAdmin(admin.ModelAdmin):
+    list_display = ('item', 'store', 'last_count', 'last_count_list', 'additions', 'subtractions', 'on_hand')
+
 class ListItemAdmin(admin.ModelAdmin):
     list_display = ('id', 'list', 'item', 'amount')
 
@@ -21,6 +33,10 @@ class UserAdmin(admin.ModelAdmin):
     list_display = ('id', 'username', 'is_superuser')
 
 
+admin.site.register(ImportJob, ImportJobAdmin)
+admin.site.register(Deletion, DeletionAdmin)
+admin.site.register(SyncOperation, SyncOperationAdmin)
+admin.site.register(ItemBalance, ItemBalanceAdmin)
 admin.site.register(ListItem, ListItemAdmin)
 admin.site.register(List, ListAdmin)
 admin.site.register(Item, ItemAdmin)
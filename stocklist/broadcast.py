@@ -0,0 +1,107 @@
+import asyncio
+import json
+import threading
+from django.db import transaction
+
+
+MAX_QUEUED_EVENTS = 100
+
+
+class Broadcaster:
+    '''
+    Fans out Store events to every client connected to this process.
+    Events can be published from any thread; each subscriber receives them on its own event loop.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, store_id):
+        '''
+        Adds a subscriber for the Store's events, on the running event loop.
+
+        Return: asyncio.Queue
+        '''
+        queue = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+        with self._lock:
+            self._subscribers.setdefault(store_id, {})[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, store_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(store_id, {})
+            subscribers.pop(queue, None)
+            if not subscribers:
+                self._subscribers.pop(store_id, None)
+
+    def subscriber_count(self, store_id):
+        with self._lock:
+            return len(self._subscribers.get(store_id, {}))
+
+    def publish(self, store_id, event, data):
+        '''
+        Sends an event to each subscriber of the Store, without waiting for them.
+
+        Return: int - number of subscribers
+        '''
+        message = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers.get(store_id, {}).items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(put_event, queue, message)
+            except RuntimeError:
+                # the loop has closed
+                self.unsubscribe(store_id, queue)
+        return len(subscribers)
+
+
+def put_event(queue, message):
+    '''
+    Queues an event for a subscriber. A subscriber too slow to keep up
+    gets a "changed" event in place of its backlog, and can fetch the changes since its version.
+    '''
+    if queue.full():
+        while not queue.empty():
+            queue.get_nowait()
+        message = format_event("changed", {})
+    queue.put_nowait(message)
+
+
+def format_event(event, data):
+    '''
+    Formats an event for a text/event-stream, with the Store version as its id when there is one.
+
+    Return: bytes
+    '''
+    lines = []
+    if "version" in data:
+        lines.append("id: {}".format(data["version"]))
+    lines.append("event: {}".format(event))
+    lines.append("data: {}".format(json.dumps(data, default=str)))
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+broadcaster = Broadcaster()
+
+
+def publish_list_items(store_id, version, list_items):
+    '''
+    Broadcasts changed ListItem amounts once the transaction commits: (list id, item id, amount) tuples,
+    amount None for deleted ListItems.
+    '''
+    data = {
+        "version": version,
+        "list_items": [
+            {"list_id": list_id, "item_id": item_id, "amount": None if amount is None else str(amount)} for list_id, item_id, amount in list_items
+        ],
+    }
+    transaction.on_commit(lambda: broadcaster.publish(store_id, "list_items", data))
+
+
+def publish_changed(store_id, version):
+    '''
+    Broadcasts that the Store's Items or Lists changed once the transaction commits,
+    so clients fetch the changes since their version.
+    '''
+    transaction.on_commit(lambda: broadcaster.publish(store_id, "changed", {"version": version}))
@@ -0,0 +1,18 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+
+
+def async_login_required(view):
+    '''
+    login_required for async views: the session and User are read in a thread,
+    so the event loop is not blocked by the database.
+
+    Return: async view
+    '''
+    @wraps(view)
+    async def wrapped_view(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapped_view
@@ -0,0 +1,95 @@
+import asyncio
+import re
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+
+from .broadcast import broadcaster
+from .models import Store
+
+
+EVENTS_PATH = re.compile(r'^/events/(?P<store_id>[0-9]+)$')
+KEEPALIVE_INTERVAL = 15.0
+RETRY_MS = 5000
+
+
+def user_store_id(cookie_header, store_id):
+    '''
+    Finds the logged in User from the session cookie, and checks they own the Store.
+
+    Return: int or None - the Store id
+    '''
+    cookies = SimpleCookie()
+    cookies.load(cookie_header)
+    session_key = cookies[settings.SESSION_COOKIE_NAME].value if settings.SESSION_COOKIE_NAME in cookies else None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    user = get_user(SimpleNamespace(session=session))
+    if not user.is_authenticated or not Store.objects.filter(user=user, pk=store_id).exists():
+        return None
+    return store_id
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def store_events(scope, receive, send, store_id, keepalive_interval=KEEPALIVE_INTERVAL):
+    '''
+    Streams a Store's events to a client as Server-Sent Events, until it disconnects.
+    Sends a comment every keepalive_interval seconds, so proxies keep the connection open.
+    '''
+    headers = dict(scope.get("headers", []))
+    store_id = await sync_to_async(user_store_id)(headers.get(b"cookie", b"").decode("latin-1"), store_id)
+    if store_id is None:
+        await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"Not Found"})
+        return
+
+    queue = broadcaster.subscribe(store_id)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": "retry: {}\n\n".format(RETRY_MS).encode(), "more_body": True})
+
+        while not disconnect.done():
+            get_event = asyncio.ensure_future(queue.get())
+            done, pending = await asyncio.wait({get_event, disconnect}, timeout=keepalive_interval, return_when=asyncio.FIRST_COMPLETED)
+            if get_event in done:
+                await send({"type": "http.response.body", "body": get_event.result(), "more_body": True})
+            else:
+                get_event.cancel()
+                if not disconnect.done():
+                    await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+    finally:
+        broadcaster.unsubscribe(store_id, queue)
+        disconnect.cancel()
+
+
+class EventsRouter:
+    '''
+    ASGI application that streams /events/<store_id> itself, and passes every other request to Django.
+    Django 3.2 sends streaming responses from a sync iterator, which would block the event loop.
+    '''
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope.get("method") == "GET":
+            match = EVENTS_PATH.match(scope["path"])
+            if match:
+                return await store_events(scope, receive, send, int(match.group("store_id")))
+        return await self.application(scope, receive, send)
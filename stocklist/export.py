@@ -0,0 +1,259 @@
+import csv
+import os
+import re
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+
+from .events import user_store_id
+from .models import Store, Item, List, ListItem
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    # columnar export is optional: pip install pyarrow
+    pyarrow = None
+
+
+EXPORT_PATH = re.compile(r'^/export/(?P<store_id>[0-9]+)\.csv$')
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_LINES_PER_SEND = 500
+COLUMNAR_BATCH_SIZE = 10000
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'feather': '.arrow'}
+
+
+class Echo:
+    '''
+    A file-like object for csv.writer that returns each line rather than storing it.
+    '''
+    def write(self, value):
+        return value
+
+
+def export_header(lists):
+    '''
+    The CSV header row, as exported by the store page: Item, then each List name, with " Count" after Counts.
+
+    Return: list
+    '''
+    return ['Item'] + ['{} {}'.format(list.name, list.get_type_display()) if list.type == List.COUNT else list.name for list in lists]
+
+
+def export_rows(store, lists, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Pivots the Store's ListItems into one row per Item, one column per List, '' where the Item is not in the List.
+    Items and their ListItems are read with a single query, chunk_size rows at a time, so memory does not grow with the Store.
+
+    Return: generator of lists
+    '''
+    columns = {list.id: index for index, list in enumerate(lists)}
+    rows = Item.objects.filter(store=store).order_by('id').values_list('id', 'name', 'list_items__list_id', 'list_items__amount')
+
+    row = None
+    row_item_id = None
+    for item_id, name, list_id, amount in rows.iterator(chunk_size=chunk_size):
+        if item_id != row_item_id:
+            if row is not None:
+                yield row
+            row = [name] + [''] * len(columns)
+            row_item_id = item_id
+        if list_id is not None:
+            row[columns[list_id] + 1] = amount
+    if row is not None:
+        yield row
+
+
+def export_csv_lines(store, chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Streams the Store's ListItems as CSV, see export_rows().
+
+    Return: generator of str - one line at a time
+    '''
+    lists = list(store.lists.order_by('id'))
+    writer = csv.writer(Echo())
+    yield writer.writerow(export_header(lists))
+    for row in export_rows(store, lists, chunk_size=chunk_size):
+        yield writer.writerow(row)
+
+
+def export_filename(store):
+    '''
+    The Store name as a CSV file name, without characters that would break a Content-Disposition header.
+
+    Return: str
+    '''
+    name = re.sub(r'[^\w\- ]', '', store.name, flags=re.ASCII).strip() or 'Store'
+    return '{}.csv'.format(name)
+
+
+def next_lines(lines, count=EXPORT_LINES_PER_SEND):
+    '''
+    Joins the next lines of a CSV export.
+
+    Return: bytes - empty at the end of the export
+    '''
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == count:
+            break
+    return ''.join(chunk).encode()
+
+
+def user_store(cookie_header, store_id):
+    '''
+    The Store, if the session cookie's User owns it, see user_store_id().
+
+    Return: Store or None
+    '''
+    store_id = user_store_id(cookie_header, store_id)
+    return None if store_id is None else Store.objects.get(pk=store_id)
+
+
+async def store_export(scope, receive, send, store_id):
+    '''
+    Streams a Store's CSV export under ASGI. Each chunk of lines is read in Django's sync thread,
+    as the export iterates a database cursor, so the event loop is not blocked.
+    '''
+    headers = dict(scope.get("headers", []))
+    store = await sync_to_async(user_store)(headers.get(b"cookie", b"").decode("latin-1"), store_id)
+    if store is None:
+        await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"Not Found"})
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/csv; charset=utf-8"),
+            (b"content-disposition", 'attachment; filename="{}"'.format(export_filename(store)).encode()),
+            (b"cache-control", b"private, no-cache"),
+        ],
+    })
+    lines = export_csv_lines(store)
+    try:
+        while True:
+            body = await sync_to_async(next_lines)(lines)
+            await send({"type": "http.response.body", "body": body, "more_body": bool(body)})
+            if not body:
+                return
+    finally:
+        # closes the database cursor
+        await sync_to_async(lines.close)()
+
+
+class ExportRouter:
+    '''
+    ASGI application that streams /export/<store_id>.csv itself, and passes every other request on.
+    Django 3.2 sends streaming responses from a sync iterator in the event loop, where the export can't read the database.
+    '''
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope.get("method") == "GET":
+            match = EXPORT_PATH.match(scope["path"])
+            if match:
+                return await store_export(scope, receive, send, int(match.group("store_id")))
+        return await self.application(scope, receive, send)
+
+
+def columnar_tables(store):
+    '''
+    The Store's Items, Lists and ListItems as tables for columnar export: (name, queryset, fields).
+    ListItems keep their item_id and list_id, so the tables join as they do in the database.
+
+    Return: list of tuples
+    '''
+    return [
+        ('items', Item.objects.filter(store=store).order_by('id'), ['id', 'name', 'version']),
+        ('lists', List.objects.filter(store=store).order_by('date_added', 'id'), ['id', 'name', 'type', 'date_added', 'version']),
+        (
+            'list_items',
+            ListItem.objects.filter(list__store=store).order_by('id'),
+            ['id', 'list_id', 'item_id', 'amount', 'date_counted', 'version'],
+        ),
+    ]
+
+
+def columnar_batches(queryset, fields, batch_size=COLUMNAR_BATCH_SIZE):
+    '''
+    Reads the queryset with an iterator, batch_size rows at a time, and transposes each batch into columns.
+
+    Return: generator of dicts - {field: list of values}
+    '''
+    rows = []
+    for row in queryset.values_list(*fields).iterator(chunk_size=batch_size):
+        rows.append(row)
+        if len(rows) == batch_size:
+            yield dict(zip(fields, map(list, zip(*rows))))
+            rows = []
+    if rows:
+        yield dict(zip(fields, map(list, zip(*rows))))
+
+
+def columnar_schemas():
+    '''
+    Arrow schemas for columnar_tables(): amounts stay decimal with the precision of ListItem.amount,
+    and dates are UTC timestamps.
+
+    Return: dict - {table name: pyarrow.Schema}
+    Raises: ImproperlyConfigured if pyarrow is not installed
+    '''
+    if pyarrow is None:
+        raise ImproperlyConfigured('Columnar export needs pyarrow: pip install pyarrow')
+
+    amount = ListItem._meta.get_field('amount')
+    timestamp = pyarrow.timestamp('us', tz='UTC')
+    return {
+        'items': pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('name', pyarrow.string()),
+            ('version', pyarrow.int64()),
+        ]),
+        'lists': pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('name', pyarrow.string()),
+            ('type', pyarrow.string()),
+            ('date_added', timestamp),
+            ('version', pyarrow.int64()),
+        ]),
+        'list_items': pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('list_id', pyarrow.int64()),
+            ('item_id', pyarrow.int64()),
+            ('amount', pyarrow.decimal128(amount.max_digits, amount.decimal_places)),
+            ('date_counted', timestamp),
+            ('version', pyarrow.int64()),
+        ]),
+    }
+
+
+def write_columnar(store, directory, format='parquet', batch_size=COLUMNAR_BATCH_SIZE):
+    '''
+    Writes the Store's Items, Lists and ListItems to one file per table in directory, as Parquet,
+    or Arrow IPC (Feather v2). Each batch from columnar_batches() is written as a record batch,
+    so memory grows with batch_size, not the Store.
+
+    Return: list of file paths
+    Raises: ImproperlyConfigured if pyarrow is not installed, ValueError for an unknown format
+    '''
+    if format not in COLUMNAR_FORMATS:
+        raise ValueError('Format must be one of: {}'.format(', '.join(COLUMNAR_FORMATS)))
+    schemas = columnar_schemas()
+
+    paths = []
+    for name, queryset, fields in columnar_tables(store):
+        schema = schemas[name]
+        path = os.path.join(directory, name + COLUMNAR_FORMATS[format])
+        if format == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(path, schema)
+        else:
+            writer = pyarrow.ipc.new_file(path, schema)
+        with writer:
+            for columns in columnar_batches(queryset, fields, batch_size=batch_size):
+                writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+        paths.append(path)
+    return paths
@@ -0,0 +1,707 @@
+import codecs
+import csv
+import datetime
+import itertools
+import time
+import zipfile
+from collections.abc import Iterable
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .broadcast import publish_changed, publish_list_items
+from .matching import MAX_IMPORT_MATCHES, ItemIndex, normalize_name
+from .metrics import observe_batch_update, observe_import
+from .models import Store, Item, ItemBalance, List, ListItem, MAX_LIST_NAME_LENGTH, MAX_ITEM_NAME_LENGTH, MIN_LIST_ITEM_AMOUNT, MAX_LIST_ITEM_AMOUNT
+
+try:
+    import openpyxl
+except ImportError:
+    # XLSX import is optional: pip install openpyxl
+    openpyxl = None
+
+
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_ERRORS = 100
+DEFAULT_CSV_LISTS = [{"name": "Import", "type": List.ADDITION}]
+XLSX_EXTENSIONS = ('.xlsx', '.xlsm')
+XLSX_PREVIEW_ROWS = 10
+
+AMOUNT_DECIMAL_PLACES = ListItem._meta.get_field('amount').decimal_places
+LIST_TYPES = [list_type for list_type, display in List.LIST_TYPE_CHOICES]
+
+
+class ImportValidationError(ValidationError):
+    '''
+    Raised when import data has invalid Lists or rows.
+    report has one dict for each error: "list" index, "row" index (None for List errors), "field", "message".
+    '''
+    def __init__(self, report, error_count):
+        self.report = report
+        self.error_count = error_count
+        messages = [error["message"] for error in report]
+        if error_count > len(report):
+            messages.append("{} more errors.".format(error_count - len(report)))
+        super().__init__(messages)
+
+
+def list_errors(list_data):
+    '''
+    Checks the name, type and items of an imported List.
+
+    Return: list of (field, message) tuples
+    '''
+    errors = []
+    name = list_data.get("name", "")
+    list_type = list_data.get("type", "")
+    items = list_data.get("items", [])
+    if not isinstance(name, str):
+        errors.append(("name", "List name must be text."))
+    elif name == '':
+        errors.append(("name", "List name cannot be blank."))
+    elif len(name) > MAX_LIST_NAME_LENGTH:
+        errors.append(("name", "Ensure List name has at most {} characters (it has {}).".format(MAX_LIST_NAME_LENGTH, len(name))))
+    if list_type != '' and list_type not in LIST_TYPES:
+        errors.append(("type", "Value {!r} is not a valid List type.".format(list_type)))
+    if isinstance(items, (str, bytes, dict)) or not isinstance(items, Iterable):
+        errors.append(("items", "List items must be an array."))
+    return errors
+
+
+def clean_item_name(name):
+    '''
+    Converts an imported Item name to a string. Missing names return ''.
+
+    Return: str
+    '''
+    if name == None:
+        return ''
+    return str(name)
+
+
+def clean_item_amount(amount, required=False):
+    '''
+    Converts an imported ListItem amount to a Decimal without touching the database.
+    Missing amounts default to MIN_LIST_ITEM_AMOUNT, as blank spreadsheet cells do, unless required:
+    a missing count is an error, rather than a zero that replaces the saved count.
+
+    Return: tuple - Decimal or None, error message or None
+    '''
+    if amount == '' or amount == 'null' or amount == None:
+        if required:
+            return None, "Amount is required."
+        return MIN_LIST_ITEM_AMOUNT, None
+    try:
+        value = Decimal(str(amount).strip())
+    except InvalidOperation:
+        value = None
+    if value is None or not value.is_finite():
+        return None, "Amount {!r} must be a decimal number.".format(amount)
+
+    if value < MIN_LIST_ITEM_AMOUNT:
+        return None, "Ensure amount is greater than or equal to {}.".format(MIN_LIST_ITEM_AMOUNT)
+    if value > MAX_LIST_ITEM_AMOUNT:
+        return None, "Ensure amount is less than or equal to {}.".format(MAX_LIST_ITEM_AMOUNT)
+    if -value.normalize().as_tuple().exponent > AMOUNT_DECIMAL_PLACES:
+        return None, "Ensure amount has no more than {} decimal place.".format(AMOUNT_DECIMAL_PLACES)
+    return value, None
+
+
+def clean_rows(rows):
+    '''
+    Converts rows of import data one row at a time, skipping rows with empty names.
+    Rows that aren't dicts have an error, and an empty name.
+
+    Return: generator of (row index, name, amount, list of (field, message) tuples)
+    '''
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            yield index, '', None, [("row", "Row must be an object with a name and amount.")]
+            continue
+        name = clean_item_name(row.get("name", ""))
+        if name == '':
+            continue
+
+        errors = []
+        if len(name) > MAX_ITEM_NAME_LENGTH:
+            errors.append(("name", "Ensure item name has at most {} characters (it has {}).".format(MAX_ITEM_NAME_LENGTH, len(name))))
+        amount, amount_error = clean_item_amount(row.get("amount", ""))
+        if amount_error:
+            errors.append(("amount", amount_error))
+        yield index, name, amount, errors
+
+
+def validate_lists(data, max_errors=MAX_IMPORT_ERRORS):
+    '''
+    Checks every List and row of import data in one pass, before anything is saved:
+    List name, type & items, item name length, amount bounds & precision, and duplicate names in a List.
+    Names that only differ in case, accents or punctuation are duplicates, as they import as the same Item.
+    Only the names in each List are kept in memory, so rows can be any iterable.
+
+    Raises: ImportValidationError with the first max_errors errors
+    '''
+    report = []
+    error_count = 0
+
+    def add_error(list_index, row_index, field, message):
+        nonlocal error_count
+        error_count += 1
+        if len(report) < max_errors:
+            if row_index is None:
+                message = "List {}: {}".format(list_index + 1, message)
+            else:
+                message = "List {} row {}: {}".format(list_index + 1, row_index + 1, message)
+            report.append({"list": list_index, "row": row_index, "field": field, "message": message})
+
+    for list_index, list_data in enumerate(data):
+        list_data_errors = list_errors(list_data)
+        for field, message in list_data_errors:
+            add_error(list_index, None, field, message)
+        if any(field == "items" for field, message in list_data_errors):
+            continue
+
+        name_rows = {}
+        for row_index, name, amount, errors in clean_rows(list_data.get("items", [])):
+            for field, message in errors:
+                add_error(list_index, row_index, field, message)
+            if name == '':
+                continue
+            normalized = normalize_name(name)
+            if normalized in name_rows:
+                add_error(list_index, row_index, "name", "Item {!r} is already in this list (row {}).".format(name, name_rows[normalized] + 1))
+            else:
+                name_rows[normalized] = row_index
+
+    if error_count:
+        raise ImportValidationError(report, error_count)
+
+
+def create_items(store, names, index, batch_size=IMPORT_BATCH_SIZE, version=0):
+    '''
+    Bulk creates the Items in names that are missing from the ItemIndex, stamped with the Store version,
+    then adds them to the index. Names are matched by normalized name, so an existing Item is used when
+    an imported name only differs in case, accents or punctuation.
+
+    Return: int - number of Items created
+    '''
+    new_names = {}
+    for name in names:
+        if index.get(name) is None:
+            new_names.setdefault(normalize_name(name), name)
+    new_names = list(new_names.values())
+    if not new_names:
+        return 0
+
+    new_items = Item.objects.bulk_create(
+        [Item(store=store, name=name, version=version) for name in new_names],
+        batch_size=batch_size,
+    )
+    if all(item.pk for item in new_items):
+        rows = [(item.pk, item.name) for item in new_items]
+    else:
+        # backends that can't return ids from bulk inserts (sqlite): read them back
+        rows = Item.objects.filter(store=store, name__in=new_names).values_list('id', 'name')
+    for item_id, name in rows:
+        index.add(item_id, name)
+    return len(new_names)
+
+
+def batched(rows, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    Groups an iterable of rows into lists of at most batch_size rows.
+
+    Return: generator
+    '''
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def create_list(store, list_data):
+    '''
+    Creates a List from validated import data.
+
+    Return: List
+    '''
+    list_name = list_data.get("name", "")
+    list_type = list_data.get("type", "")
+
+    if list_type == '':
+        list = List(name=list_name, store=store)
+    else:
+        list = List(name=list_name, type=list_type, store=store)
+    list.save()
+    return list
+
+
+def import_rows(store, list, rows, index, batch_size=IMPORT_BATCH_SIZE, version=0, matches=None):
+    '''
+    Saves validated rows of import data to a List in batches, creating any Items missing from the Store's ItemIndex,
+    and updates the Items' balances. New Items and ListItems are stamped with the Store version.
+    rows can be any iterable, it is only read one batch at a time.
+    The number of queries depends on the number of batches, not on the number of rows.
+    If matches is a list, similar Items for each new Item name are added to it, up to MAX_IMPORT_MATCHES.
+
+    Return: tuple - number of rows imported, number of rows skipped
+    '''
+    imported = 0
+    skipped = 0
+    for batch in batched(rows, batch_size):
+        amounts = {name: amount for row_index, name, amount, errors in clean_rows(batch)}
+        if matches is not None and len(matches) < MAX_IMPORT_MATCHES:
+            matches.extend(index.matches(amounts.keys())[:MAX_IMPORT_MATCHES - len(matches)])
+        create_items(store, amounts.keys(), index, batch_size=batch_size, version=version)
+        item_ids = {name: index.get(name) for name in amounts}
+        ListItem.objects.bulk_create(
+            [ListItem(list=list, item_id=item_ids[name], amount=amount, version=version) for name, amount in amounts.items()],
+            batch_size=batch_size,
+        )
+        ItemBalance.objects.apply_changes(store.pk, list.type, list.position, [(item_ids[name], None, amount) for name, amount in amounts.items()])
+        imported += len(amounts)
+        skipped += len(batch) - len(amounts)
+    return imported, skipped
+
+
+def save_lists(store, data, batch_size=IMPORT_BATCH_SIZE, matches=None):
+    '''
+    Saves validated Lists of import data to the Store in one transaction, see import_rows().
+    Bulk created Items and ListItems share one Store version.
+
+    Return: tuple - number of rows imported, number of rows skipped
+    '''
+    start = time.perf_counter()
+    imported = 0
+    skipped = 0
+    with transaction.atomic():
+        version = Store.objects.filter(pk=store.pk).next_version()
+        index = ItemIndex.for_store(store)
+        for list_data in data:
+            list = create_list(store, list_data)
+            list_imported, list_skipped = import_rows(
+                store, list, list_data.get("items", []), index, batch_size=batch_size, version=version, matches=matches
+            )
+            imported += list_imported
+            skipped += list_skipped
+        publish_changed(store.pk, version)
+    observe_import(imported, skipped, time.perf_counter() - start)
+    return imported, skipped
+
+
+def commit_lists(store, data, progress, batch_size=IMPORT_BATCH_SIZE, matches=None, list_ids=(), skip_rows=0):
+    '''
+    Saves validated Lists of import data to the Store one batch at a time, see import_rows(). Each List, and each batch,
+    is saved in its own transaction with its own Store version, so a long import doesn't hold the database's
+    write lock, and other connections see it progress. progress(list id, imported, skipped) is called in each
+    transaction, so it can record what was saved with it.
+    An interrupted import is resumed by passing the ids of the Lists it created, in order, and the rows it saved.
+
+    Return: tuple - number of rows imported, number of rows skipped
+    '''
+    start = time.perf_counter()
+    imported = 0
+    skipped = 0
+    index = ItemIndex.for_store(store)
+    for list_index, list_data in enumerate(data):
+        rows = iter(list_data.get("items", []))
+        if list_index < len(list_ids):
+            list = List.objects.get(pk=list_ids[list_index], store=store)
+            saved_rows = sum(1 for row in itertools.islice(rows, skip_rows))
+            skip_rows -= saved_rows
+        else:
+            with transaction.atomic():
+                list = create_list(store, list_data)
+                progress(list.pk, 0, 0)
+
+        for batch in batched(rows, batch_size):
+            with transaction.atomic():
+                version = Store.objects.filter(pk=store.pk).next_version()
+                List.objects.filter(pk=list.pk).update(version=version)
+                batch_imported, batch_skipped = import_rows(store, list, batch, index, batch_size=batch_size, version=version, matches=matches)
+                progress(list.pk, batch_imported, batch_skipped)
+                publish_changed(store.pk, version)
+            imported += batch_imported
+            skipped += batch_skipped
+    observe_import(imported, skipped, time.perf_counter() - start)
+    return imported, skipped
+
+
+def import_lists(store, data, batch_size=IMPORT_BATCH_SIZE, matches=None):
+    '''
+    Validates Lists of import data, then saves them to the Store.
+    Nothing is saved unless every List and row is valid.
+
+    Raises: ImportValidationError
+    Return: tuple - number of rows imported, number of rows skipped
+    '''
+    validate_lists(data)
+    return save_lists(store, data, batch_size=batch_size, matches=matches)
+
+
+def clean_list_item_amounts(count_list, rows, max_errors=MAX_IMPORT_ERRORS):
+    '''
+    Checks a batch of count updates for a List in one pass, with one query:
+    each "item_id" must be an Item of the List's Store, and appear once, and each "amount" must be given and valid.
+
+    Raises: ImportValidationError with the first max_errors errors
+    Return: dict - amount for each item id
+    '''
+    report = []
+    error_count = 0
+
+    def add_error(row_index, field, message):
+        nonlocal error_count
+        error_count += 1
+        if len(report) < max_errors:
+            report.append({"list": None, "row": row_index, "field": field, "message": "Row {}: {}".format(row_index + 1, message)})
+
+    item_ids = {}
+    for row_index, row in enumerate(rows):
+        item_id = row.get("item_id") if isinstance(row, dict) else None
+        if isinstance(item_id, bool) or not isinstance(item_id, int):
+            add_error(row_index, "item_id", "Item id {!r} must be a whole number.".format(item_id))
+            continue
+        if item_id in item_ids:
+            add_error(row_index, "item_id", "Item {} is already in this update (row {}).".format(item_id, item_ids[item_id] + 1))
+            continue
+        item_ids[item_id] = row_index
+
+    store_item_ids = set(Item.objects.filter(store_id=count_list.store_id, pk__in=item_ids).values_list('id', flat=True))
+
+    amounts = {}
+    for item_id, row_index in item_ids.items():
+        if item_id not in store_item_ids:
+            add_error(row_index, "item_id", "Item {} is not in this Store.".format(item_id))
+        amount, amount_error = clean_item_amount(rows[row_index].get("amount", ""), required=True)
+        if amount_error:
+            add_error(row_index, "amount", amount_error)
+        amounts[item_id] = amount
+
+    if error_count:
+        report.sort(key=lambda error: error["row"])
+        raise ImportValidationError(report, error_count)
+    return amounts
+
+
+def upsert_list_item_rows(rows, version, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    Creates or updates ListItems from rows of (list id, item id, amount, date counted, op id), stamped with version,
+    and updates the Items' balances. Each batch is one INSERT ... ON CONFLICT DO UPDATE statement, with the unique
+    (list, item) constraint as the conflict target, so the number of queries depends on the number of batches and Lists,
+    not on the number of rows.
+
+    Return: int - number of rows
+    '''
+    # amounts before the upsert, for the balances
+    keys = {(row[0], row[1]) for row in rows}
+    saved_amounts = {
+        (list_id, item_id): amount for list_id, item_id, amount in ListItem.objects.filter(
+            list_id__in={list_id for list_id, item_id in keys}, item_id__in={item_id for list_id, item_id in keys}
+        ).values_list('list_id', 'item_id', 'amount') if (list_id, item_id) in keys
+    }
+
+    fields = [ListItem._meta.get_field(name) for name in ['list', 'item', 'amount', 'date_counted', 'op_id', 'version']]
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    batch_size = min(batch_size, connection.ops.bulk_batch_size(fields, rows))
+    placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+
+    with connection.cursor() as cursor:
+        for batch in batched(rows, batch_size):
+            params = []
+            for row in batch:
+                params += [field.get_db_prep_save(value, connection) for field, value in zip(fields, [*row, version])]
+            cursor.execute(
+                'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT ({list}, {item}) DO UPDATE SET {updates}'.format(
+                    table=connection.ops.quote_name(ListItem._meta.db_table),
+                    columns=', '.join(columns),
+                    values=', '.join([placeholders] * len(batch)),
+                    list=columns[0],
+                    item=columns[1],
+                    updates=', '.join('{0} = excluded.{0}'.format(column) for column in columns[2:]),
+                ),
+                params,
+            )
+
+    changes = {}
+    for list_id, item_id, amount, date_counted, op_id in rows:
+        changes.setdefault(list_id, []).append((item_id, saved_amounts.get((list_id, item_id)), amount))
+    for list_id, count_list in List.objects.in_bulk(changes).items():
+        ItemBalance.objects.apply_changes(count_list.store_id, count_list.type, count_list.position, changes[list_id])
+    observe_batch_update(len(rows))
+    return len(rows)
+
+
+def upsert_list_items(count_list, amounts, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    Creates or updates the ListItems of a List from validated amounts for each item id, in one transaction,
+    see upsert_list_item_rows(). The ListItems, and the List, are stamped with the next Store version.
+
+    Return: int - the Store version
+    '''
+    now = timezone.now()
+    with transaction.atomic():
+        version = Store.objects.filter(pk=count_list.store_id).next_version()
+        List.objects.filter(pk=count_list.pk).update(version=version)
+        upsert_list_item_rows([(count_list.pk, item_id, amount, now, '') for item_id, amount in amounts.items()], version, batch_size=batch_size)
+        publish_list_items(count_list.store_id, version, [(count_list.pk, item_id, amount) for item_id, amount in amounts.items()])
+    return version
+
+
+def read_csv(lines, name_fields, amount_field=''):
+    '''
+    Checks the header row of a CSV file, then maps its rows to import data one row at a time.
+    Values from multiple name_fields are joined with a space.
+    Quotes are not special, matching Papa.parse in stocklist.js.
+
+    Raises: ValidationError
+    Return: generator of dicts with "name" & "amount"
+    '''
+    if not name_fields:
+        raise ValidationError("Select an Item Name column!")
+
+    reader = csv.DictReader(lines, quoting=csv.QUOTE_NONE)
+    try:
+        fields = reader.fieldnames or []
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise csv_read_error(reader, e)
+    missing_fields = [field for field in [*name_fields, amount_field] if field and field not in fields]
+    if missing_fields:
+        raise ValidationError(["CSV file has no column named {}".format(field) for field in missing_fields])
+
+    return csv_rows(reader, name_fields, amount_field)
+
+
+def csv_rows(reader, name_fields, amount_field=''):
+    '''
+    Maps the rows of a csv.DictReader to import data one row at a time.
+
+    Raises: ValidationError for a line that isn't UTF-8 text, or can't be read as CSV
+    Return: generator of dicts with "name" & "amount"
+    '''
+    rows = iter(reader)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise csv_read_error(reader, e)
+        yield {
+            "name": ' '.join(row[field] for field in name_fields if row[field]),
+            "amount": row[amount_field] if amount_field else '',
+        }
+
+
+def csv_read_error(reader, error):
+    '''
+    Return: ValidationError - for a line of a CSV file that couldn't be read, by its line number
+    '''
+    # the reader counts a line once it has been read
+    line = reader.line_num + 1
+    if isinstance(error, UnicodeDecodeError):
+        return ValidationError("CSV file line {} is not UTF-8 text. Save the file as CSV UTF-8.".format(line))
+    return ValidationError("CSV file line {} can't be read: {}".format(line, error))
+
+
+def csv_import_data(csv_file, name_fields, amount_field='', lists=None):
+    '''
+    Reads an uploaded CSV file from the start as import data: its rows go in the first of lists.
+
+    Raises: ValidationError
+    Return: list of dicts
+    '''
+    csv_file.seek(0)
+    rows = read_csv(codecs.iterdecode(csv_file, 'utf-8-sig'), name_fields, amount_field)
+
+    import_data = [dict(list_data, items=[]) for list_data in lists or DEFAULT_CSV_LISTS]
+    import_data[0]["items"] = rows
+    return import_data
+
+
+def import_csv(store, csv_file, name_fields, amount_field='', lists=None, batch_size=IMPORT_BATCH_SIZE, matches=None):
+    '''
+    Streams the rows of an uploaded CSV file into the first of lists, and creates the other lists empty.
+    The file is read twice, once to validate and once to save,
+    and only one batch of rows is held in memory at a time.
+
+    Raises: ValidationError
+    Return: tuple - number of rows imported, number of rows skipped
+    '''
+    validate_lists(csv_import_data(csv_file, name_fields, amount_field, lists))
+    return save_lists(store, csv_import_data(csv_file, name_fields, amount_field, lists), batch_size=batch_size, matches=matches)
+
+
+def is_xlsx(uploaded_file):
+    '''
+    Return: bool - True if the uploaded file is an Excel workbook, by its name
+    '''
+    return uploaded_file.name.lower().endswith(XLSX_EXTENSIONS)
+
+
+def clean_header_row(value):
+    '''
+    Converts the selected header row of a sheet, counting from 1. Missing values default to 1.
+
+    Raises: ValidationError
+    Return: int
+    '''
+    if value in (None, ''):
+        return 1
+    try:
+        header_row = int(value)
+    except (TypeError, ValueError):
+        header_row = 0
+    if header_row < 1:
+        raise ValidationError("Header row {!r} must be a whole number from 1.".format(value))
+    return header_row
+
+
+def cell_text(value):
+    '''
+    Converts a sheet cell to text as it is shown in the sheet: whole numbers stored as floats lose their '.0',
+    dates are ISO formatted, and empty cells return ''.
+
+    Return: str
+    '''
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def open_workbook(xlsx_file):
+    '''
+    Opens an uploaded XLSX file from the start in read-only mode, so sheets are read row by row
+    rather than loaded into memory. Cached values are read in place of formulas.
+
+    Raises: ValidationError
+    Return: openpyxl Workbook
+    '''
+    if openpyxl is None:
+        raise ValidationError("XLSX import needs openpyxl on the server.")
+    xlsx_file.seek(0)
+    try:
+        return openpyxl.load_workbook(xlsx_file, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, KeyError, OSError, ValueError):
+        raise ValidationError("File is not a valid XLSX workbook.")
+
+
+def xlsx_rows(xlsx_file, sheet=''):
+    '''
+    Streams the rows of a sheet of an uploaded XLSX file, the first sheet by default.
+    The workbook is closed once the rows have been read.
+
+    Raises: ValidationError on the first row read
+    Return: generator of tuples of cell values
+    '''
+    workbook = open_workbook(xlsx_file)
+    try:
+        if not sheet:
+            worksheet = workbook.worksheets[0]
+        elif sheet in [worksheet.title for worksheet in workbook.worksheets]:
+            worksheet = workbook[sheet]
+        else:
+            raise ValidationError("Workbook has no sheet named {}".format(sheet))
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def xlsx_preview(xlsx_file, preview_rows=XLSX_PREVIEW_ROWS):
+    '''
+    The name and first rows of each sheet of an uploaded XLSX file, to pick the sheet and header row from.
+    Only preview_rows rows of each sheet are read.
+
+    Raises: ValidationError
+    Return: list of dicts with "name" & "rows"
+    '''
+    workbook = open_workbook(xlsx_file)
+    try:
+        return [
+            {
+                "name": worksheet.title,
+                "rows": [
+                    [value if isinstance(value, (int, float, str)) else cell_text(value) for value in row]
+                    for row in worksheet.iter_rows(max_row=preview_rows, values_only=True)
+                ],
+            }
+            for worksheet in workbook.worksheets
+        ]
+    finally:
+        workbook.close()
+
+
+def read_sheet(rows, name_fields, amount_field='', header_row=1):
+    '''
+    Skips to the header row of a sheet and checks it, then maps the rows after it to import data one row at a time.
+    Values from multiple name_fields are joined with a space, as read_csv() does.
+
+    Raises: ValidationError
+    Return: generator of dicts with "name" & "amount"
+    '''
+    if not name_fields:
+        raise ValidationError("Select an Item Name column!")
+
+    rows = iter(rows)
+    header = None
+    for row_number, row in enumerate(rows, start=1):
+        if row_number == header_row:
+            header = row
+            break
+    if header is None:
+        raise ValidationError("Sheet has no row {}".format(header_row))
+
+    columns = {}
+    for index, field in enumerate(cell_text(value) for value in header):
+        columns.setdefault(field, index)
+    missing_fields = [field for field in [*name_fields, amount_field] if field and field not in columns]
+    if missing_fields:
+        raise ValidationError(["Sheet has no column named {}".format(field) for field in missing_fields])
+
+    def value(row, field):
+        index = columns[field]
+        return row[index] if index < len(row) else None
+
+    return (
+        {
+            "name": ' '.join(filter(None, (cell_text(value(row, field)) for field in name_fields))),
+            "amount": value(row, amount_field) if amount_field else '',
+        }
+        for row in rows
+    )
+
+
+def xlsx_import_data(xlsx_file, name_fields, amount_field='', lists=None, sheet='', header_row=1):
+    '''
+    Reads a sheet of an uploaded XLSX file from the start as import data: its rows go in the first of lists.
+
+    Raises: ValidationError
+    Return: list of dicts
+    '''
+    rows = read_sheet(xlsx_rows(xlsx_file, sheet), name_fields, amount_field, header_row)
+
+    import_data = [dict(list_data, items=[]) for list_data in lists or DEFAULT_CSV_LISTS]
+    import_data[0]["items"] = rows
+    return import_data
+
+
+def import_xlsx(store, xlsx_file, name_fields, amount_field='', lists=None, sheet='', header_row=1, batch_size=IMPORT_BATCH_SIZE, matches=None):
+    '''
+    Streams the rows of a sheet of an uploaded XLSX file into the first of lists, as import_csv() does for CSV files.
+    The sheet is read twice, row by row, once to validate and once to save.
+
+    Raises: ValidationError
+    Return: tuple - number of rows imported, number of rows skipped
+    '''
+    validate_lists(xlsx_import_data(xlsx_file, name_fields, amount_field, lists, sheet, header_row))
+    return save_lists(
+        store, xlsx_import_data(xlsx_file, name_fields, amount_field, lists, sheet, header_row), batch_size=batch_size, matches=matches
+    )
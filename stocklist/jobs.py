@@ -0,0 +1,183 @@
+import datetime
+import logging
+import threading
+import time
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .importer import IMPORT_BATCH_SIZE, ImportValidationError, commit_lists, csv_import_data, is_xlsx, validate_lists, xlsx_import_data
+from .models import ImportJob
+
+
+logger = logging.getLogger(__name__)
+
+JOB_POLL_INTERVAL = 1.0
+JOB_HEARTBEAT_INTERVAL = 10.0
+JOB_LEASE = 60.0
+
+
+def enqueue_import(store, lists, csv_file=None, name_fields=(), amount_field='', sheet='', header_row=1):
+    '''
+    Queues import data, or an uploaded CSV or XLSX file, for import into the Store by a worker.
+    The file is saved to MEDIA_ROOT until the job finishes.
+
+    Return: ImportJob
+    '''
+    job = ImportJob(
+        store=store, lists=lists, name_fields=list(name_fields), amount_field=amount_field, sheet=sheet, header_row=header_row
+    )
+    if csv_file is not None:
+        job.csv_file.save(csv_file.name, csv_file, save=False)
+    job.save()
+    return job
+
+
+def claim_next_job():
+    '''
+    Marks the oldest pending ImportJob as running, with a heartbeat.
+    The status is only changed if it is still pending, so two workers can't claim the same job.
+
+    Return: ImportJob or None
+    '''
+    for job_id in ImportJob.objects.filter(status=ImportJob.PENDING).order_by('id').values_list('id', flat=True)[:10]:
+        if ImportJob.objects.filter(pk=job_id, status=ImportJob.PENDING).update(status=ImportJob.RUNNING, heartbeat=timezone.now()):
+            return ImportJob.objects.select_related('store').get(pk=job_id)
+    return None
+
+
+def requeue_interrupted_jobs(lease=JOB_LEASE):
+    '''
+    Returns running ImportJobs to the queue when their worker has stopped: jobs with no heartbeat for lease seconds.
+    Jobs of other live workers keep running. An interrupted job resumes after the last batch it saved, see run_import_job().
+
+    Return: int - number of jobs requeued
+    '''
+    stale = timezone.now() - datetime.timedelta(seconds=lease)
+    return ImportJob.objects.filter(Q(heartbeat__lt=stale) | Q(heartbeat=None), status=ImportJob.RUNNING).update(status=ImportJob.PENDING)
+
+
+class JobHeartbeat(threading.Thread):
+    '''
+    Records a running ImportJob's heartbeat every interval seconds, from a thread with its own database connection,
+    so a long validation pass or batch doesn't make the job look interrupted.
+    A write that fails, as it can while SQLite is locked by a batch, is tried again on the next beat.
+    '''
+    def __init__(self, job_id, interval=JOB_HEARTBEAT_INTERVAL):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def beat(self):
+        '''
+        Return: bool - True if the job's heartbeat was written
+        '''
+        try:
+            ImportJob.objects.filter(pk=self.job_id, status=ImportJob.RUNNING).update(heartbeat=timezone.now())
+        except OperationalError:
+            return False
+        return True
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                self.beat()
+        finally:
+            # each thread has its own database connection
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def job_import_data(job):
+    '''
+    The job's import data: its Lists, or the rows of its open CSV or XLSX file, read from the start.
+
+    Raises: ValidationError
+    Return: list of dicts
+    '''
+    if not job.csv_file:
+        return job.lists
+    if is_xlsx(job.csv_file):
+        return xlsx_import_data(job.csv_file, job.name_fields, job.amount_field, job.lists, job.sheet, job.header_row)
+    return csv_import_data(job.csv_file, job.name_fields, job.amount_field, job.lists)
+
+
+def run_import_job(job, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    Validates the job's data, then imports it into its Store one batch at a time, each batch in its own transaction,
+    see importer.commit_lists(). The rows processed and skipped, and the Lists created, are saved with each batch,
+    so they are seen while the job runs, and a requeued job resumes after the last batch it saved.
+    Records the result, with similar existing Items for new Item names.
+
+    Return: ImportJob
+    '''
+    def progress(list_id, imported, skipped):
+        if list_id not in job.list_ids:
+            job.list_ids.append(list_id)
+        job.rows_processed += imported
+        job.rows_skipped += skipped
+        job.heartbeat = timezone.now()
+        job.save(update_fields=['list_ids', 'rows_processed', 'rows_skipped', 'heartbeat'])
+
+    heartbeat = JobHeartbeat(job.pk)
+    heartbeat.start()
+    try:
+        if job.csv_file:
+            job.csv_file.open('rb')
+        validate_lists(job_import_data(job))
+        matches = []
+        commit_lists(
+            job.store, job_import_data(job), progress, batch_size=batch_size, matches=matches,
+            list_ids=list(job.list_ids), skip_rows=job.rows_processed + job.rows_skipped,
+        )
+        job.status = ImportJob.DONE
+        job.matches = matches
+        job.date_finished = timezone.now()
+        job.save()
+
+    except ImportValidationError as e:
+        job.status = ImportJob.FAILED
+        job.errors = e.report
+    except ValidationError as e:
+        job.status = ImportJob.FAILED
+        job.errors = e.messages
+    except Exception as e:
+        logger.exception("Import job %s failed", job.pk)
+        job.status = ImportJob.FAILED
+        job.errors = [str(e)]
+    finally:
+        heartbeat.stop()
+        if job.csv_file:
+            job.csv_file.close()
+
+    if job.status == ImportJob.FAILED:
+        job.date_finished = timezone.now()
+        job.save()
+
+    # the file is no longer needed once the job has finished
+    if job.csv_file:
+        job.csv_file.delete()
+    return job
+
+
+def work(poll_interval=JOB_POLL_INTERVAL, once=False):
+    '''
+    Runs queued ImportJobs until stopped, or until the queue is empty when once is True.
+
+    Return: int - number of jobs run
+    '''
+    jobs_run = 0
+    while True:
+        job = claim_next_job()
+        if job is not None:
+            run_import_job(job)
+            jobs_run += 1
+        elif once:
+            return jobs_run
+        else:
+            time.sleep(poll_interval)
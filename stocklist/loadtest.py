@@ -0,0 +1,317 @@
+'''
+Simulated stock counters for the load_test command: each virtual user logs in to a running server over HTTP
+and replays counting sessions. Imports nothing from Django, so worker processes don't need its settings.
+'''
+import asyncio
+import json
+import random
+import re
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+
+LOCKED_MESSAGE = b'database is locked'
+IMPORT_ROWS = 20
+MAX_COUNT_AMOUNT = 200
+LOCKED_METRIC = re.compile(r'^stocklist_database_locked_total\{[^}]*\} ([0-9.e+]+)$', re.MULTILINE)
+
+
+class Client:
+    '''
+    A minimal HTTP/1.1 client for one virtual user: one keep-alive connection, and the cookies a browser would keep,
+    with the CSRF token sent back as X-CSRFToken on unsafe requests, as stocklist.js does.
+    '''
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookies = {}
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, method, path, body=b'', content_type=None):
+        '''
+        Sends a request on the open connection, or a new one. A request on a reused connection the server
+        has since closed is sent again, once.
+
+        Return: tuple - status, {lowercase header name: value}, body
+        Raises: asyncio.TimeoutError, OSError or asyncio.IncompleteReadError
+        '''
+        while True:
+            reused = self.writer is not None
+            if not reused:
+                self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+            try:
+                return await asyncio.wait_for(self.exchange(method, path, body, content_type), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                if not reused:
+                    raise
+            except BaseException:
+                # the connection is in an unknown state
+                await self.close()
+                raise
+
+    async def exchange(self, method, path, body, content_type):
+        lines = [
+            '{} {} HTTP/1.1'.format(method, path),
+            'Host: {}:{}'.format(self.host, self.port),
+            'Content-Length: {}'.format(len(body)),
+        ]
+        if self.cookies:
+            lines.append('Cookie: {}'.format('; '.join('{}={}'.format(name, value) for name, value in self.cookies.items())))
+        if method not in ('GET', 'HEAD') and 'csrftoken' in self.cookies:
+            lines.append('X-CSRFToken: {}'.format(self.cookies['csrftoken']))
+        if content_type:
+            lines.append('Content-Type: {}'.format(content_type))
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by the server.')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name = name.lower()
+            if name == 'set-cookie':
+                self.set_cookie(value.strip())
+            headers[name] = value.strip()
+
+        close = headers.get('connection', '').lower() == 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # trailers end with a blank line
+                    while (await self.reader.readline()).strip():
+                        pass
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            response_body = b''.join(chunks)
+        elif 'content-length' in headers:
+            response_body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            response_body = await self.reader.read()
+            close = True
+        if close:
+            await self.close()
+        return status, headers, response_body
+
+    def set_cookie(self, header):
+        for name, morsel in SimpleCookie(header).items():
+            if morsel['max-age'] == '0' or not morsel.value:
+                self.cookies.pop(name, None)
+            else:
+                self.cookies[name] = morsel.value
+
+
+class Results:
+    '''
+    Latencies and failures of each kind of request, as plain dicts so they can be sent from worker processes.
+    '''
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.locked = {}
+
+    def record(self, name, seconds, error=None, locked=False):
+        self.latencies.setdefault(name, []).append(seconds)
+        if error is not None:
+            errors = self.errors.setdefault(name, {})
+            errors[error] = errors.get(error, 0) + 1
+        if locked:
+            self.locked[name] = self.locked.get(name, 0) + 1
+
+    def as_dict(self):
+        return {"latencies": self.latencies, "errors": self.errors, "locked": self.locked}
+
+
+class SessionFailed(Exception):
+    '''
+    Raised when a virtual user can't go on with its session, such as when login fails.
+    '''
+
+
+class VirtualUser:
+    '''
+    A member of staff counting stock: logs in, opens their Store and fetches its Items, then counts Items into
+    the Store's latest Count, one create_list_item request per Item, or update_list_items batches of batch_size.
+    Every import_every counts they import a delivery, and every export_every counts they export the Store.
+    '''
+    def __init__(self, index, options, results):
+        self.index = index
+        self.options = options
+        self.results = results
+        self.rng = random.Random('{}:{}'.format(options['seed'], index))
+        self.client = Client(options['host'], options['port'], options['timeout'])
+        self.username = '{}{}'.format(options['prefix'], index % options['accounts'] + 1)
+
+    async def call(self, name, method, path, data=None, form=None, expect=200):
+        '''
+        Sends a request and records its latency, and any failure: a status other than expect, "timeout",
+        or "connection". Failures with "database is locked" in the body, as DEBUG error pages have, are also
+        recorded as locked.
+
+        Return: tuple - status, headers, body; None if the request failed
+        '''
+        body, content_type = b'', None
+        if data is not None:
+            body, content_type = json.dumps(data).encode(), 'application/json'
+        elif form is not None:
+            body, content_type = urlencode(form).encode(), 'application/x-www-form-urlencoded'
+
+        start = time.perf_counter()
+        try:
+            status, headers, response_body = await self.client.request(method, path, body, content_type)
+        except asyncio.TimeoutError:
+            self.results.record(name, time.perf_counter() - start, 'timeout')
+            return None
+        except (OSError, asyncio.IncompleteReadError):
+            self.results.record(name, time.perf_counter() - start, 'connection')
+            return None
+        seconds = time.perf_counter() - start
+        if status != expect:
+            self.results.record(name, seconds, str(status), locked=LOCKED_MESSAGE in response_body)
+            return None
+        self.results.record(name, seconds)
+        return status, headers, response_body
+
+    async def login(self):
+        if await self.call('login', 'GET', '/login') is None:
+            raise SessionFailed('Could not open the login page.')
+        response = await self.call('login', 'POST', '/login', form={
+            'csrfmiddlewaretoken': self.client.cookies.get('csrftoken', ''),
+            'username': self.username,
+            'password': self.options['password'],
+        }, expect=302)
+        if response is None:
+            raise SessionFailed('Could not log in as {}.'.format(self.username))
+
+    async def open_store(self):
+        '''
+        Return: tuple - Store id, and the Store's Items and Lists, in the matrix format
+        '''
+        response = await self.call('open_store', 'GET', '/', expect=302)
+        match = re.match(r'^(?:https?://[^/]+)?/store/(\d+)$', response[1].get('location', '')) if response else None
+        if match is None:
+            raise SessionFailed('{} has no Store.'.format(self.username))
+        store_id = int(match.group(1))
+        await self.call('open_store', 'GET', '/store/{}'.format(store_id))
+        response = await self.call('items', 'GET', '/items/{}?format=matrix'.format(store_id))
+        if response is None:
+            raise SessionFailed('Could not fetch the Items of Store {}.'.format(store_id))
+        return store_id, json.loads(response[2])
+
+    async def count_list(self, store_id, data):
+        '''
+        Return: int - the id of the Store's latest Count, created if it has none
+        '''
+        counts = [store_list["id"] for store_list in data["lists"] if store_list["type"] == "Count"]
+        if counts:
+            return counts[-1]
+        await self.call('create_lists', 'POST', '/create_lists/{}'.format(store_id), [{"name": "Count", "type": "CO"}], expect=201)
+        store_id, data = await self.open_store()
+        counts = [store_list["id"] for store_list in data["lists"] if store_list["type"] == "Count"]
+        if not counts:
+            raise SessionFailed('Could not create a Count in Store {}.'.format(store_id))
+        return counts[-1]
+
+    def amount(self):
+        return '{:.1f}'.format(self.rng.randint(0, MAX_COUNT_AMOUNT * 10) / 10)
+
+    async def session(self):
+        store_id, data = await self.open_store()
+        item_ids, item_names = data["item_ids"], data["item_names"]
+        if not item_ids:
+            raise SessionFailed('Store {} has no Items.'.format(store_id))
+        list_id = await self.count_list(store_id, data)
+
+        options = self.options
+        counted = 0
+        while counted < options['counts']:
+            if options['batch_size']:
+                batch = self.rng.sample(item_ids, min(options['batch_size'], options['counts'] - counted, len(item_ids)))
+                await self.call('update_list_items', 'POST', '/update_list_items/{}'.format(list_id), [
+                    {"item_id": item_id, "amount": self.amount()} for item_id in batch
+                ], expect=201)
+                previous, counted = counted, counted + len(batch)
+            else:
+                await self.call('create_list_item', 'POST', '/create_list_item/{}/{}'.format(list_id, self.rng.choice(item_ids)), {
+                    "amount": self.amount()
+                }, expect=201)
+                previous, counted = counted, counted + 1
+
+            if options['import_every'] and counted // options['import_every'] > previous // options['import_every']:
+                await self.call('import_items', 'POST', '/import_items/{}'.format(store_id), [{
+                    "name": "Load Delivery {}".format(self.index + 1),
+                    "type": "AD",
+                    "items": [{"name": name, "amount": "6"} for name in self.rng.sample(item_names, min(IMPORT_ROWS, len(item_names)))],
+                }], expect=201)
+            if options['export_every'] and counted // options['export_every'] > previous // options['export_every']:
+                await self.call('export_csv', 'GET', '/export/{}.csv'.format(store_id))
+            if options['think_time']:
+                await asyncio.sleep(self.rng.uniform(0, 2 * options['think_time']))
+
+    async def run(self):
+        '''
+        Return: str - why the virtual user stopped early, None if it finished every session
+        '''
+        try:
+            await self.login()
+            for session in range(self.options['sessions']):
+                await self.session()
+        except SessionFailed as e:
+            return str(e)
+        finally:
+            await self.client.close()
+        return None
+
+
+def run_users(indexes, options):
+    '''
+    Runs virtual users concurrently in this process' event loop. The entry point of each worker process.
+
+    Return: dict - Results.as_dict(), and "failed", why virtual users stopped early
+    '''
+    results = Results()
+
+    async def run():
+        return await asyncio.gather(*[VirtualUser(index, options, results).run() for index in indexes])
+
+    failed = [reason for reason in asyncio.run(run()) if reason is not None]
+    return dict(results.as_dict(), failed=failed)
+
+
+def locked_total(options):
+    '''
+    Reads stocklist_database_locked_total from the server's /metrics, which it serves to 127.0.0.1 with METRICS on.
+
+    Return: float - the total over every view, None if /metrics can't be read
+    '''
+    async def scrape():
+        client = Client(options['host'], options['port'], options['timeout'])
+        try:
+            return await client.request('GET', '/metrics')
+        finally:
+            await client.close()
+
+    try:
+        status, headers, body = asyncio.run(scrape())
+    except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError):
+        return None
+    if status != 200:
+        return None
+    return sum(float(value) for value in LOCKED_METRIC.findall(body.decode()))
@@ -0,0 +1,311 @@
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from statistics import median
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+
+from stocklist.models import User, Store, Item, List, ListItem
+from stocklist.stock import rebuild_balances
+from stocklist.stockdata import insert_rows
+from stocklist.timing import install, start_timing, stop_timing
+from .benchmark_servers import percentile
+
+
+BENCHMARK_SIZES = [100, 5000, 50000]
+BENCHMARK_LISTS = [2, 10]
+BENCHMARK_PATHS = ['items', 'items_matrix', 'create_list_item', 'create_lists', 'import_items', 'delete_store']
+BENCHMARK_SEED_BATCH_SIZE = 5000
+# latency changes smaller than this are noise, however large as a fraction
+BUDGET_LATENCY_FLOOR_MS = 2
+
+
+def seed_store(user, items, lists, seed=0):
+    '''
+    Creates a Store with items Items and lists Lists, Additions, Subtractions and Counts in turn,
+    each with a ListItem for every Item, with bulk inserts, see stockdata.insert_rows(), then builds the Item balances.
+
+    Return: Store
+    '''
+    rng = random.Random(seed)
+    list_types = [List.ADDITION, List.SUBTRACTION, List.COUNT]
+    with transaction.atomic():
+        store = Store.objects.create(user=user, name='Benchmark {}x{} {}'.format(items, lists, uuid.uuid4().hex[:8]))
+        version = Store.objects.filter(pk=store.pk).next_version()
+        Item.objects.bulk_create(
+            [Item(store=store, name='Benchmark Item {:06d}'.format(i), version=version) for i in range(items)],
+            batch_size=BENCHMARK_SEED_BATCH_SIZE,
+        )
+        List.objects.bulk_create([
+            List(store=store, name='List {}'.format(i), type=list_types[i % len(list_types)], version=version) for i in range(lists)
+        ])
+        item_ids = list(Item.objects.filter(store=store).order_by('id').values_list('id', flat=True))
+        amounts = [ListItem._meta.get_field('amount').get_db_prep_save(Decimal(tenths) / 10, connection) for tenths in range(1000)]
+        for list_id in List.objects.filter(store=store).order_by('id').values_list('id', flat=True):
+            insert_rows(ListItem, ['list', 'item', 'amount', 'op_id', 'version'], (
+                (list_id, item_id, amounts[rng.randint(0, 999)], '', version) for item_id in item_ids
+            ), BENCHMARK_SEED_BATCH_SIZE)
+    rebuild_balances(store)
+    return store
+
+
+@contextmanager
+def throwaway_database():
+    '''
+    Creates and migrates a temporary database in place of the default database, as the test runner does,
+    and destroys it on exit. On SQLite it is a file in a temporary directory, like the configured database, not in memory.
+    '''
+    test_settings = connection.settings_dict['TEST']
+    test_name = test_settings['NAME']
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = test_name
+
+
+def summarize(latencies, queries, peak_memory):
+    '''
+    Return: dict - latency in milliseconds, query count and peak memory in KiB of a benchmarked path
+    '''
+    return {
+        "runs": len(latencies),
+        "median_ms": round(median(latencies) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "min_ms": round(min(latencies) * 1000, 2),
+        "queries": queries,
+        "peak_memory_kib": None if peak_memory is None else round(peak_memory / 1024),
+    }
+
+
+def compare_results(results, baseline, tolerance):
+    '''
+    Compares benchmark results with a baseline run: a path regresses if its median latency or peak memory
+    grew by more than tolerance, a fraction, or it runs more queries. Paths missing from either run are ignored.
+
+    Return: list of str - one message for each regression
+    '''
+    regressions = []
+    for name, result in sorted(results["results"].items()):
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        if result["median_ms"] > base["median_ms"] * (1 + tolerance) and result["median_ms"] - base["median_ms"] > BUDGET_LATENCY_FLOOR_MS:
+            regressions.append('{}: median {} ms, budget {} ms'.format(name, result["median_ms"], base["median_ms"]))
+        if result["queries"] > base["queries"]:
+            regressions.append('{}: {} queries, budget {}'.format(name, result["queries"], base["queries"]))
+        if (
+            result["peak_memory_kib"] is not None and base["peak_memory_kib"] is not None
+            and result["peak_memory_kib"] > base["peak_memory_kib"] * (1 + tolerance)
+        ):
+            regressions.append('{}: peak memory {} KiB, budget {} KiB'.format(name, result["peak_memory_kib"], base["peak_memory_kib"]))
+    return regressions
+
+
+def parse_sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(',')]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) < 1:
+        raise CommandError('Sizes must be positive whole numbers separated by commas: {!r}'.format(value))
+    return sizes
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures latency, query count and peak memory of the hot API paths against seeded Stores of several sizes, '
+        'through the full middleware stack. Writes the results as JSON, and with --budget fails if a path regressed '
+        'past --tolerance of a baseline run. Runs against a throwaway database, unless --database is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=','.join(map(str, BENCHMARK_SIZES)), help='Items in each Store, separated by commas.')
+        parser.add_argument('--lists', default=','.join(map(str, BENCHMARK_LISTS)), help='Lists in each Store, separated by commas.')
+        parser.add_argument('--paths', default=','.join(BENCHMARK_PATHS), help='Paths to benchmark, of: {}.'.format(', '.join(BENCHMARK_PATHS)))
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs of each path.')
+        parser.add_argument('--import-rows', type=int, default=1000, help='Rows in each import_items request, half of them new Items.')
+        parser.add_argument('--no-memory', action='store_true', help="Don't measure peak memory, which takes an extra run of each path.")
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the generated amounts.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--budget', help='JSON results of a baseline run to check against.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed growth of latency and peak memory over the budget, a fraction.')
+        parser.add_argument('--database', action='store_true', help='Run against the configured database, adding and deleting a User and Stores, not a throwaway one.')
+
+    def handle(self, *args, **options):
+        sizes = parse_sizes(options['sizes'])
+        list_counts = parse_sizes(options['lists'])
+        paths = options['paths'].split(',')
+        unknown = set(paths) - set(BENCHMARK_PATHS)
+        if unknown:
+            raise CommandError('Unknown paths: {}'.format(', '.join(sorted(unknown))))
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        baseline = None
+        if options['budget']:
+            try:
+                with open(options['budget']) as budget_file:
+                    baseline = json.load(budget_file)
+            except (OSError, ValueError) as e:
+                raise CommandError('Could not read budget {}: {}'.format(options['budget'], e))
+
+        # count queries with the request timing's execute wrapper
+        install()
+
+        if options['database']:
+            results = self.benchmark_stores(sizes, list_counts, paths, options)
+        else:
+            self.stdout.write('Creating a throwaway database...')
+            with throwaway_database():
+                results = self.benchmark_stores(sizes, list_counts, paths, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+            self.stdout.write('Results written to {}'.format(options['output']))
+
+        if baseline is not None:
+            regressions = compare_results(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('{} regressions past {:.0%} tolerance:\n{}'.format(len(regressions), options['tolerance'], '\n'.join(regressions)))
+            self.stdout.write('Within budget.')
+
+    def benchmark_stores(self, sizes, list_counts, paths, options):
+        '''
+        Seeds a Store of each size, with each count of Lists, and benchmarks each path against it.
+        The benchmark User and Stores are deleted afterwards.
+
+        Return: dict - the results, as written to --output
+        '''
+        results = {
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "repeat": options['repeat'],
+            "import_rows": options['import_rows'],
+            "results": {},
+        }
+        user = User.objects.create_user('benchmark-{}'.format(uuid.uuid4().hex[:12]))
+        try:
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(user)
+            for items in sizes:
+                for lists in list_counts:
+                    start = time.perf_counter()
+                    store = seed_store(user, items, lists, seed=options['seed'])
+                    self.stdout.write('{} Items x {} Lists, seeded in {:.1f}s'.format(items, lists, time.perf_counter() - start))
+                    for path in paths:
+                        result = self.benchmark(client, user, store, path, items, lists, options)
+                        results["results"]['{} {}x{}'.format(path, items, lists)] = result
+                        self.stdout.write('  {:18} median {:9.2f} ms  p95 {:9.2f} ms  {:4} queries  peak {} KiB'.format(
+                            path, result["median_ms"], result["p95_ms"], result["queries"],
+                            '-' if result["peak_memory_kib"] is None else result["peak_memory_kib"],
+                        ))
+                    store.delete()
+        finally:
+            user.delete()
+        return results
+
+    def requests(self, client, user, store, path, items, lists, options):
+        '''
+        Return: tuple - setup(run), untimed, and request(setup's return value), timed, for each run of the path
+        '''
+        def setup(run):
+            return run
+
+        if path == 'items':
+            def request(run):
+                return client.get('/items/{}'.format(store.pk))
+
+        elif path == 'items_matrix':
+            def request(run):
+                return client.get('/items/{}?format=matrix'.format(store.pk))
+
+        elif path == 'create_list_item':
+            # a new ListItem in the last List for each run
+            count_list = store.lists.order_by('id').last()
+            item_ids = list(Item.objects.filter(store=store).order_by('-id').values_list('id', flat=True))
+
+            def request(run):
+                return client.post(
+                    '/create_list_item/{}/{}'.format(count_list.pk, item_ids[run % len(item_ids)]),
+                    json.dumps({"amount": "1.5"}),
+                    content_type='application/json',
+                )
+
+        elif path == 'create_lists':
+            def request(run):
+                return client.post('/create_lists/{}'.format(store.pk), json.dumps([
+                    {"name": "Benchmark Delivery {}".format(run), "type": List.ADDITION},
+                    {"name": "Benchmark Count {}".format(run), "type": List.COUNT},
+                ]), content_type='application/json')
+
+        elif path == 'import_items':
+            # half existing Items, half new
+            existing = min(options['import_rows'] // 2, items)
+
+            def setup(run):
+                names = ['Benchmark Item {:06d}'.format(i) for i in range(existing)]
+                names += ['New Item {} {}'.format(run, i) for i in range(options['import_rows'] - existing)]
+                return json.dumps([{"name": "Benchmark Import {}".format(run), "type": List.ADDITION, "items": [
+                    {"name": name, "amount": "2"} for name in names
+                ]}])
+
+            def request(data):
+                return client.post('/import_items/{}'.format(store.pk), data, content_type='application/json')
+
+        elif path == 'delete_store':
+            # deletes a fresh copy of the Store, without the Lists and Items the other paths added
+            def setup(run):
+                return seed_store(user, items, lists, seed=options['seed'])
+
+            def request(target):
+                return client.post('/delete_store/{}'.format(target.pk))
+
+        return setup, request
+
+    def benchmark(self, client, user, store, path, items, lists, options):
+        '''
+        Times each run of the path, counting queries on the first. Peak memory is traced in one more run,
+        as tracing slows every allocation. delete_store runs once, and once more for memory,
+        as each run seeds the Store it deletes.
+
+        Return: dict, see summarize()
+        '''
+        setup, request = self.requests(client, user, store, path, items, lists, options)
+        runs = 1 if path == 'delete_store' else options['repeat']
+        latencies = []
+        queries = None
+        peak_memory = None
+        for run in range(runs + (0 if options['no_memory'] else 1)):
+            arg = setup(run)
+            trace = run == runs
+            if trace:
+                tracemalloc.start()
+            timing, token = start_timing()
+            start = time.perf_counter()
+            try:
+                response = request(arg)
+            finally:
+                elapsed = time.perf_counter() - start
+                stop_timing(token)
+                if trace:
+                    peak_memory = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+            if response.status_code >= 400:
+                raise CommandError('{} failed with status {}: {}'.format(path, response.status_code, response.content[:200]))
+            if not trace:
+                latencies.append(elapsed)
+                if queries is None:
+                    queries = timing.queries
+        return summarize(latencies, queries, peak_memory)
@@ -0,0 +1,163 @@
+import asyncio
+import io
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from stocklist.importer import import_lists
+from stocklist.models import User, Store
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares concurrent-client throughput of the WSGI and ASGI handlers in-process. '
+        'Each client is slow to read its response, which holds a WSGI worker thread but only a coroutine under ASGI.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50, help='Number of concurrent clients.')
+        parser.add_argument('--requests', type=int, default=500, help='Number of requests for each handler.')
+        parser.add_argument('--wsgi-workers', type=int, default=8, help='WSGI worker threads, as in a threaded WSGI server.')
+        parser.add_argument('--client-delay', type=float, default=0.1, help='Seconds each client takes to read a response.')
+        parser.add_argument('--items', type=int, default=1000, help='Number of Items in the benchmark Store.')
+        parser.add_argument('--path', default='/items/{store_id}?format=matrix', help='Path to request, {store_id} is replaced.')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user('benchmark-{}'.format(uuid.uuid4().hex[:12]))
+        try:
+            store = Store.objects.create(user=user, name='Benchmark')
+            import_lists(store, [
+                {"name": "Stock", "type": "AD", "items": [{"name": "Item {}".format(i), "amount": str(i % 100)} for i in range(options['items'])]},
+                {"name": "Start", "type": "CO", "items": []},
+            ])
+            client = Client()
+            client.force_login(user)
+            cookie = '{}={}'.format(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+            path, _, query_string = options['path'].format(store_id=store.pk).partition('?')
+
+            self.stdout.write('{} clients, {} requests, {}s client delay, GET {}'.format(
+                options['clients'], options['requests'], options['client_delay'], options['path'].format(store_id=store.pk)
+            ))
+            for name, run in [('WSGI', self.run_wsgi), ('ASGI', self.run_asgi)]:
+                start = time.perf_counter()
+                latencies = asyncio.run(run(path, query_string, cookie, options))
+                self.report(name, latencies, time.perf_counter() - start)
+        finally:
+            user.delete()
+
+    def report(self, name, latencies, elapsed):
+        self.stdout.write('{:5} {:8.1f} req/s  p50 {:7.1f} ms  p95 {:7.1f} ms  ({} requests in {:.2f}s)'.format(
+            name,
+            len(latencies) / elapsed,
+            median(latencies) * 1000,
+            percentile(latencies, 0.95) * 1000,
+            len(latencies),
+            elapsed,
+        ))
+
+    async def run_clients(self, request, options):
+        '''
+        Runs requests from concurrent clients, each waiting for its last response before the next request.
+
+        Return: list of latencies in seconds
+        '''
+        latencies = []
+        remaining = options['requests']
+
+        async def client():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                status = await request()
+                if status != 200:
+                    raise RuntimeError('Request failed with status {}'.format(status))
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*[client() for _ in range(options['clients'])])
+        return latencies
+
+    async def run_wsgi(self, path, query_string, cookie, options):
+        handler = WSGIHandler()
+        executor = ThreadPoolExecutor(max_workers=options['wsgi_workers'])
+        loop = asyncio.get_running_loop()
+
+        def wsgi_request():
+            environ = {
+                'REQUEST_METHOD': 'GET',
+                'PATH_INFO': path,
+                'QUERY_STRING': query_string,
+                'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'localhost',
+                'HTTP_COOKIE': cookie,
+                'wsgi.version': (1, 0),
+                'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(b''),
+                'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            statuses = []
+            response = handler(environ, lambda status, headers: statuses.append(int(status.split()[0])))
+            try:
+                for chunk in response:
+                    # the worker is blocked while a slow client reads
+                    time.sleep(options['client_delay'])
+            finally:
+                response.close()
+            return statuses[0]
+
+        try:
+            return await self.run_clients(lambda: loop.run_in_executor(executor, wsgi_request), options)
+        finally:
+            executor.shutdown()
+
+    async def run_asgi(self, path, query_string, cookie, options):
+        handler = ASGIHandler()
+
+        async def asgi_request():
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': 'GET',
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': query_string.encode(),
+                'root_path': '',
+                'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 0),
+                'server': ('localhost', 80),
+            }
+            statuses = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                else:
+                    # only this coroutine waits while a slow client reads
+                    await asyncio.sleep(options['client_delay'])
+
+            await handler(scope, receive, send)
+            return statuses[0]
+
+        return await self.run_clients(asgi_request, options)
@@ -0,0 +1,33 @@
+import os
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from stocklist.export import COLUMNAR_BATCH_SIZE, COLUMNAR_FORMATS, write_columnar
+from stocklist.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Writes a Store\'s Items, Lists and ListItems as columnar files, one per table, for analytics tools. Needs pyarrow.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('store_id', type=int)
+        parser.add_argument('directory', help='Directory for items, lists and list_items files, created if needed.')
+        parser.add_argument('--format', choices=list(COLUMNAR_FORMATS), default='parquet', help='Parquet, or Arrow IPC (Feather v2). Default parquet.')
+        parser.add_argument('--batch-size', type=int, default=COLUMNAR_BATCH_SIZE, help='Rows read and written at a time.')
+
+    def handle(self, *args, **options):
+        try:
+            store = Store.objects.get(pk=options['store_id'])
+        except Store.DoesNotExist:
+            raise CommandError('Store {} does not exist.'.format(options['store_id']))
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be at least 1.')
+
+        os.makedirs(options['directory'], exist_ok=True)
+        try:
+            paths = write_columnar(store, options['directory'], format=options['format'], batch_size=options['batch_size'])
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+
+        for path in paths:
+            self.stdout.write('Wrote {}'.format(path))
@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from stocklist.models import User
+from stocklist.stockdata import STOCKDATA_BATCH_SIZE, generate_stockdata
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates Users, each with Stores of Items and Lists of every type, with realistic names and amounts, '
+        'written with bulk inserts. The same --seed generates the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help='Users to create.')
+        parser.add_argument('--stores', type=int, default=1, help='Stores for each User.')
+        parser.add_argument('--items', type=int, default=1000, help='Items in each Store.')
+        parser.add_argument('--lists', type=int, default=10, help='Lists in each Store: a Count, a Delivery and Sales, in turn.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the random names and amounts.')
+        parser.add_argument('--prefix', default='stockdata', help='Usernames are the prefix and a number.')
+        parser.add_argument('--password', default='stockdata', help='Password of every User.')
+        parser.add_argument('--replace', action='store_true', help='Delete existing Users with the generated usernames first.')
+        parser.add_argument('--batch-size', type=int, default=STOCKDATA_BATCH_SIZE, help='Rows in each insert.')
+
+    def handle(self, *args, **options):
+        for option in ['users', 'stores', 'items', 'lists', 'batch_size']:
+            if options[option] < 1:
+                raise CommandError('--{} must be at least 1.'.format(option.replace('_', '-')))
+
+        usernames = ['{}{}'.format(options['prefix'], user_index + 1) for user_index in range(options['users'])]
+        existing = User.objects.filter(username__in=usernames)
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError('Users already exist: {}. Use --replace to delete them first.'.format(
+                    ', '.join(sorted(existing.values_list('username', flat=True)))
+                ))
+            existing.delete()
+
+        start = time.perf_counter()
+        users, stores, list_items = generate_stockdata(
+            options['users'], options['stores'], options['items'], options['lists'],
+            seed=options['seed'], prefix=options['prefix'], password=options['password'], batch_size=options['batch_size'],
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write('Created {} Users, {} Stores, {} Items and {} ListItems in {:.1f}s ({:.0f} ListItems per second).'.format(
+            users, stores, stores * options['items'], list_items, elapsed, list_items / elapsed if elapsed else 0,
+        ))
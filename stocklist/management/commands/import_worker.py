@@ -0,0 +1,40 @@
+import threading
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from stocklist.jobs import JOB_LEASE, JOB_POLL_INTERVAL, requeue_interrupted_jobs, work
+
+
+class Command(BaseCommand):
+    help = 'Runs queued import jobs. Jobs of a worker that has stopped, with no heartbeat for --lease seconds, are run again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=1, help='Number of jobs to run at once.')
+        parser.add_argument('--poll-interval', type=float, default=JOB_POLL_INTERVAL, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty.')
+        parser.add_argument('--lease', type=float, default=JOB_LEASE, help='Seconds without a heartbeat before a running job is requeued.')
+
+    def handle(self, *args, **options):
+        requeued = requeue_interrupted_jobs(options['lease'])
+        if requeued:
+            self.stdout.write('Requeued {} interrupted jobs.'.format(requeued))
+
+        jobs_run = []
+
+        def worker_thread():
+            try:
+                jobs_run.append(work(options['poll_interval'], options['once']))
+            finally:
+                # each thread has its own database connection
+                connection.close()
+
+        if options['threads'] == 1:
+            jobs_run.append(work(options['poll_interval'], options['once']))
+        else:
+            threads = [threading.Thread(target=worker_thread, daemon=True) for _ in range(options['threads'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write('Ran {} jobs.'.format(sum(jobs_run)))
@@ -0,0 +1,139 @@
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+from stocklist.loadtest import locked_total, run_users
+from .benchmark_servers import percentile
+
+
+def summarize_results(results, elapsed):
+    '''
+    Merges the results of every worker process.
+
+    Return: dict - requests, errors, error rate, locked failures and p50, p95 & p99 latency in milliseconds,
+    for each kind of request and in "total"
+    '''
+    latencies = {}
+    errors = {}
+    locked = {}
+    for result in results:
+        for name, values in result["latencies"].items():
+            latencies.setdefault(name, []).extend(values)
+        for name, kinds in result["errors"].items():
+            for kind, count in kinds.items():
+                errors.setdefault(name, {})[kind] = errors.get(name, {}).get(kind, 0) + count
+        for name, count in result["locked"].items():
+            locked[name] = locked.get(name, 0) + count
+    total_errors = {}
+    for kinds in errors.values():
+        for kind, count in kinds.items():
+            total_errors[kind] = total_errors.get(kind, 0) + count
+    latencies["total"] = [value for values in latencies.values() for value in values]
+    errors["total"] = total_errors
+    locked["total"] = sum(locked.values())
+
+    summary = {}
+    for name, values in latencies.items():
+        if not values:
+            continue
+        error_count = sum(errors.get(name, {}).values())
+        summary[name] = {
+            "requests": len(values),
+            "per_second": round(len(values) / elapsed, 1) if elapsed else None,
+            "errors": error_count,
+            "error_rate": round(error_count / len(values), 4),
+            "error_kinds": errors.get(name, {}),
+            "locked": locked.get(name, 0),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 1),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+        }
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        'Load tests a running server from localhost: virtual users log in as generate_stockdata Users and replay '
+        'counting sessions from a pool of processes, each running its users with asyncio. Reports p50, p95 and p99 '
+        'latency, error rates and "database is locked" failures for each kind of request.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='The running server.')
+        parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users.')
+        parser.add_argument('--processes', type=int, default=2, help='Worker processes the virtual users are shared between.')
+        parser.add_argument('--accounts', type=int, default=1, help='Users to log in as, so virtual users share Stores when fewer than --users.')
+        parser.add_argument('--prefix', default='stockdata', help='Usernames are the prefix and a number, as generate_stockdata creates them.')
+        parser.add_argument('--password', default='stockdata', help='Password of every User.')
+        parser.add_argument('--sessions', type=int, default=1, help='Counting sessions each virtual user replays.')
+        parser.add_argument('--counts', type=int, default=1000, help='Items counted in each session.')
+        parser.add_argument('--batch-size', type=int, default=0, help='Send counts to update_list_items in batches of this size, instead of one create_list_item request each.')
+        parser.add_argument('--import-every', type=int, default=500, help='Import a delivery every N counts, 0 never.')
+        parser.add_argument('--export-every', type=int, default=1000, help='Export the Store as CSV every N counts, 0 never.')
+        parser.add_argument('--think-time', type=float, default=0, help='Mean seconds between counts.')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request fails as a timeout.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the Items counted and their amounts.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('--url must be an http:// URL: {}'.format(options['url']))
+        for option in ['users', 'processes', 'accounts', 'sessions', 'counts']:
+            if options[option] < 1:
+                raise CommandError('--{} must be at least 1.'.format(option))
+        user_options = {
+            name: options[name] for name in [
+                'accounts', 'prefix', 'password', 'sessions', 'counts', 'batch_size', 'import_every', 'export_every', 'think_time', 'timeout', 'seed'
+            ]
+        }
+        user_options.update(host=url.hostname, port=url.port or 80)
+
+        processes = min(options['processes'], options['users'])
+        self.stdout.write('{} virtual users as {} accounts, in {} processes, {} sessions of {} counts{}, against {}'.format(
+            options['users'], min(options['accounts'], options['users']), processes, options['sessions'], options['counts'],
+            ' in batches of {}'.format(options['batch_size']) if options['batch_size'] else '', options['url'],
+        ))
+
+        locked_before = locked_total(user_options)
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(run_users, [range(index, options['users'], processes) for index in range(processes)], [user_options] * processes))
+        elapsed = time.perf_counter() - start
+        locked_after = locked_total(user_options)
+
+        failed = [reason for result in results for reason in result["failed"]]
+        summary = summarize_results(results, elapsed)
+        self.report(summary, elapsed)
+        server_locked = None if locked_before is None or locked_after is None else int(locked_after - locked_before)
+        self.stdout.write('"database is locked": {} in responses, {} counted by the server{}'.format(
+            summary.get("total", {}).get("locked", 0),
+            '-' if server_locked is None else server_locked,
+            '' if server_locked is not None else ' (/metrics not available)',
+        ))
+        for reason in sorted(set(failed)):
+            self.stdout.write('{} virtual users stopped: {}'.format(failed.count(reason), reason))
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump({
+                    "options": dict(user_options, users=options['users'], processes=processes, url=options['url']),
+                    "elapsed": round(elapsed, 2),
+                    "server_locked": server_locked,
+                    "failed": failed,
+                    "results": summary,
+                }, output_file, indent=2)
+            self.stdout.write('Results written to {}'.format(options['output']))
+
+    def report(self, summary, elapsed):
+        self.stdout.write('{:18} {:>8} {:>8} {:>7} {:>7} {:>9} {:>9} {:>9}'.format('request', 'count', 'req/s', 'errors', 'locked', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for name, result in summary.items():
+            self.stdout.write('{:18} {:8} {:8.1f} {:6.1%} {:7} {:9.1f} {:9.1f} {:9.1f}'.format(
+                name, result["requests"], result["per_second"] or 0, result["error_rate"], result["locked"],
+                result["p50_ms"], result["p95_ms"], result["p99_ms"],
+            ))
+            if result["error_kinds"]:
+                self.stdout.write('    {}'.format(', '.join('{}: {}'.format(kind, count) for kind, count in sorted(result["error_kinds"].items()))))
+        self.stdout.write('{} requests in {:.1f}s'.format(summary.get("total", {}).get("requests", 0), elapsed))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stocklist.models import Store
+from stocklist.stock import check_balances, rebuild_balances
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Item balances from ListItems, for every Store by default. With --check, reports balances that differ instead.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('store_ids', nargs='*', type=int, help='Stores to rebuild, default all.')
+        parser.add_argument('--check', action='store_true', help='Compare balances with ListItems without changing them.')
+
+    def handle(self, *args, **options):
+        stores = Store.objects.order_by('id')
+        if options['store_ids']:
+            stores = stores.filter(pk__in=options['store_ids'])
+            missing = set(options['store_ids']) - set(stores.values_list('id', flat=True))
+            if missing:
+                raise CommandError('Stores do not exist: {}'.format(', '.join(str(store_id) for store_id in sorted(missing))))
+
+        differences = 0
+        for store in stores:
+            if not options['check']:
+                self.stdout.write('Store {}: rebuilt {} balances.'.format(store.pk, rebuild_balances(store)))
+                continue
+            for computed, balance in check_balances(store):
+                differences += 1
+                self.stdout.write('Store {} Item {}: balance {} + {} - {}, ListItems {} + {} - {}'.format(
+                    store.pk, computed['item_id'],
+                    balance['last_count'], balance['additions'], balance['subtractions'],
+                    computed['last_count'], computed['additions'], computed['subtractions'],
+                ))
+
+        if differences:
+            raise CommandError('{} balances differ, run rebuild_balances to fix them.'.format(differences))
+        if options['check']:
+            self.stdout.write('Balances match.')
@@ -0,0 +1,71 @@
+import csv
+from django.core.management.base import BaseCommand, CommandError
+
+from stocklist.models import Store, List
+from stocklist.stock import VARIANCE_SORT_FIELDS, last_count_list, parse_threshold, variance_report
+
+
+REPORT_FIELDS = ['name', 'expected', 'counted', 'variance', 'percentage']
+
+
+def threshold_argument(value):
+    try:
+        return parse_threshold(value)
+    except ValueError as e:
+        raise CommandError(e)
+
+
+class Command(BaseCommand):
+    help = 'Reports the variance between expected and counted stock for each Item in a Store, at its latest Count by default.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('store_id', type=int)
+        parser.add_argument('--list', type=int, dest='list_id', help='Count List id, default the latest Count.')
+        parser.add_argument(
+            '--sort', default='variance',
+            help='One of {}, "-" prefix for descending. Default variance, largest shortfall first.'.format(', '.join(VARIANCE_SORT_FIELDS))
+        )
+        parser.add_argument('--threshold', type=threshold_argument, help='Only Items with a variance at least this size.')
+        parser.add_argument('--threshold-percentage', type=threshold_argument, help='Only Items with a percentage variance at least this size.')
+        parser.add_argument('--csv', action='store_true', help='Write CSV rather than a table.')
+
+    def handle(self, *args, **options):
+        try:
+            store = Store.objects.get(pk=options['store_id'])
+        except Store.DoesNotExist:
+            raise CommandError('Store {} does not exist.'.format(options['store_id']))
+
+        if options['list_id'] is not None:
+            try:
+                count_list = List.counts.get(store=store, pk=options['list_id'])
+            except List.DoesNotExist:
+                raise CommandError('Count {} does not exist in Store {}.'.format(options['list_id'], store.pk))
+        else:
+            count_list = last_count_list(store)
+            if count_list is None:
+                raise CommandError('Store {} has no Count.'.format(store.pk))
+
+        try:
+            report = variance_report(
+                store, count_list, sort=options['sort'],
+                threshold=options['threshold'], threshold_percentage=options['threshold_percentage'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        if options['csv']:
+            writer = csv.writer(self.stdout, lineterminator='\n')
+            writer.writerow(REPORT_FIELDS)
+            for row in report['items']:
+                writer.writerow(['' if row[field] is None else row[field] for field in REPORT_FIELDS])
+            return
+
+        self.stdout.write('{} - {} ({} Items)'.format(store.name, report['name'], len(report['items'])))
+        self.stdout.write('{:40} {:>12} {:>12} {:>12} {:>10}'.format('Item', 'Expected', 'Counted', 'Variance', '%'))
+        for row in report['items']:
+            self.stdout.write('{:40} {:>12} {:>12} {:>12} {:>10}'.format(
+                row['name'][:40], row['expected'], row['counted'], row['variance'],
+                '' if row['percentage'] is None else row['percentage'],
+            ))
+        totals = report['totals']
+        self.stdout.write('{:40} {:>12} {:>12} {:>12}'.format('Total', totals['expected'], totals['counted'], totals['variance']))
@@ -0,0 +1,195 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from itertools import chain
+
+from .models import Item
+
+
+MATCH_THRESHOLD = 0.7
+MATCH_CANDIDATES = 3
+MAX_IMPORT_MATCHES = 100
+
+
+def normalize_name(name):
+    '''
+    Normalizes an Item name for matching: case, accents, punctuation and repeated spaces are ignored,
+    so "Absolut Vodka 70CL BTL" and "absolut  vodka 70cl btl." are the same name.
+
+    Return: str
+    '''
+    name = unicodedata.normalize('NFKD', name.casefold())
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[\W_]+', ' ', name).split())
+
+
+def trigrams(normalized_name):
+    '''
+    The trigrams of a normalized name, with each word padded as pg_trgm does: two spaces before and one after.
+
+    Return: frozenset of str
+    '''
+    grams = set()
+    for word in normalized_name.split():
+        padded = '  {} '.format(word)
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def similarity(grams, other_grams):
+    '''
+    Return: float - shared trigrams over all trigrams (Jaccard), from 0 to 1
+    '''
+    shared = len(grams & other_grams)
+    return shared / (len(grams) + len(other_grams) - shared) if shared else 0.0
+
+
+def min_shared(size, threshold):
+    '''
+    Return: int - the trigrams a name of size trigrams must share with any other to reach threshold similarity
+    '''
+    return max(1, math.ceil(round(threshold * size, 9)))
+
+
+def min_overlap(size, other_size, threshold):
+    '''
+    Return: int - the trigrams two names of these sizes must share to reach threshold similarity
+    '''
+    return max(1, math.ceil(round(threshold / (1 + threshold) * (size + other_size), 9)))
+
+
+class ItemIndex:
+    '''
+    The Items of a Store by normalized name, for import.
+
+    Similar names are found with a trigram index that is only built when it is first needed (PPJoin):
+    trigrams are ordered rarest first, by how many of the Store's Items had them when the index was built,
+    and each Item is only indexed under the first trigrams that it could not reach threshold similarity without.
+    Two names that are similar enough share one of those trigrams, so common trigrams ("vod", "70c") are rarely
+    looked up. The positions of the shared trigrams bound how many more the names could share, so most Items
+    found are dropped without comparing them, and a name is compared with a few Items rather than every Item.
+    '''
+    def __init__(self, items=(), threshold=MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.ids = {}
+        self.names = {}
+        self.grams = None
+        self.postings = None
+        self.frequency = None
+        for item_id, name in items:
+            self.add(item_id, name)
+
+    @classmethod
+    def for_store(cls, store, threshold=MATCH_THRESHOLD):
+        '''
+        Builds the index for every Item in the Store with a single query.
+        Items whose names normalize the same map to the oldest of them.
+
+        Return: ItemIndex
+        '''
+        return cls(Item.objects.filter(store=store).order_by('id').values_list('id', 'name'), threshold=threshold)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, name):
+        '''
+        Return: int or None - the id of the Item with the same normalized name
+        '''
+        return self.ids.get(normalize_name(name))
+
+    def add(self, item_id, name):
+        normalized = normalize_name(name)
+        self.ids.setdefault(normalized, item_id)
+        self.names[item_id] = name
+        if self.postings is not None:
+            self.add_trigrams(item_id, trigrams(normalized))
+
+    def prefix(self, grams):
+        '''
+        Return: list - the rarest trigrams, enough that a similar name must share one of them
+        '''
+        ordered = sorted(grams, key=lambda gram: (self.frequency.get(gram, 0), gram))
+        return ordered[:len(ordered) - min_shared(len(ordered), self.threshold) + 1]
+
+    def add_trigrams(self, item_id, grams):
+        self.grams[item_id] = grams
+        for position, gram in enumerate(self.prefix(grams)):
+            self.postings.setdefault(gram, []).append((item_id, position, len(grams)))
+
+    def build_trigrams(self):
+        self.grams = {}
+        self.postings = {}
+        # only the Item each normalized name maps to is matched
+        item_grams = {item_id: trigrams(normalized) for normalized, item_id in self.ids.items()}
+        # the trigram order is fixed here, so Items added later are indexed in the same order
+        self.frequency = Counter(chain.from_iterable(item_grams.values()))
+        for item_id, grams in item_grams.items():
+            self.add_trigrams(item_id, grams)
+
+    def candidates(self, name, limit=MATCH_CANDIDATES):
+        '''
+        The Items most similar to name, with a trigram similarity of at least threshold.
+
+        Return: list of (item id, score) tuples, best first
+        '''
+        if self.postings is None:
+            self.build_trigrams()
+
+        grams = trigrams(normalize_name(name))
+        if not grams:
+            return []
+        size = len(grams)
+        min_size = self.threshold * size
+        max_size = size / self.threshold
+
+        required = {
+            other_size: min_overlap(size, other_size, self.threshold)
+            for other_size in range(math.ceil(round(min_size, 9)), math.floor(round(max_size, 9)) + 1)
+        }
+
+        # shared prefix trigrams for each Item found, -1 once it can't share enough
+        shared = {}
+        for position, gram in enumerate(self.prefix(grams)):
+            remaining = size - position
+            for item_id, other_position, other_size in self.postings.get(gram, ()):
+                if other_size not in required:
+                    continue
+                count = shared.get(item_id, 0)
+                if count < 0:
+                    continue
+                if count + min(remaining, other_size - other_position) >= required[other_size]:
+                    shared[item_id] = count + 1
+                else:
+                    shared[item_id] = -1
+
+        scores = []
+        for item_id, count in shared.items():
+            if count > 0:
+                score = similarity(grams, self.grams[item_id])
+                if score >= self.threshold:
+                    scores.append((item_id, score))
+        scores.sort(key=lambda score: (-score[1], score[0]))
+        return scores[:limit]
+
+    def matches(self, names, limit=MATCH_CANDIDATES):
+        '''
+        Candidates for each name without an Item of the same normalized name.
+
+        Return: list of dicts - "name", "candidates": [{"item_id", "name", "score"}]
+        '''
+        matches = []
+        for name in names:
+            if self.get(name) is not None:
+                continue
+            candidates = self.candidates(name, limit=limit)
+            if candidates:
+                matches.append({
+                    "name": name,
+                    "candidates": [
+                        {"item_id": item_id, "name": self.names[item_id], "score": round(score, 2)}
+                        for item_id, score in candidates
+                    ],
+                })
+        return matches
@@ -0,0 +1,345 @@
+import asyncio
+import atexit
+import bisect
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import OperationalError
+
+from .timing import install, start_timing, stop_timing
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_FLUSH_INTERVAL = 5
+METRICS_METHODS = ['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS']
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+IMPORT_SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ROWS_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+ROWS_PER_SECOND_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def format_value(value):
+    '''
+    Return: str - a sample value or bucket bound in the Prometheus text format
+    '''
+    if value == math.inf:
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labelnames, labels):
+    '''
+    Return: str - label pairs in the Prometheus text format, without braces
+    '''
+    pairs = []
+    for name in labelnames:
+        value = str(labels[name]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('{}="{}"'.format(name, value))
+    return ','.join(pairs)
+
+
+def sample_line(name, labels, value):
+    return '{}{{{}}} {}'.format(name, labels, format_value(value)) if labels else '{} {}'.format(name, format_value(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.label_strings = {}
+
+    def format_labels(self, labels):
+        '''
+        Return: str - the labels in the Prometheus text format, formatted once for each set of values
+        '''
+        values = tuple(labels[name] for name in self.labelnames)
+        label_string = self.label_strings.get(values)
+        if label_string is None:
+            label_string = self.label_strings[values] = format_labels(self.labelnames, labels)
+        return label_string
+
+
+class Counter(Metric):
+    '''
+    A count that only goes up, such as requests or rows imported.
+    '''
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.registry.add(self.name, self.format_labels(labels), [('', amount)])
+
+    def lines(self, samples):
+        '''
+        Return: list of str - each labels' sample, from {labels: {sample: value}}
+        '''
+        return [sample_line(self.name, labels, values.get('', 0)) for labels, values in sorted(samples.items())]
+
+
+class Histogram(Metric):
+    '''
+    Observations, such as latencies, counted in buckets, with their sum and count.
+    Each observation is added to its own bucket only, the cumulative buckets are summed when collected.
+    '''
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.bucket_names = [format_value(bucket) for bucket in self.buckets]
+
+    def observe(self, value, **labels):
+        # the first bucket with an upper bound >= value
+        bucket = bisect.bisect_left(self.buckets, value)
+        self.registry.add(self.name, self.format_labels(labels), [
+            (self.bucket_names[bucket], 1),
+            ('sum', value),
+            ('count', 1),
+        ])
+
+    def lines(self, samples):
+        lines = []
+        for labels, values in sorted(samples.items()):
+            cumulative = 0
+            for bucket in self.bucket_names:
+                cumulative += values.get(bucket, 0)
+                le = 'le="{}"'.format(bucket)
+                lines.append(sample_line(self.name + '_bucket', '{},{}'.format(labels, le) if labels else le, cumulative))
+            lines.append(sample_line(self.name + '_sum', labels, values.get('sum', 0)))
+            lines.append(sample_line(self.name + '_count', labels, values.get('count', 0)))
+        return lines
+
+
+class Registry:
+    '''
+    The metrics of this process. Each sample is a (metric name, labels, sample) key, added to a dict under a lock
+    that is only held for the addition, so threads rarely wait for it.
+
+    With METRICS_DB set, samples are added to a SQLite file shared by every worker process: each process adds
+    what it counted since its last flush from a background thread every METRICS_FLUSH_INTERVAL seconds, when scraped,
+    and at exit, so requests never wait for the file. The file holds the totals, so a scrape of any process sees every process' counts, up to the interval.
+    Without METRICS_DB, each process only reports its own counts.
+    '''
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}
+        self.lock = threading.Lock()
+        self.flusher = None
+        self.stopped = threading.Event()
+
+    def counter(self, name, documentation, labelnames=()):
+        self.metrics[name] = Counter(self, name, documentation, labelnames)
+        return self.metrics[name]
+
+    def histogram(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.metrics[name] = Histogram(self, name, documentation, labelnames, buckets)
+        return self.metrics[name]
+
+    def add(self, name, labels, samples):
+        with self.lock:
+            for sample, amount in samples:
+                key = (name, labels, sample)
+                self.values[key] = self.values.get(key, 0) + amount
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def after_fork(self):
+        # counts from before a fork belong to the parent process
+        self.lock = threading.Lock()
+        self.values = {}
+        # threads don't survive a fork, the child starts its own flusher
+        self.flusher = None
+        self.stopped = threading.Event()
+
+    def connect(self, path):
+        connection = sqlite3.connect(str(path), timeout=10)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS metric ('
+            'name TEXT NOT NULL, labels TEXT NOT NULL, sample TEXT NOT NULL, value REAL NOT NULL, '
+            'PRIMARY KEY (name, labels, sample))'
+        )
+        return connection
+
+    def flush(self):
+        '''
+        Adds the samples counted since the last flush to METRICS_DB, in one transaction.
+        If the file can't be written, they are kept for the next flush.
+        '''
+        path = getattr(settings, 'METRICS_DB', None)
+        if not path:
+            return
+        with self.lock:
+            values, self.values = self.values, {}
+        if not values:
+            return
+
+        try:
+            connection = self.connect(path)
+            try:
+                with connection:
+                    connection.executemany(
+                        'INSERT INTO metric (name, labels, sample, value) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (name, labels, sample) DO UPDATE SET value = value + excluded.value',
+                        [(name, labels, sample, value) for (name, labels, sample), value in values.items()],
+                    )
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            logger.exception("Could not write metrics to %s", path)
+            for (name, labels, sample), value in values.items():
+                self.add(name, labels, [(sample, value)])
+
+    def start_flusher(self):
+        '''
+        Starts the thread that flushes every METRICS_FLUSH_INTERVAL seconds, once per process, with METRICS_DB set.
+        '''
+        if self.flusher is not None or not getattr(settings, 'METRICS_DB', None):
+            return
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self.flush_every_interval, name='stocklist-metrics-flush', daemon=True)
+                self.flusher.start()
+
+    def flush_every_interval(self):
+        while not self.stopped.wait(METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+    def collect(self):
+        '''
+        Return: dict - {metric name: {labels: {sample: value}}}, every process' totals with METRICS_DB
+        '''
+        path = getattr(settings, 'METRICS_DB', None)
+        if path:
+            self.flush()
+            connection = self.connect(path)
+            try:
+                rows = connection.execute('SELECT name, labels, sample, value FROM metric').fetchall()
+            finally:
+                connection.close()
+        else:
+            with self.lock:
+                rows = [(name, labels, sample, value) for (name, labels, sample), value in self.values.items()]
+
+        samples = {}
+        for name, labels, sample, value in rows:
+            samples.setdefault(name, {}).setdefault(labels, {})[sample] = value
+        return samples
+
+    def exposition(self):
+        '''
+        Return: str - every metric in the Prometheus text format
+        '''
+        samples = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            lines += metric.lines(samples.get(name, {}))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.after_fork)
+
+REQUESTS = REGISTRY.counter('stocklist_requests_total', 'Requests by URL name, method and status.', ['view', 'method', 'status'])
+REQUEST_SECONDS = REGISTRY.histogram('stocklist_request_duration_seconds', 'Request latency by URL name.', ['view'], SECONDS_BUCKETS)
+REQUEST_QUERIES = REGISTRY.histogram('stocklist_request_queries', 'Database queries per request by URL name.', ['view'], QUERY_BUCKETS)
+IMPORT_ROWS = REGISTRY.counter('stocklist_import_rows_total', 'Rows saved by imports.')
+IMPORT_ROWS_SKIPPED = REGISTRY.counter('stocklist_import_rows_skipped_total', 'Rows skipped by imports, without an Item name.')
+IMPORT_SECONDS = REGISTRY.histogram('stocklist_import_duration_seconds', 'Time to save an import.', buckets=IMPORT_SECONDS_BUCKETS)
+IMPORT_ROWS_PER_SECOND = REGISTRY.histogram('stocklist_import_rows_per_second', 'Rows saved per second by each import.', buckets=ROWS_PER_SECOND_BUCKETS)
+DATABASE_LOCKED = REGISTRY.counter('stocklist_database_locked_total', 'Requests whose view failed with "database is locked", by URL name.', ['view'])
+BATCH_UPDATE_ROWS = REGISTRY.histogram('stocklist_batch_update_rows', 'ListItems created or updated by each batch count update.', buckets=ROWS_BUCKETS)
+
+
+def observe_import(imported, skipped, seconds):
+    IMPORT_ROWS.inc(imported)
+    IMPORT_ROWS_SKIPPED.inc(skipped)
+    IMPORT_SECONDS.observe(seconds)
+    if seconds > 0 and imported:
+        IMPORT_ROWS_PER_SECOND.observe(imported / seconds)
+
+
+def observe_batch_update(rows):
+    BATCH_UPDATE_ROWS.observe(rows)
+
+
+def url_name(request):
+    resolver_match = getattr(request, 'resolver_match', None)
+    return resolver_match.url_name if resolver_match is not None and resolver_match.url_name else 'unmatched'
+
+
+class MetricsMiddleware:
+    '''
+    Counts requests, and observes their latency and query count, by the URL name of their view,
+    "unmatched" for requests no URL matched, and counts views that failed with "database is locked".
+    With METRICS off, Django leaves the middleware out.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+        install()
+
+        if asyncio.iscoroutinefunction(get_response):
+            # marks the middleware as async for Django, so it is not run in a thread
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timing, token = start_timing()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_timing(token)
+        self.record(request, response, timing)
+        return response
+
+    async def __acall__(self, request):
+        timing, token = start_timing()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_timing(token)
+        self.record(request, response, timing)
+        return response
+
+    def process_exception(self, request, exception):
+        # SQLite gave up waiting for another connection's write lock
+        if isinstance(exception, OperationalError) and 'database is locked' in str(exception):
+            DATABASE_LOCKED.inc(view=url_name(request))
+        return None
+
+    def record(self, request, response, timing):
+        seconds = time.perf_counter() - timing.start
+        view = url_name(request)
+        method = request.method if request.method in METRICS_METHODS else 'other'
+
+        REQUESTS.inc(view=view, method=method, status=response.status_code)
+        REQUEST_SECONDS.observe(seconds, view=view)
+        REQUEST_QUERIES.observe(timing.queries, view=view)
+        REGISTRY.start_flusher()
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.11 on 2026-10-18 17:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0060_alter_list_date_added'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PE', 'Pending'), ('RU', 'Running'), ('DO', 'Done'), ('FA', 'Failed')], default='PE', max_length=2)),
+                ('lists', models.JSONField(default=list, help_text='import_items data, or the Lists to create for a CSV file.')),
+                ('csv_file', models.FileField(blank=True, upload_to='import_jobs/')),
+                ('name_fields', models.JSONField(blank=True, default=list)),
+                ('amount_field', models.CharField(blank=True, max_length=80)),
+                ('rows_processed', models.PositiveIntegerField(default=0)),
+                ('rows_skipped', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('store', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='stocklist.store')),
+            ],
+        ),
+    ]
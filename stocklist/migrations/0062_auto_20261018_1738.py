@@ -0,0 +1,24 @@
+# Generated by Django 3.2.11 on 2026-10-18 17:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0061_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='date_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text="The date the Store's Items, Lists or ListItems last changed."),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text="Incremented whenever the Store's Items, Lists or ListItems change."),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.11 on 2026-10-18 17:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0062_auto_20261018_1738'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Deletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('items', 'Item'), ('lists', 'List'), ('list_items', 'ListItem')], max_length=10)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('version', models.PositiveBigIntegerField(help_text='The Store version when the object was deleted.')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='The Store version when this Item last changed.'),
+        ),
+        migrations.AddField(
+            model_name='list',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='The Store version when this List, or its count, last changed.'),
+        ),
+        migrations.AddField(
+            model_name='listitem',
+            name='version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False, help_text='The Store version when this ListItem last changed.'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['store', 'version'], name='stocklist_i_store_i_77cadd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='list',
+            index=models.Index(fields=['store', 'version'], name='stocklist_l_store_i_2eb2a3_idx'),
+        ),
+        migrations.AddField(
+            model_name='deletion',
+            name='store',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='deletions', to='stocklist.store'),
+        ),
+        migrations.AddIndex(
+            model_name='deletion',
+            index=models.Index(fields=['store', 'version'], name='stocklist_d_store_i_ab91ae_idx'),
+        ),
+    ]
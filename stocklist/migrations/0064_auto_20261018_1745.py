@@ -0,0 +1,43 @@
+# Generated by Django 3.2.11 on 2026-10-18 17:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0063_auto_20261018_1741'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listitem',
+            name='date_counted',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the amount was counted, used to order conflicting counts.', null=True),
+        ),
+        migrations.AddField(
+            model_name='listitem',
+            name='op_id',
+            field=models.CharField(blank=True, editable=False, help_text='The SyncOperation that set the amount, blank if it was set on the server.', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='SyncOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('op_id', models.CharField(help_text='Generated by the client, unique for Store.', max_length=64)),
+                ('list_id', models.BigIntegerField(blank=True, null=True)),
+                ('item_id', models.BigIntegerField(blank=True, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=1, max_digits=7, null=True)),
+                ('date_counted', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('AP', 'Applied'), ('SU', 'Superseded'), ('RE', 'Rejected')], max_length=2)),
+                ('message', models.CharField(blank=True, max_length=200)),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+                ('store', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='sync_operations', to='stocklist.store')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='syncoperation',
+            constraint=models.UniqueConstraint(fields=('store', 'op_id'), name='unique op_id store'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.11 on 2026-10-18 18:03
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# List types as they were when this migration was written
+COUNT = 'CO'
+ADDITION = 'AD'
+SUBTRACTION = 'SU'
+
+
+def fold_balances(rows):
+    '''
+    A frozen copy of stocklist.models.fold_balances(): folds ListItem rows of (item id, list id, list type, amount),
+    in List (date_added, id) order, into each Item's last Count and the Additions & Subtractions after it.
+    '''
+    balances = {}
+    for item_id, list_id, list_type, amount in rows:
+        balance = balances.setdefault(item_id, {"last_count": None, "last_count_list_id": None, "additions": Decimal(0), "subtractions": Decimal(0)})
+        if list_type == COUNT:
+            balance.update(last_count=amount, last_count_list_id=list_id, additions=Decimal(0), subtractions=Decimal(0))
+        elif list_type == ADDITION:
+            balance["additions"] += amount
+        elif list_type == SUBTRACTION:
+            balance["subtractions"] += amount
+    return balances
+
+
+def create_balances(apps, schema_editor):
+    Item = apps.get_model('stocklist', 'Item')
+    ListItem = apps.get_model('stocklist', 'ListItem')
+    ItemBalance = apps.get_model('stocklist', 'ItemBalance')
+
+    rows = ListItem.objects.order_by('list__date_added', 'list_id').values_list('item_id', 'list_id', 'list__type', 'amount')
+    store_ids = dict(Item.objects.values_list('id', 'store_id'))
+    ItemBalance.objects.bulk_create([
+        ItemBalance(
+            item_id=item_id,
+            store_id=store_ids[item_id],
+            on_hand=(balance['last_count'] or 0) + balance['additions'] - balance['subtractions'],
+            **balance
+        ) for item_id, balance in fold_balances(rows).items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0064_auto_20261018_1745'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemBalance',
+            fields=[
+                ('item', models.OneToOneField(editable=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='stocklist.item')),
+                ('last_count', models.DecimalField(blank=True, decimal_places=1, max_digits=12, null=True)),
+                ('additions', models.DecimalField(decimal_places=1, default=Decimal('0'), max_digits=12)),
+                ('subtractions', models.DecimalField(decimal_places=1, default=Decimal('0'), max_digits=12)),
+                ('on_hand', models.DecimalField(decimal_places=1, default=Decimal('0'), max_digits=12)),
+                ('last_count_list', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='stocklist.list')),
+                ('store', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='stocklist.store')),
+            ],
+        ),
+        migrations.RunPython(create_balances, migrations.RunPython.noop),
+    ]
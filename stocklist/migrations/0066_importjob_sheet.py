@@ -0,0 +1,28 @@
+# Generated by Django 3.2.11 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0065_itembalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='header_row',
+            field=models.PositiveIntegerField(default=1, help_text='The XLSX header row, counting from 1.'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='sheet',
+            field=models.CharField(blank=True, help_text='The XLSX sheet, blank for the first.', max_length=31),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='csv_file',
+            field=models.FileField(blank=True, help_text='A CSV or XLSX file.', upload_to='import_jobs/'),
+        ),
+    ]
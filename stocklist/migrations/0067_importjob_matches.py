@@ -0,0 +1,18 @@
+# Generated by Django 3.2.11 on 2026-10-18 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0066_importjob_sheet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='matches',
+            field=models.JSONField(blank=True, default=list, help_text='Similar existing Items for new Item names.'),
+        ),
+    ]
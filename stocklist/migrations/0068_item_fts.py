@@ -0,0 +1,57 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+# frozen here, as they were when this migration was written, rather than imported from stocklist.search
+FTS_TABLE = 'stocklist_item_fts'
+# an external content FTS5 table over Item names: the trigram tokenizer indexes every substring of 3+ characters
+CREATE_FTS_SQL = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5(name, content='stocklist_item', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON stocklist_item BEGIN "
+    "INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON stocklist_item BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER {fts}_update AFTER UPDATE OF name ON stocklist_item BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END",
+    "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+]
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS {fts}_insert",
+    "DROP TRIGGER IF EXISTS {fts}_delete",
+    "DROP TRIGGER IF EXISTS {fts}_update",
+    "DROP TABLE IF EXISTS {fts}",
+]
+
+
+def create_item_fts(apps, schema_editor):
+    # SQLite only, and only if it was built with FTS5: search falls back to scanning Item names
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts5_check USING fts5(name, tokenize='trigram')")
+        except OperationalError:
+            return
+        cursor.execute("DROP TABLE temp.fts5_check")
+        for sql in CREATE_FTS_SQL:
+            cursor.execute(sql.format(fts=FTS_TABLE))
+
+
+def drop_item_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in DROP_FTS_SQL:
+            cursor.execute(sql.format(fts=FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0067_importjob_matches'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_item_fts, drop_item_fts),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.11 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0068_item_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, help_text='Last sign of life from the worker running the job.', null=True),
+        ),
+    ]
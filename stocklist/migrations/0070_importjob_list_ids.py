@@ -0,0 +1,18 @@
+# Generated by Django 3.2.11 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocklist', '0069_importjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='list_ids',
+            field=models.JSONField(blank=True, default=list, help_text='The Lists created so far, in order, to resume an interrupted job.'),
+        ),
+    ]
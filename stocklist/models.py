@@ -1,8 +1,11 @@
 from decimal import Decimal
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connection, models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .broadcast import publish_changed, publish_list_items
 
 
 MAX_STORE_NAME_LENGTH = 20
@@ -12,15 +15,48 @@ MAX_ITEM_NAME_LENGTH = 80
 # MAX_ITEM_ORIGIN_NAME_LENGTH = 30
 MIN_LIST_ITEM_AMOUNT = Decimal('0')
 MAX_LIST_ITEM_AMOUNT = Decimal('100000')
+MAX_OP_ID_LENGTH = 64
+MAX_BALANCE_DIGITS = 12
+MAX_SHEET_NAME_LENGTH = 31
 
 
 class User(AbstractUser):
     pass
 
 
+class StoreQuerySet(models.QuerySet):
+    def bump_version(self):
+        '''
+        Marks the Items, Lists and ListItems of the Stores as changed, without reading them.
+
+        Return: int - number of Stores updated
+        '''
+        return self.update(version=models.F('version') + 1, date_modified=timezone.now())
+
+    def next_version(self):
+        '''
+        Bumps the version of a single Store and reads it back, to stamp a write with.
+        Call it in the same transaction as the write, so the Store stays locked until the write is committed.
+
+        Return: int - the new version
+        '''
+        self.bump_version()
+        return self.values_list('version', flat=True).get()
+
 class Store(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="stores")
     name = models.CharField(max_length=MAX_STORE_NAME_LENGTH)
+    version = models.PositiveBigIntegerField(
+        default=0, 
+        editable=False, 
+        help_text="Incremented whenever the Store's Items, Lists or ListItems change."
+    )
+    date_modified = models.DateTimeField(
+        default=timezone.now, 
+        editable=False, 
+        help_text="The date the Store's Items, Lists or ListItems last changed."
+    )
+    objects = StoreQuerySet.as_manager()
 
     class Meta:
         '''Store name must be unique for User.'''
@@ -31,6 +67,74 @@ class Store(models.Model):
     def __str__(self):
         return self.name
 
+    def etag(self, *variant):
+        '''
+        An ETag for the Store's Items, Lists and ListItems, one for each variant of a response.
+
+        Return: str
+        '''
+        return '"{}"'.format('-'.join(str(part) for part in [self.id, self.version, *variant]))
+
+    def serialize_items(self):
+        '''
+        Serializes Items with their ListItems, and Lists with their counts, with 3 queries.
+
+        Return: dict
+        '''
+        items = Item.objects.filter(store=self).prefetch_related("list_items").order_by('id')
+        return {
+            'items' : [item.serialize() for item in items],
+            'lists' : [list.serialize() for list in self.lists.with_counts()]
+        }
+
+    def serialize_matrix(self):
+        '''
+        Serializes Items and Lists as parallel arrays, with ListItem amounts in a dense row-major 2-D array:
+        one row per Item, one column per List, None where the Item is not in the List.
+        All amounts are read with a single query.
+
+        Return: dict
+        '''
+        items = Item.objects.filter(store=self).order_by('id').values_list('id', 'name')
+        item_ids = [item_id for item_id, name in items]
+        item_names = [name for item_id, name in items]
+        lists = self.lists.order_by('id')
+
+        rows = {item_id: index for index, item_id in enumerate(item_ids)}
+        columns = {list.id: index for index, list in enumerate(lists)}
+        amounts = [[None] * len(columns) for item_id in item_ids]
+        counts = [0] * len(columns)
+        for item_id, list_id, amount in ListItem.objects.filter(list__store=self).values_list('item_id', 'list_id', 'amount'):
+            amounts[rows[item_id]][columns[list_id]] = amount
+            counts[columns[list_id]] += 1
+
+        return {
+            "item_ids": item_ids,
+            "item_names": item_names,
+            "lists": [list.serialize(count=count) for list, count in zip(lists, counts)],
+            "amounts": amounts,
+        }
+
+    def serialize_changes(self, since):
+        '''
+        Serializes the Items, Lists and ListItems created, updated or deleted after version since,
+        with a query for each. Deleting a List also deletes its ListItems, which are not listed.
+
+        Return: dict
+        '''
+        deleted = {model: [] for model, display in Deletion.MODEL_CHOICES}
+        for model, object_id in self.deletions.filter(version__gt=since).order_by('version').values_list('model', 'object_id'):
+            deleted[model].append(object_id)
+
+        return {
+            "version": self.version,
+            "since": since,
+            "items": list(self.items.filter(version__gt=since).order_by('id').values('id', 'name')),
+            "lists": [list.serialize() for list in self.lists.filter(version__gt=since).order_by('id').with_counts()],
+            "list_items": list(ListItem.objects.filter(list__store=self, version__gt=since).order_by('id').values('id', 'list_id', 'item_id', 'amount')),
+            "deleted": deleted,
+        }
+
 
 class AdditionListManager(models.Manager):
     def get_queryset(self):
@@ -59,6 +163,15 @@ class CountListManager(models.Manager):
         '''
         return super().get_queryset().filter(type='CO')
 
+class ListQuerySet(models.QuerySet):
+    def with_counts(self):
+        '''
+        Annotates each List with list_item_count, counted in the same query.
+
+        Return: QuerySet
+        '''
+        return self.annotate(list_item_count=models.Count('list_items'))
+
 class List(models.Model):
     ADDITION = 'AD'
     SUBTRACTION = 'SU'
@@ -77,31 +190,70 @@ class List(models.Model):
         auto_now_add=True, 
         help_text="The date these items were added/removed from the Store."
     )
-    objects = models.Manager()
+    version = models.PositiveBigIntegerField(
+        default=0, 
+        editable=False, 
+        help_text="The Store version when this List, or its count, last changed."
+    )
+    objects = ListQuerySet.as_manager()
     additions = AdditionListManager()
     subtractions = SubtractionListManager()
     counts = CountListManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['store', 'version']),
+        ]
+
     def __str__(self):
         return self.name
     
     def save(self, *args, **kwargs): # Save or Clean??
         if not [i for i in List.LIST_TYPE_CHOICES if self.type in i]:
             raise ValidationError({'type': ["Invalid Type",]})
-        super(List, self).save(*args, **kwargs)
+        with transaction.atomic():
+            self.version = Store.objects.filter(pk=self.store_id).next_version()
+            super(List, self).save(*args, **kwargs)
+            publish_changed(self.store_id, self.version)
 
-    def serialize(self):
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            version = Store.objects.filter(pk=self.store_id).next_version()
+            Deletion.objects.create(store_id=self.store_id, model=Deletion.LIST, object_id=self.pk, version=version)
+            publish_changed(self.store_id, version)
+            position = self.position
+            changes = [(item_id, amount, None) for item_id, amount in self.list_items.values_list('item_id', 'amount')]
+            deleted = super(List, self).delete(*args, **kwargs)
+            ItemBalance.objects.apply_changes(self.store_id, self.type, position, changes)
+            return deleted
+
+    @property
+    def position(self):
+        '''The order Lists are applied to stock: (date_added, id).'''
+        return (self.date_added, self.pk)
+
+    def serialize(self, count=None):
+        '''
+        count defaults to the list_item_count annotation (see ListQuerySet.with_counts), or a count query.
+        '''
+        if count is None:
+            count = getattr(self, 'list_item_count', None)
         return {
             "id": self.id,
             "name": self.name,
             "type": self.get_type_display(),
             # TODO date
-            "count":self.list_items.count(),
+            "count":self.list_items.count() if count is None else count,
         }
 
 class Item(models.Model):
     store = models.ForeignKey(Store, editable=False, on_delete=models.CASCADE, related_name="items")
     name = models.CharField(max_length=MAX_ITEM_NAME_LENGTH)
+    version = models.PositiveBigIntegerField(
+        default=0, 
+        editable=False, 
+        help_text="The Store version when this Item last changed."
+    )
     # spare cols?
 
     class Meta:
@@ -109,15 +261,38 @@ class Item(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['store', 'name',], name='unique name store')
         ]
+        indexes = [
+            models.Index(fields=['store', 'version']),
+        ]
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.version = Store.objects.filter(pk=self.store_id).next_version()
+            super(Item, self).save(*args, **kwargs)
+            publish_changed(self.store_id, self.version)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            version = Store.objects.filter(pk=self.store_id).next_version()
+            Deletion.objects.create(store_id=self.store_id, model=Deletion.ITEM, object_id=self.pk, version=version)
+            # the Item's ListItems are deleted with it, which changes their Lists' counts
+            list_items = list(self.list_items.values_list('id', 'list_id'))
+            List.objects.filter(pk__in={list_id for list_item_id, list_id in list_items}).update(version=version)
+            Deletion.objects.bulk_create([
+                Deletion(store_id=self.store_id, model=Deletion.LIST_ITEM, object_id=list_item_id, version=version)
+                for list_item_id, list_id in list_items
+            ])
+            publish_changed(self.store_id, version)
+            return super(Item, self).delete(*args, **kwargs)
     
     def serialize(self):
         return {
             "id": self.id,
             "name": self.name,
-            "list_items": [{ "list_id":list_item.list.id, "amount":list_item.amount } for list_item in self.list_items.all()],
+            "list_items": [{ "list_id":list_item.list_id, "amount":list_item.amount } for list_item in self.list_items.all()],
         }
 
 
@@ -130,6 +305,24 @@ class ListItem(models.Model):
         validators=[MinValueValidator(MIN_LIST_ITEM_AMOUNT), MaxValueValidator(MAX_LIST_ITEM_AMOUNT)],
         default=MIN_LIST_ITEM_AMOUNT
     )
+    version = models.PositiveBigIntegerField(
+        default=0, 
+        editable=False, 
+        db_index=True,
+        help_text="The Store version when this ListItem last changed."
+    )
+    date_counted = models.DateTimeField(
+        null=True, 
+        blank=True, 
+        editable=False, 
+        help_text="When the amount was counted, used to order conflicting counts."
+    )
+    op_id = models.CharField(
+        max_length=MAX_OP_ID_LENGTH, 
+        blank=True, 
+        editable=False, 
+        help_text="The SyncOperation that set the amount, blank if it was set on the server."
+    )
 
     class Meta:
         '''Item must be unique for List.'''
@@ -140,8 +333,294 @@ class ListItem(models.Model):
     def __str__(self):
         return '{} {}'.format(self.amount, self.item.name)
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.version = Store.objects.filter(pk=self.list.store_id).next_version()
+            if self._state.adding:
+                # the List count changes
+                List.objects.filter(pk=self.list_id).update(version=self.version)
+                old_amount = None
+            else:
+                old_amount = self.saved_amount()
+            super(ListItem, self).save(*args, **kwargs)
+            amount = self._meta.get_field('amount').to_python(self.amount)
+            if amount != old_amount:
+                ItemBalance.objects.apply_changes(self.list.store_id, self.list.type, self.list.position, [(self.item_id, old_amount, amount)])
+            publish_list_items(self.list.store_id, self.version, [(self.list_id, self.item_id, self.amount)])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            version = Store.objects.filter(pk=self.list.store_id).next_version()
+            List.objects.filter(pk=self.list_id).update(version=version)
+            Deletion.objects.create(store_id=self.list.store_id, model=Deletion.LIST_ITEM, object_id=self.pk, version=version)
+            publish_list_items(self.list.store_id, version, [(self.list_id, self.item_id, None)])
+            old_amount = self.saved_amount()
+            deleted = super(ListItem, self).delete(*args, **kwargs)
+            ItemBalance.objects.apply_changes(self.list.store_id, self.list.type, self.list.position, [(self.item_id, old_amount, None)])
+            return deleted
+
+    def saved_amount(self):
+        '''
+        The amount in the database, before this save or delete.
+
+        Return: Decimal or None
+        '''
+        return ListItem.objects.filter(pk=self.pk).values_list('amount', flat=True).first()
+
     @property
     def name(self):
         '''Get the item name.'''
         return self.item.name
 
+
+def fold_balances(rows):
+    '''
+    Folds ListItem rows of (item id, list id, list type, amount), in List (date_added, id) order,
+    into each Item's last Count and the Additions & Subtractions after it.
+
+    Return: dict - item id: dict of "last_count", "last_count_list_id", "additions", "subtractions"
+    '''
+    balances = {}
+    for item_id, list_id, list_type, amount in rows:
+        balance = balances.setdefault(item_id, {"last_count": None, "last_count_list_id": None, "additions": Decimal(0), "subtractions": Decimal(0)})
+        if list_type == List.COUNT:
+            balance.update(last_count=amount, last_count_list_id=list_id, additions=Decimal(0), subtractions=Decimal(0))
+        elif list_type == List.ADDITION:
+            balance["additions"] += amount
+        elif list_type == List.SUBTRACTION:
+            balance["subtractions"] += amount
+    return balances
+
+
+class ItemBalanceQuerySet(models.QuerySet):
+    def upsert(self, balances):
+        '''
+        Creates or updates ItemBalances, with one INSERT ... ON CONFLICT DO UPDATE statement for each batch.
+        Amounts are sums of validated ListItem amounts, so they are passed to the database as they are.
+        '''
+        fields = [ItemBalance._meta.get_field(name) for name in ['item', 'store', *ItemBalance.UPDATE_FIELDS]]
+        columns = [connection.ops.quote_name(field.column) for field in fields]
+        batch_size = connection.ops.bulk_batch_size(fields, balances)
+        placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(balances), batch_size):
+                batch = balances[start:start + batch_size]
+                params = []
+                for balance in batch:
+                    params += [getattr(balance, field.attname) for field in fields]
+                cursor.execute(
+                    'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT ({item}) DO UPDATE SET {updates}'.format(
+                        table=connection.ops.quote_name(ItemBalance._meta.db_table),
+                        columns=', '.join(columns),
+                        values=', '.join([placeholders] * len(batch)),
+                        item=columns[0],
+                        updates=', '.join('{0} = excluded.{0}'.format(column) for column in columns[2:]),
+                    ),
+                    params,
+                )
+
+    def recompute(self, store_id, item_ids):
+        '''
+        Recomputes the balances of Items from all of their ListItems.
+        '''
+        rows = ListItem.objects.filter(item_id__in=item_ids).order_by('list__date_added', 'list_id').values_list('item_id', 'list_id', 'list__type', 'amount')
+        folded = fold_balances(rows)
+        balances = [ItemBalance(item_id=item_id, store_id=store_id, **folded.get(item_id, {})) for item_id in item_ids]
+        for balance in balances:
+            balance.update_on_hand()
+        self.upsert(balances)
+
+    def apply_changes(self, store_id, list_type, position, changes):
+        '''
+        Updates Item balances for ListItems of a List that have been saved or deleted:
+        changes are (item id, old amount, new amount) tuples, old amount None for created ListItems, new amount None for deleted.
+        position is the List's (date_added, id).
+
+        Additions & Subtractions after an Item's last Count, and a Count at or after it, are applied as deltas.
+        Deleting the last Count, or counting an Item before its later Additions or Subtractions, recomputes the Item,
+        see recompute(). The balances, with the position of their last Count, and for a Count whether each Item is in
+        a later Addition or Subtraction, are read with one query, then written with one upsert.
+        '''
+        changes = [(item_id, old, new) for item_id, old, new in changes if old != new]
+        if not changes:
+            return
+
+        date_added, list_id = position
+        balances = self.filter(item_id__in=[item_id for item_id, old, new in changes]).annotate(
+            last_count_date_added=models.F('last_count_list__date_added')
+        )
+        if list_type == List.COUNT:
+            balances = balances.annotate(later_stock_lists=models.Exists(
+                ListItem.objects.filter(item_id=models.OuterRef('item_id')).exclude(list__type=List.COUNT).filter(
+                    models.Q(list__date_added__gt=date_added) | models.Q(list__date_added=date_added, list_id__gt=list_id)
+                )
+            ))
+        balances = {balance.item_id: balance for balance in balances}
+
+        changed = []
+        recompute = []
+        for item_id, old, new in changes:
+            balance = balances.get(item_id) or ItemBalance(item_id=item_id, store_id=store_id)
+            counted_at = None
+            if getattr(balance, 'last_count_date_added', None) is not None:
+                counted_at = (balance.last_count_date_added, balance.last_count_list_id)
+            if counted_at is not None and position < counted_at:
+                # before the last Count
+                continue
+            if list_type == List.ADDITION:
+                balance.additions += (new or 0) - (old or 0)
+            elif list_type == List.SUBTRACTION:
+                balance.subtractions += (new or 0) - (old or 0)
+            elif new is not None and position == counted_at:
+                balance.last_count = new
+            elif new is None or getattr(balance, 'later_stock_lists', False):
+                recompute.append(item_id)
+                continue
+            else:
+                balance.last_count = new
+                balance.last_count_list_id = list_id
+                balance.additions = Decimal(0)
+                balance.subtractions = Decimal(0)
+            balance.update_on_hand()
+            changed.append(balance)
+
+        self.upsert(changed)
+        if recompute:
+            self.recompute(store_id, recompute)
+
+
+class ItemBalance(models.Model):
+    '''
+    An Item's running total: its last Count, plus Additions, minus Subtractions after it.
+    Kept up to date as ListItems change, see ItemBalanceQuerySet.apply_changes(). Items without one have no stock.
+    '''
+    UPDATE_FIELDS = ['last_count', 'last_count_list', 'additions', 'subtractions', 'on_hand']
+
+    item = models.OneToOneField(Item, primary_key=True, editable=False, on_delete=models.CASCADE, related_name="balance")
+    store = models.ForeignKey(Store, editable=False, on_delete=models.CASCADE, related_name="balances")
+    last_count = models.DecimalField(max_digits=MAX_BALANCE_DIGITS, decimal_places=1, null=True, blank=True)
+    last_count_list = models.ForeignKey(List, null=True, blank=True, editable=False, on_delete=models.SET_NULL, related_name="+")
+    additions = models.DecimalField(max_digits=MAX_BALANCE_DIGITS, decimal_places=1, default=Decimal(0))
+    subtractions = models.DecimalField(max_digits=MAX_BALANCE_DIGITS, decimal_places=1, default=Decimal(0))
+    on_hand = models.DecimalField(max_digits=MAX_BALANCE_DIGITS, decimal_places=1, default=Decimal(0))
+    objects = ItemBalanceQuerySet.as_manager()
+
+    def __str__(self):
+        return '{} {}'.format(self.on_hand, self.item_id)
+
+    def update_on_hand(self):
+        self.on_hand = (self.last_count or 0) + self.additions - self.subtractions
+
+
+class Deletion(models.Model):
+    '''
+    A deleted Item, List or ListItem, kept so that delta syncs can report it.
+    '''
+    ITEM = 'items'
+    LIST = 'lists'
+    LIST_ITEM = 'list_items'
+    MODEL_CHOICES = [
+        (ITEM, "Item"),
+        (LIST, "List"),
+        (LIST_ITEM, "ListItem"),
+    ]
+
+    store = models.ForeignKey(Store, editable=False, on_delete=models.CASCADE, related_name="deletions")
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    version = models.PositiveBigIntegerField(help_text="The Store version when the object was deleted.")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['store', 'version']),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.get_model_display(), self.object_id)
+
+
+class SyncOperation(models.Model):
+    '''
+    A count sent by a client, recorded so that it is applied at most once.
+    '''
+    APPLIED = 'AP'
+    SUPERSEDED = 'SU'
+    REJECTED = 'RE'
+    STATUS_CHOICES = [
+        (APPLIED, "Applied"),
+        (SUPERSEDED, "Superseded"),
+        (REJECTED, "Rejected"),
+    ]
+
+    store = models.ForeignKey(Store, editable=False, on_delete=models.CASCADE, related_name="sync_operations")
+    op_id = models.CharField(max_length=MAX_OP_ID_LENGTH, help_text="Generated by the client, unique for Store.")
+    list_id = models.BigIntegerField(null=True, blank=True)
+    item_id = models.BigIntegerField(null=True, blank=True)
+    amount = models.DecimalField(max_digits=7, decimal_places=1, null=True, blank=True)
+    date_counted = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=2, choices=STATUS_CHOICES)
+    message = models.CharField(max_length=200, blank=True)
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        '''Operation id must be unique for Store.'''
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'op_id',], name='unique op_id store')
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.get_status_display(), self.op_id)
+
+    def serialize(self):
+        return {
+            "op_id": self.op_id,
+            "status": self.get_status_display(),
+            "message": self.message,
+        }
+
+
+class ImportJob(models.Model):
+    PENDING = 'PE'
+    RUNNING = 'RU'
+    DONE = 'DO'
+    FAILED = 'FA'
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    store = models.ForeignKey(Store, editable=False, on_delete=models.CASCADE, related_name="import_jobs")
+    status = models.CharField(max_length=2, choices=STATUS_CHOICES, default=PENDING)
+    lists = models.JSONField(
+        default=list, 
+        help_text="import_items data, or the Lists to create for a CSV file."
+    )
+    csv_file = models.FileField(upload_to='import_jobs/', blank=True, help_text="A CSV or XLSX file.")
+    name_fields = models.JSONField(default=list, blank=True)
+    amount_field = models.CharField(max_length=MAX_ITEM_NAME_LENGTH, blank=True)
+    sheet = models.CharField(max_length=MAX_SHEET_NAME_LENGTH, blank=True, help_text="The XLSX sheet, blank for the first.")
+    header_row = models.PositiveIntegerField(default=1, help_text="The XLSX header row, counting from 1.")
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_skipped = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    matches = models.JSONField(default=list, blank=True, help_text="Similar existing Items for new Item names.")
+    list_ids = models.JSONField(default=list, blank=True, help_text="The Lists created so far, in order, to resume an interrupted job.")
+    date_added = models.DateTimeField(auto_now_add=True)
+    heartbeat = models.DateTimeField(null=True, blank=True, help_text="Last sign of life from the worker running the job.")
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.get_status_display(), self.store.name)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "status": self.get_status_display(),
+            "rows_processed": self.rows_processed,
+            "rows_skipped": self.rows_skipped,
+            "errors": self.errors,
+            "matches": self.matches,
+        }
@@ -0,0 +1,118 @@
+import base64
+import json
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Item, ListItem
+
+
+# the FTS5 table of Item names, and its triggers, are created by migration 0068
+FTS_TABLE = 'stocklist_item_fts'
+FTS_MIN_LENGTH = 3
+
+SEARCH_MODES = ['substring', 'prefix']
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+
+def fts_available():
+    '''
+    Checked once for each database connection, so searches don't query sqlite_master.
+
+    Return: bool - True if the database has the Item name FTS5 table, see migration 0068
+    '''
+    if connection.vendor != 'sqlite':
+        return False
+    available = getattr(connection, 'stocklist_fts_available', None)
+    if available is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            available = cursor.fetchone() is not None
+        connection.stocklist_fts_available = available
+    return available
+
+
+def reset_fts_available(sender, connection, **kwargs):
+    '''
+    A new database connection checks for the FTS5 table again, see fts_available().
+    '''
+    connection.stocklist_fts_available = None
+
+
+connection_created.connect(reset_fts_available, dispatch_uid='stocklist.search')
+
+
+def encode_cursor(item):
+    '''
+    Return: str - an opaque cursor for the results after item, in (name, id) order
+    '''
+    return base64.urlsafe_b64encode(json.dumps([item["name"], item["id"]]).encode()).decode()
+
+
+def decode_cursor(value):
+    '''
+    Raises: ValueError
+    Return: tuple - name, id
+    '''
+    try:
+        name, item_id = json.loads(base64.urlsafe_b64decode(value.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(name, str) or isinstance(item_id, bool) or not isinstance(item_id, int):
+        raise ValueError("Invalid cursor.")
+    return name, item_id
+
+
+def parse_limit(value):
+    '''
+    Parses a page size, from 1 to MAX_SEARCH_LIMIT. Missing values default to SEARCH_LIMIT.
+
+    Raises: ValueError
+    Return: int
+    '''
+    if value in (None, ''):
+        return SEARCH_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_SEARCH_LIMIT:
+        raise ValueError("Limit must be a whole number from 1 to {}.".format(MAX_SEARCH_LIMIT))
+    return limit
+
+
+def search_items(store, query='', mode='substring', in_list=None, not_in_list=None, cursor=None, limit=SEARCH_LIMIT):
+    '''
+    Finds the Store's Items whose name contains query, or starts with it, ignoring case, in (name, id) order.
+    Queries of 3+ characters are looked up in the FTS5 trigram index when the database has it, shorter
+    queries scan the Store's Items. in_list keeps Items in a List, not_in_list keeps Items not yet in a List,
+    such as Items not yet counted. Each page is read with one query, after the cursor of the previous page.
+
+    Raises: ValueError for an unknown mode or invalid cursor
+    Return: dict - "items": [{"id", "name"}], "next": cursor for the next page, or None
+    '''
+    if mode not in SEARCH_MODES:
+        raise ValueError("Match must be one of: {}".format(', '.join(SEARCH_MODES)))
+
+    items = Item.objects.filter(store=store)
+    if query:
+        if len(query) >= FTS_MIN_LENGTH and fts_available():
+            # a quoted FTS5 string matches the substring, the filter below checks it
+            phrase = '"{}"'.format(query.replace('"', '""'))
+            items = items.filter(pk__in=RawSQL("SELECT rowid FROM {} WHERE {} MATCH %s".format(FTS_TABLE, FTS_TABLE), [phrase]))
+        items = items.filter(name__istartswith=query) if mode == 'prefix' else items.filter(name__icontains=query)
+    if in_list is not None:
+        items = items.filter(Exists(ListItem.objects.filter(list=in_list, item=OuterRef('pk'))))
+    if not_in_list is not None:
+        items = items.filter(~Exists(ListItem.objects.filter(list=not_in_list, item=OuterRef('pk'))))
+    if cursor:
+        name, item_id = decode_cursor(cursor)
+        items = items.filter(Q(name__gt=name) | Q(name=name, pk__gt=item_id))
+
+    page = list(items.order_by('name', 'id').values('id', 'name')[:limit + 1])
+    return {
+        "items": page[:limit],
+        "next": encode_cursor(page[limit - 1]) if len(page) > limit else None,
+    }
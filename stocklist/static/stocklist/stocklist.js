@@ -16,8 +16,19 @@ document.addEventListener('DOMContentLoaded', function() {
     document.querySelector('#items-view').style.display = 'none';
     document.querySelector('#import-csv-view').style.display = 'none';
 
-    // fetch items
+    // fetch items, save counts queued while offline
     fetch_items();
+    save_counts();
+
+    // counts from other devices
+    listen_for_counts();
+});
+
+// save queued counts when back online, and before leaving the page
+window.addEventListener('online', save_counts);
+window.addEventListener('pagehide', function() {
+    clearTimeout(count_queue_timer);
+    save_counts();
 });
 
 
@@ -97,7 +108,7 @@ function fetch_items() {
         
     // Import Items
     store_id = document.querySelector('#store-name-heading').dataset.store_id;
-    const path = '/items/' + store_id;
+    const path = '/items/' + store_id + '?format=matrix';
     fetch(path, {
         method: 'GET',
         headers: { 'X-CSRFToken': csrftoken },
@@ -109,13 +120,13 @@ function fetch_items() {
         // Print result
         console.log(data);
 
-        if (data.items.length) {
+        if (data.item_ids.length) {
             // Display Table View
             document.querySelector('#items-view').style.display = 'block';
             document.querySelector('#import-csv-view').style.display = 'none';
 
             // Save Data
-            localStorage.setItem('items', JSON.stringify(data.items));
+            localStorage.setItem('items', JSON.stringify(items_from_matrix(data)));
             localStorage.setItem('lists', JSON.stringify(data.lists));
 
             // Load Data
@@ -134,16 +145,31 @@ function fetch_items() {
     });
 }
 
+function items_from_matrix(data) {
+
+    // Item objects with list_items, from the rows of the amounts matrix
+    return data.item_ids.map((item_id, i) => {
+        const list_items = [];
+        data.amounts[i].forEach((amount, j) => {
+            if (amount !== null) {
+                list_items.push({ "list_id":data.lists[j].id, "amount":amount });
+            }
+        });
+        return { "id":item_id, "name":data.item_names[i], "list_items":list_items };
+    });
+}
+
 function load_table_with_data(data) {
 
-    const items = data.items;
+    const item_ids = data.item_ids;
     const lists = data.lists;
 
-    // Cells
-    for (var i = 0, item; item = items[i]; i++) {
+    // Cells: one pass over the amounts matrix
+    const table_body = document.createDocumentFragment();
+    for (var i = 0; i < item_ids.length; i++) {
 
-        var item_id = item['id'];
-        var list_items = item['list_items'];
+        var item_id = item_ids[i];
+        var amounts = data.amounts[i];
         
         // Table Row
         var table_row = document.createElement('tr');
@@ -154,7 +180,7 @@ function load_table_with_data(data) {
         var header_cell = document.createElement('th');
         header_cell.setAttribute('scope', 'row');
         header_cell.setAttribute('id', item_id + '_Name');
-        header_cell.innerHTML = item['name'];
+        header_cell.innerHTML = data.item_names[i];
         table_row.append(header_cell);
 
         // row cells
@@ -164,19 +190,19 @@ function load_table_with_data(data) {
             cell.setAttribute('id', item_id + '_' + list.name);
 
             // add list_item.amount
-            const list_item = list_items.find((list_item) => list_item.list_id == list.id);
-            if (typeof list_item !== "undefined") {
-                cell.innerHTML = Number(list_item.amount).toString();
+            if (amounts[j] !== null) {
+                cell.innerHTML = Number(amounts[j]).toString();
             }
             table_row.append(cell);  
         }
 
         // Append Row
-        document.querySelector('#items-table-body').append(table_row);
+        table_body.append(table_row);
     }
+    document.querySelector('#items-table-body').append(table_body);
 
     // current_list(items_count, lists, )
-    const items_count = items.length;
+    const items_count = item_ids.length;
 
     // current list
     var current_list_index = lists.findIndex((list) => list.count != items_count);
@@ -293,55 +319,27 @@ function count_item(button) {
     if (amount.length > 0 && (typeof list_item === "undefined" || (Number(list_item.amount).toString() != amount))) {
         console.log('save list_item.amount');
 
-
-        // csrf token from cookie
-        const csrftoken = getCookie('csrftoken');
-
-        // data to save//error here!
-        let new_list_item = { 'amount': amount };
-            
-        // Save List item
-        const path = '/create_list_item/' + current_list.id + '/' + current_item.id;
-        fetch(path, {
-            method: 'POST',
-            body: JSON.stringify(new_list_item),
-            headers: { 'X-CSRFToken': csrftoken },
-            mode: 'same-origin',
-        })
-        .then(response => response.json())
-        .then(result => {
-            // Print result
-            console.log(result);
-    
-            // insert list_item into items
+        // update items now, save with the next batch
+        if (typeof list_item === "undefined") {
             current_item.list_items.push({ "list_id":current_list.id, "amount":amount });
-            items[current_item_index] = current_item;
-            localStorage.setItem('items', JSON.stringify(items));
-            
-            if (result.created) {
-                
-                // update list.count
-                current_list.count = current_list.count + 1;
-                lists[current_list_index] = current_list;
-                localStorage.setItem('lists', JSON.stringify(lists));
 
-                // update ui
-                update_count_button(current_list, items.length);
-            }
-
-            // update ui
-            update_count_form(next_item, current_list.id);
-            update_table_cell(current_item.id, current_list.name, amount);
+            // update list.count
+            current_list.count = current_list.count + 1;
+            lists[current_list_index] = current_list;
+            localStorage.setItem('lists', JSON.stringify(lists));
+            update_count_button(current_list, items.length);
+        }
+        else {
+            list_item.amount = amount;
+        }
+        items[current_item_index] = current_item;
+        localStorage.setItem('items', JSON.stringify(items));
+        queue_count(current_list.id, current_item.id, amount);
 
-        })
-        // Catch any errors and log them to the console
-        .catch(error => {
-        console.log('Error:', error);
-        });
-    }
-    else {
-        update_count_form(next_item, current_list.id);
+        // update ui
+        update_table_cell(current_item.id, current_list.name, amount);
     }
+    update_count_form(next_item, current_list.id);
 }
 
 function next_row_index(button, index, items_length) {
@@ -365,6 +363,152 @@ function next_row_index(button, index, items_length) {
 
 
 
+// ************** Count Queue **************** 
+
+// counts waiting to be saved, kept in localStorage until the server has them:
+// [{op_id, timestamp, list_id, item_id, amount}]
+const COUNT_QUEUE_DELAY = 2000;
+const COUNT_QUEUE_BATCH_SIZE = 50;
+const SYNC_BATCH_SIZE = 200;
+let count_queue_timer = null;
+let count_queue_saving = null;
+
+function queue_count(list_id, item_id, amount) {
+
+    // the server applies each operation once, so a batch can be sent again
+    const operations = JSON.parse(localStorage.getItem('count_queue')) || [];
+    operations.push({ 'op_id':new_op_id(), 'timestamp':Date.now(), 'list_id':list_id, 'item_id':item_id, 'amount':amount });
+    localStorage.setItem('count_queue', JSON.stringify(operations));
+
+    // save when the batch is full, or the counter pauses
+    clearTimeout(count_queue_timer);
+    if (operations.length >= COUNT_QUEUE_BATCH_SIZE) {
+        save_counts();
+    }
+    else {
+        count_queue_timer = setTimeout(save_counts, COUNT_QUEUE_DELAY);
+    }
+}
+
+function new_op_id() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+// Returns a promise that settles when the queue has been sent, or sending it failed
+function save_counts() {
+
+    // one request at a time, while online: wait for the one being sent
+    if (count_queue_saving) {
+        return count_queue_saving;
+    }
+    const operations = (JSON.parse(localStorage.getItem('count_queue')) || []).slice(0, SYNC_BATCH_SIZE);
+    if (!navigator.onLine || operations.length == 0) {
+        return Promise.resolve();
+    }
+
+    // csrf token from cookie
+    const csrftoken = getCookie('csrftoken');
+    const store_id = document.querySelector('#store-name-heading').dataset.store_id;
+
+    count_queue_saving = fetch('/sync/' + store_id, {
+        method: 'POST',
+        body: JSON.stringify(operations),
+        headers: { 'X-CSRFToken': csrftoken },
+        mode: 'same-origin',
+        keepalive: true,
+    })
+    .then(response => response.json().then(result => {
+        count_queue_saving = null;
+        if (!response.ok) {
+            console.log('Error:', result.error);
+            return;
+        }
+
+        // every operation sent has a result, remove them from the queue
+        const sent = new Set(operations.map(operation => operation.op_id));
+        const remaining = (JSON.parse(localStorage.getItem('count_queue')) || []).filter(operation => !sent.has(operation.op_id));
+        localStorage.setItem('count_queue', JSON.stringify(remaining));
+        result.results.filter(op_result => op_result.status == 'Rejected').forEach(op_result => {
+            console.log('Rejected:', op_result.op_id, op_result.message);
+        });
+
+        if (remaining.length > 0) {
+            return save_counts();
+        }
+    }))
+    // Catch any errors and log them to the console, the queue is sent again when online
+    .catch(error => {
+        count_queue_saving = null;
+        console.log('Error:', error);
+    });
+    return count_queue_saving;
+}
+
+
+
+// ************** Count Events **************** 
+
+function listen_for_counts() {
+
+    // Server-Sent Events from capstone/asgi.py
+    const store_id = document.querySelector('#store-name-heading').dataset.store_id;
+    const events = new EventSource('/events/' + store_id);
+
+    // counts saved on any device
+    events.addEventListener('list_items', event => {
+        const data = JSON.parse(event.data);
+        update_list_items(data.list_items);
+    });
+
+    // Items or Lists changed, or too many counts were missed
+    events.addEventListener('changed', event => {
+        fetch_items();
+    });
+}
+
+function update_list_items(list_items) {
+
+    // data
+    const items = JSON.parse(localStorage.getItem('items'));
+    const lists = JSON.parse(localStorage.getItem('lists'));
+    if (items === null || lists === null) {
+        return;
+    }
+
+    list_items.forEach(list_item => {
+        const item = items.find(item => item.id == list_item.item_id);
+        const list = lists.find(list => list.id == list_item.list_id);
+        if (typeof item === "undefined" || typeof list === "undefined") {
+            return;
+        }
+
+        // update, add or remove the amount
+        const index = item.list_items.findIndex(item_list_item => item_list_item.list_id == list.id);
+        if (list_item.amount === null) {
+            if (index >= 0) {
+                item.list_items.splice(index, 1);
+                list.count = list.count - 1;
+            }
+        }
+        else if (index >= 0) {
+            item.list_items[index].amount = list_item.amount;
+        }
+        else {
+            item.list_items.push({ "list_id":list.id, "amount":list_item.amount });
+            list.count = list.count + 1;
+        }
+        update_table_cell(item.id, list.name, list_item.amount === null ? '' : Number(list_item.amount).toString());
+    });
+
+    localStorage.setItem('items', JSON.stringify(items));
+    localStorage.setItem('lists', JSON.stringify(lists));
+}
+
+
+
 // ************** Update UI **************** 
 
 function update_count_button(current_list, items_count) {
@@ -419,13 +563,20 @@ function parse_csv() {
     const file_name = selected_file['name'];
     const file_type = selected_file['type'];
 
+    // Excel workbooks are read on the server
+    clear_xlsx_selections();
+    if (is_xlsx(file_name)) {
+        preview_xlsx(selected_file);
+        return;
+    }
 
-    // Parse local CSV file
+    // Parse the first rows of the local CSV file - the server imports the whole file
     Papa.parse(selected_file,  {
         header: true,
         dynamicTyping: true,
         quoteChar: '',
         escapeChar: '',
+        preview: 5,
         complete: function(results) {
             console.log("Finished:", results.data);
             // console.log("Fields:", results.meta.fields);
@@ -444,10 +595,6 @@ function parse_csv() {
             else {
                 display_parsed_csv_table(results);
             }
-            
-
-            // save data to local storage
-            localStorage.setItem('data', JSON.stringify(results.data));
         },
         error: function(error, file) {
             console.log("Error:", error);
@@ -456,12 +603,116 @@ function parse_csv() {
 }
 
 
+function is_xlsx(file_name) {
+    return /\.(xlsx|xlsm)$/i.test(file_name);
+}
+
+function preview_xlsx(selected_file) {
+
+    // csrf token from cookie
+    const csrftoken = getCookie('csrftoken');
+
+    let form_data = new FormData();
+    form_data.append('file', selected_file);
+
+    // First rows of each sheet
+    store_id = document.querySelector('#store-name-heading').dataset.store_id;
+    const path = '/xlsx_sheets/' + store_id;
+    fetch(path, {
+        method: 'POST',
+        body: form_data,
+        headers: { 'X-CSRFToken': csrftoken },
+        mode: 'same-origin',
+    })
+    .then(response => response.json())
+    .then(result => {
+        console.log(result);
+
+        // ERRORS - Not a workbook
+        if (result.error) {
+            display_error([].concat(result.error).join('<br>'));
+            return;
+        }
+        display_xlsx_selections(result.sheets);
+    })
+    // Catch any errors and log them to the console
+    .catch(error => {
+      console.log('Error:', error);
+    });
+}
+
+function display_xlsx_selections(sheets) {
+
+    const sheet_select = document.querySelector('#xlsx-sheet-select');
+    const header_row_select = document.querySelector('#xlsx-header-row-select');
+
+    // Sheet options
+    sheets.forEach((sheet, index) => {
+        const option = document.createElement('OPTION');
+        option.textContent = sheet.name;
+        option.value = index.toString();
+        sheet_select.append(option);
+    });
+
+    // Header Row options for the selected sheet
+    const display_header_rows = function() {
+        header_row_select.innerHTML = '';
+        sheets[sheet_select.value].rows.forEach((row, index) => {
+            const option = document.createElement('OPTION');
+            option.innerHTML = index + 1;
+            option.value = (index + 1).toString();
+            header_row_select.append(option);
+        });
+        display_xlsx_sheet(sheets[sheet_select.value], 1);
+    }
+    sheet_select.onchange = display_header_rows;
+    header_row_select.onchange = function() {
+        display_xlsx_sheet(sheets[sheet_select.value], Number(header_row_select.value));
+    }
+
+    document.querySelector('#import-xlsx-selections-div').hidden = false;
+    display_header_rows();
+}
+
+function display_xlsx_sheet(sheet, header_row) {
+
+    // ERRORS - Empty sheet
+    const header = sheet.rows[header_row - 1];
+    if (typeof header === 'undefined' || sheet.rows.length <= header_row) {
+        clear_import_table();
+        document.querySelector('#import-csv-table-div').hidden = true;
+        document.querySelector('#load-csv-error-message').innerHTML = 'Sheet should contain a header row and rows of items: Choose another sheet!';
+        return;
+    }
+    document.querySelector('#load-csv-error-message').innerHTML = '';
+
+    // Rows after the header, as Papa.parse results
+    const fields = header.map(value => (value === null ? '' : String(value)));
+    const data = sheet.rows.slice(header_row).map(row => {
+        let row_data = {};
+        fields.forEach((field, index) => {
+            if (field && !(field in row_data)) {
+                row_data[field] = (index < row.length && row[index] !== null) ? row[index] : '';
+            }
+        });
+        return row_data;
+    });
+    display_parsed_csv_table({ 'data': data, 'meta': { 'fields': [...new Set(fields.filter(field => field))] } });
+}
+
+function clear_xlsx_selections() {
+    document.querySelector('#xlsx-sheet-select').innerHTML = '';
+    document.querySelector('#xlsx-header-row-select').innerHTML = '';
+    document.querySelector('#import-xlsx-selections-div').hidden = true;
+}
+
 function display_error(message) {
     error_p = document.querySelector('#load-csv-error-message')
     error_p.innerHTML = message;
     set_up_on_change_for_file_input(error_p);
 
     clear_import_table();
+    clear_xlsx_selections();
     document.querySelector('#import-csv-table-div').hidden = true;
 }
 
@@ -509,7 +760,7 @@ function display_parsed_csv_table(results) {
     
     
     // Display first 4 Table Rows
-    let num_display_rows = 4;
+    let num_display_rows = Math.min(4, data.length);
     for (let i = 0; i < num_display_rows; i++) {
         const table_row = document.createElement('tr');
         fields.forEach(element => {
@@ -546,7 +797,7 @@ function display_parsed_csv_table(results) {
     document.querySelector('#import-csv-table-head').prepend(table_col_select_row);
 
     // Caption
-    document.querySelector('#import-csv-table-caption').innerHTML = "Showing " + num_display_rows + " of " + data.length + " Rows";
+    document.querySelector('#import-csv-table-caption').innerHTML = "Showing first " + num_display_rows + " Rows";
    
     // Import Items Button
     document.querySelector('#import-items-button-div').append(import_items_button());
@@ -640,50 +891,43 @@ function validate_selections(button) {
         return false;
     }
 
-    // Retrieve Data from Local Storage
-    let data_text = localStorage.getItem('data');
-    let data = JSON.parse(data_text); // console.log(data)
-
     // Map Selections to Item.Properties
-    let items = data.map(item =>{
-        let properties = {
-            "name": ''
-        };
-        for (let i = 0; i < item_name_selections.length; i++) {
-            name_column_key = item_name_selections[i].field;
-            if (i > 0) {
-                properties["name"] += ' ';
-            }
-            properties["name"] += item[name_column_key];
-        }
-        if (item_amount_selections.length) {
-            amount_column_key = item_amount_selections[0].field;
-            properties["amount"] = item[amount_column_key]
-        }
-        return properties;
+    const input_file = document.querySelector('#input-file');
+    let form_data = new FormData();
+    form_data.append('file', input_file.files[0]);
+    item_name_selections.forEach(selection => {
+        form_data.append('name_fields', selection.field);
     });
-    console.log(items);
+    if (item_amount_selections.length) {
+        form_data.append('amount_field', item_amount_selections[0].field);
+    }
+    if (is_xlsx(input_file.files[0].name)) {
+        const sheet_select = document.querySelector('#xlsx-sheet-select');
+        form_data.append('sheet', sheet_select.options[sheet_select.selectedIndex].text);
+        form_data.append('header_row', document.querySelector('#xlsx-header-row-select').value);
+    }
     
-    import_items(items);
+    upload_csv(form_data);
 }
 
-function import_items(items) {
+function upload_csv(form_data) {
 
     // csrf token from cookie
     const csrftoken = getCookie('csrftoken');
 
     new_list_array = [
-        { 'name':'Import', 'type': 'AD', 'items': items},
+        { 'name':'Import', 'type': 'AD' },
         { 'name':'Start' },
         { 'name':'End' }
     ]
+    form_data.append('lists', JSON.stringify(new_list_array));
         
-    // Import Lists & Items
+    // Queue CSV File as an import job: Import Lists & Items, without waiting for the import
     store_id = document.querySelector('#store-name-heading').dataset.store_id;
-    const path = '/import_items/' + store_id;
+    const path = '/import_jobs/' + store_id;
     fetch(path, {
         method: 'POST',
-        body: JSON.stringify(new_list_array),
+        body: form_data,
         headers: { 'X-CSRFToken': csrftoken },
         mode: 'same-origin',
     })
@@ -691,9 +935,14 @@ function import_items(items) {
     .then(result => {
         // Print result
         console.log(result);
-  
-        // Update Template
-        fetch_items();
+
+        // ERRORS - Invalid selections, nothing was queued
+        if (result.error) {
+            show_import_errors([].concat(result.error));
+            return;
+        }
+
+        poll_import_job(result.job_id);
     })
     // Catch any errors and log them to the console
     .catch(error => {
@@ -701,58 +950,62 @@ function import_items(items) {
     });
 }
 
-function export_csv(export_csv_button) {
+const IMPORT_JOB_POLL_INTERVAL = 1000;
 
-    export_csv_button.disabled = true;
-    
-    // file_name
-    var store_name = document.querySelector('#store-name-heading').innerText;
-    var file_name = store_name + ".csv";
+function poll_import_job(job_id) {
 
-    // fields
-    let lists = JSON.parse(localStorage.getItem('lists')); 
-    let fields = ['Item'];
-    lists.forEach(list =>{
-        if (list.type === 'Count') {
-            fields.push(list.name + ' ' + list.type);
+    // Import job status: rows processed until it is done, or failed
+    fetch('/import_job/' + job_id)
+    .then(response => response.json())
+    .then(job => {
+        const progress_message = document.querySelector('#import-progress-message');
+
+        // ERRORS - Invalid rows, nothing was imported
+        if (job.error || job.status == 'Failed') {
+            progress_message.innerHTML = '';
+            show_import_errors(job.error ? [].concat(job.error) : job.errors.map(error => error.message || error));
+            return;
         }
-        else {
-            fields.push(list.name);
+
+        // Update Template
+        if (job.status == 'Done') {
+            progress_message.innerHTML = '';
+            fetch_items();
+            return;
         }
+
+        progress_message.innerHTML = job.status + ': ' + job.rows_processed + ' rows imported';
+        setTimeout(() => poll_import_job(job_id), IMPORT_JOB_POLL_INTERVAL);
     })
-    console.log(fields);
+    // Catch any errors and log them to the console, then ask again
+    .catch(error => {
+        console.log('Error:', error);
+        setTimeout(() => poll_import_job(job_id), IMPORT_JOB_POLL_INTERVAL);
+    });
+}
 
-    // data
-    let items = JSON.parse(localStorage.getItem('items')); 
-    var data = [];
-    items.forEach(item =>{
-        const result = [item.name];
-        for (var j = 0, list; list = lists[j]; j++) {
+function show_import_errors(errors) {
+    document.querySelector('#save-items-error-message').innerHTML = errors.join('<br>');
+    document.querySelector('#import-items-button').disabled = false;
+}
 
-            const list_item = item.list_items.find((list_item) => list_item.list_id == list.id);
-            if (typeof list_item !== "undefined") {
-                result.push(list_item.amount);
-            }
-            else {
-                result.push('');
-            }
-        }
-        data.push(result);
-    });
-    console.log(data);
+function export_csv(export_csv_button) {
 
+    export_csv_button.disabled = true;
+    
+    // file_name
+    var store_name = document.querySelector('#store-name-heading').innerText;
+    var file_name = store_name + ".csv";
 
-    // parse data
-    var csv = Papa.unparse({
-        fields: fields,
-        data: data,
+    // send queued counts first, so they are exported, then the server streams the table as CSV
+    clearTimeout(count_queue_timer);
+    save_counts().then(() => {
+        const store_id = document.querySelector('#store-name-heading').dataset.store_id;
+        download_csv_link(file_name, '/export/' + store_id + '.csv');
     });
-    console.log(csv);
-
-    download_csv_link(file_name, csv);
 }
 
-function download_csv_link(file_name, csv) {
+function download_csv_link(file_name, url) {
 
     // 
     const link = document.createElement('a');
@@ -762,7 +1015,7 @@ function download_csv_link(file_name, csv) {
     link.setAttribute('id', "export-csv-link")
     link.setAttribute('target', "_blank");
     link.setAttribute('download', file_name);
-    link.href = 'data:text/csv;charset=utf-8,' + encodeURI(csv);
+    link.href = url;
 
     document.querySelector('#export-csv-view').append(link);
     document.querySelector('#delete-store-view').style.display = 'none';
@@ -0,0 +1,302 @@
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Item, ItemBalance, List, ListItem
+
+
+AMOUNT_QUANTUM = Decimal(1).scaleb(-ListItem._meta.get_field('amount').decimal_places)
+
+# each Item's last Count in the Lists matching list_filter, and the Additions & Subtractions after it
+LEVELS_SQL = '''
+WITH ranked_lists AS (
+    SELECT {list_id}, {list_type}, ROW_NUMBER() OVER (ORDER BY {list_date}, {list_id}) AS seq
+    FROM {list_table}
+    WHERE {list_store} = %s AND {list_filter}
+),
+counted AS (
+    SELECT li.{item} AS item_id, li.{list} AS list_id, li.{amount} AS amount, l.{list_type} AS type, l.seq AS seq,
+        MAX(CASE WHEN l.{list_type} = %s THEN l.seq END) OVER (PARTITION BY li.{item}) AS count_seq
+    FROM {list_item_table} li
+    JOIN ranked_lists l ON l.{list_id} = li.{list}
+),
+levels AS (
+    SELECT item_id,
+        MAX(CASE WHEN seq = count_seq THEN amount END) AS last_count,
+        MAX(CASE WHEN seq = count_seq THEN list_id END) AS last_count_list_id,
+        SUM(CASE WHEN type = %s AND (count_seq IS NULL OR seq > count_seq) THEN amount END) AS additions,
+        SUM(CASE WHEN type = %s AND (count_seq IS NULL OR seq > count_seq) THEN amount END) AS subtractions
+    FROM counted
+    GROUP BY item_id
+)
+'''
+
+STOCK_LEVELS_SQL = LEVELS_SQL + '''
+SELECT i.{item_id}, i.{item_name}, s.last_count, s.last_count_list_id, COALESCE(s.additions, 0), COALESCE(s.subtractions, 0)
+FROM {item_table} i
+LEFT JOIN levels s ON s.item_id = i.{item_id}
+WHERE i.{item_store} = %s
+ORDER BY i.{item_id}
+'''
+
+# Lists before the end Count, and the end Count's ListItems
+VARIANCE_SQL = LEVELS_SQL + '''
+SELECT i.{item_id}, i.{item_name},
+    COALESCE(s.last_count, 0) + COALESCE(s.additions, 0) - COALESCE(s.subtractions, 0), COALESCE(e.{amount}, 0)
+FROM {item_table} i
+LEFT JOIN levels s ON s.item_id = i.{item_id}
+LEFT JOIN {list_item_table} e ON e.{item} = i.{item_id} AND e.{list} = %s
+WHERE i.{item_store} = %s
+ORDER BY i.{item_id}
+'''
+
+def to_amount(value):
+    '''
+    Converts a summed amount to a Decimal with the precision of ListItem.amount.
+    SQLite sums decimals as floats.
+
+    Return: Decimal or None
+    '''
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(AMOUNT_QUANTUM)
+
+
+def parse_as_of(value):
+    '''
+    Parses an ISO date or date & time. A date means the end of that day,
+    a time without an offset is in the current time zone.
+
+    Return: datetime
+    Raises: ValueError if value is not a valid date
+    '''
+    as_of = parse_datetime(value)
+    if as_of is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('Invalid date: {}'.format(value))
+        as_of = datetime.combine(day, time.max)
+    if timezone.is_naive(as_of):
+        as_of = timezone.make_aware(as_of)
+    return as_of
+
+
+def parse_threshold(value):
+    '''
+    Parses a non-negative variance threshold.
+
+    Return: Decimal
+    Raises: ValueError if value is not a non-negative number
+    '''
+    try:
+        threshold = Decimal(value)
+    except InvalidOperation:
+        threshold = None
+    if threshold is None or not threshold.is_finite() or threshold < 0:
+        raise ValueError('Invalid threshold: {}'.format(value))
+    return threshold
+
+
+def format_sql(sql, list_filter):
+    '''
+    Fills in the table & column names of a LEVELS_SQL query, and the condition for Lists to include.
+
+    Return: str
+    '''
+    def column(model, field):
+        return connection.ops.quote_name(model._meta.get_field(field).column)
+
+    return sql.format(
+        list_filter=list_filter.format(list_id=column(List, 'id'), list_date=column(List, 'date_added')),
+        list_table=connection.ops.quote_name(List._meta.db_table),
+        list_id=column(List, 'id'),
+        list_type=column(List, 'type'),
+        list_date=column(List, 'date_added'),
+        list_store=column(List, 'store'),
+        list_item_table=connection.ops.quote_name(ListItem._meta.db_table),
+        list=column(ListItem, 'list'),
+        item=column(ListItem, 'item'),
+        amount=column(ListItem, 'amount'),
+        item_table=connection.ops.quote_name(Item._meta.db_table),
+        item_id=column(Item, 'id'),
+        item_name=column(Item, 'name'),
+        item_store=column(Item, 'store'),
+    )
+
+
+def stock_levels(store, as_of=None):
+    '''
+    Computes the expected stock of every Item in the Store as of a date, with one grouped query:
+    the Item's last Count, plus Additions, minus Subtractions after it, with Lists in date_added order.
+    Items never counted start from zero. Lists added after as_of are ignored.
+
+    Return: list of dicts - "item_id", "name", "last_count", "last_count_list_id", "additions", "subtractions", "on_hand"
+    '''
+    as_of = List._meta.get_field('date_added').get_db_prep_value(as_of or timezone.now(), connection)
+    params = [store.pk, as_of, List.COUNT, List.ADDITION, List.SUBTRACTION, store.pk]
+    with connection.cursor() as cursor:
+        cursor.execute(format_sql(STOCK_LEVELS_SQL, '{list_date} <= %s'), params)
+        rows = cursor.fetchall()
+
+    levels = []
+    for item_id, name, last_count, last_count_list_id, additions, subtractions in rows:
+        last_count = to_amount(last_count)
+        additions = to_amount(additions)
+        subtractions = to_amount(subtractions)
+        levels.append({
+            "item_id": item_id,
+            "name": name,
+            "last_count": last_count,
+            "last_count_list_id": last_count_list_id,
+            "additions": additions,
+            "subtractions": subtractions,
+            "on_hand": (last_count or 0) + additions - subtractions,
+        })
+    return levels
+
+
+def balance_levels(store):
+    '''
+    The current stock of every Item in the Store, read from ItemBalance without reading ListItems, with one query.
+    Items without an ItemBalance have no stock.
+
+    Return: list of dicts, as stock_levels()
+    '''
+    zero = to_amount(0)
+    rows = Item.objects.filter(store=store).order_by('id').values_list(
+        'id', 'name', 'balance__last_count', 'balance__last_count_list', 'balance__additions', 'balance__subtractions', 'balance__on_hand'
+    )
+    return [{
+        "item_id": item_id,
+        "name": name,
+        "last_count": last_count,
+        "last_count_list_id": last_count_list_id,
+        "additions": zero if additions is None else additions,
+        "subtractions": zero if subtractions is None else subtractions,
+        "on_hand": zero if on_hand is None else on_hand,
+    } for item_id, name, last_count, last_count_list_id, additions, subtractions, on_hand in rows]
+
+
+BALANCE_FIELDS = ["last_count", "last_count_list_id", "additions", "subtractions", "on_hand"]
+
+
+def check_balances(store):
+    '''
+    Compares the Store's ItemBalances with stock levels computed from its ListItems.
+
+    Return: list of tuples - computed level, balance level, for each Item that differs
+    '''
+    return [
+        (computed, balance) for computed, balance in zip(stock_levels(store), balance_levels(store))
+        if any(computed[field] != balance[field] for field in BALANCE_FIELDS)
+    ]
+
+
+def rebuild_balances(store):
+    '''
+    Replaces the Store's ItemBalances with stock levels computed from its ListItems, in one transaction.
+
+    Return: int - number of ItemBalances
+    '''
+    with transaction.atomic():
+        levels = stock_levels(store)
+        ItemBalance.objects.filter(store=store).delete()
+        ItemBalance.objects.bulk_create([
+            ItemBalance(store=store, item_id=level["item_id"], **{field: level[field] for field in BALANCE_FIELDS}) for level in levels
+        ])
+    return len(levels)
+
+
+VARIANCE_SORT_FIELDS = ['name', 'expected', 'counted', 'variance', 'percentage']
+PERCENTAGE_QUANTUM = Decimal('0.1')
+
+
+def last_count_list(store):
+    '''
+    The Store's latest Count, in date_added order.
+
+    Return: List or None
+    '''
+    return List.counts.filter(store=store).order_by('-date_added', '-id').first()
+
+
+def clean_sort(sort):
+    '''
+    Checks a sort is a field of VARIANCE_SORT_FIELDS, descending with a "-" prefix.
+
+    Return: tuple - field, descending
+    Raises: ValueError for an unknown field
+    '''
+    field = sort[1:] if sort.startswith('-') else sort
+    if field not in VARIANCE_SORT_FIELDS:
+        raise ValueError('Invalid sort: {}, choose from {}'.format(sort, ', '.join(VARIANCE_SORT_FIELDS)))
+    return field, sort.startswith('-')
+
+
+def sort_variances(rows, field, descending):
+    '''
+    Sorts report rows by a field, rows without a percentage come last.
+
+    Return: list
+    '''
+    known = [row for row in rows if row[field] is not None]
+    known.sort(key=lambda row: row[field], reverse=descending)
+    return known + [row for row in rows if row[field] is None]
+
+
+def variance_report(store, count_list, sort='variance', threshold=None, threshold_percentage=None):
+    '''
+    Compares each Item's expected stock before a Count with the amount counted, with one grouped query.
+    Expected stock is the previous Count, plus Additions, minus Subtractions, up to the Count.
+    Items missing from the Count were counted as zero.
+
+    variance is counted - expected, so a shortfall is negative; percentage is of expected, None if nothing was expected.
+    Totals are for every Item; threshold and threshold_percentage only filter the rows, by size of variance.
+
+    Return: dict - "list_id", "name", "date_added", "totals", "items"
+    Raises: ValueError for an invalid sort
+    '''
+    field, descending = clean_sort(sort)
+    date_added = List._meta.get_field('date_added').get_db_prep_value(count_list.date_added, connection)
+    params = [
+        store.pk, date_added, date_added, count_list.pk,
+        List.COUNT, List.ADDITION, List.SUBTRACTION,
+        count_list.pk, store.pk,
+    ]
+    list_filter = '({list_date} < %s OR ({list_date} = %s AND {list_id} < %s))'
+    with connection.cursor() as cursor:
+        cursor.execute(format_sql(VARIANCE_SQL, list_filter), params)
+        rows = cursor.fetchall()
+
+    items = []
+    totals = {"expected": Decimal(0), "counted": Decimal(0), "variance": Decimal(0)}
+    for item_id, name, expected, counted in rows:
+        expected = to_amount(expected)
+        counted = to_amount(counted)
+        variance = counted - expected
+        percentage = (variance / expected * 100).quantize(PERCENTAGE_QUANTUM) if expected else None
+        totals["expected"] += expected
+        totals["counted"] += counted
+        totals["variance"] += variance
+        if threshold is not None and abs(variance) < threshold:
+            continue
+        if threshold_percentage is not None and percentage is not None and abs(percentage) < threshold_percentage:
+            continue
+        items.append({
+            "item_id": item_id,
+            "name": name,
+            "expected": expected,
+            "counted": counted,
+            "variance": variance,
+            "percentage": percentage,
+        })
+
+    return {
+        "list_id": count_list.pk,
+        "name": count_list.name,
+        "date_added": count_list.date_added,
+        "totals": totals,
+        "items": sort_variances(items, field, descending),
+    }
@@ -0,0 +1,223 @@
+import datetime
+import random
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+
+from .models import User, Store, Item, List, ListItem
+from .stock import rebuild_balances
+
+
+STOCKDATA_BATCH_SIZE = 10000
+STOCKDATA_START = datetime.datetime(2024, 1, 1, 9, tzinfo=datetime.timezone.utc)
+LIST_INTERVAL = datetime.timedelta(days=1)
+
+# Lists run in stocktake periods: an opening Count, then deliveries and sales, until the next Count
+LIST_CYCLE = [
+    (List.COUNT, 'Count'),
+    (List.ADDITION, 'Delivery'),
+    (List.SUBTRACTION, 'Sales'),
+]
+# the fraction of the Store's Items in each type of List
+LIST_COVERAGE = {
+    List.COUNT: 0.95,
+    List.ADDITION: 0.3,
+    List.SUBTRACTION: 0.6,
+}
+
+BRANDS = [
+    'Abbey', 'Albion', 'Anchor', 'Aurora', 'Baron', 'Beacon', 'Bishop', 'Blackwater', 'Bluebell', 'Bramble',
+    'Castle', 'Cedar', 'Copper', 'Crown', 'Falcon', 'Fox', 'Glen', 'Golden', 'Granite', 'Harbour',
+    'Hawthorn', 'Heron', 'Highland', 'Ivy', 'Juniper', 'Kestrel', 'King', 'Lantern', 'Larch', 'Lion',
+    'Maple', 'Meadow', 'Mill', 'Monarch', 'Oak', 'Orchard', 'Otter', 'Pearl', 'Pine', 'Quarry',
+    'Raven', 'Red Kite', 'River', 'Rook', 'Rowan', 'Saint', 'Silver', 'Sparrow', 'Stag', 'Star',
+    'Stone', 'Swan', 'Thistle', 'Tower', 'Union', 'Valley', 'Willow', 'Wolf', 'Wren', 'Yew',
+]
+VARIANTS = ['', 'Reserve', 'Premium', 'Classic', 'Gold', 'Special', 'Aged', 'Light', 'Export', 'Select', 'Original', 'Small Batch']
+# product, sizes, case size, and whether it is counted in tenths, as part-used bottles are
+PRODUCTS = [
+    ('Vodka', ['70cl', '100cl', '150cl'], 6, True),
+    ('Gin', ['70cl', '100cl'], 6, True),
+    ('White Rum', ['70cl', '100cl'], 6, True),
+    ('Dark Rum', ['70cl'], 6, True),
+    ('Spiced Rum', ['70cl', '100cl'], 6, True),
+    ('Reposado Tequila', ['70cl'], 6, True),
+    ('Scotch Whisky', ['70cl', '100cl'], 6, True),
+    ('Irish Whiskey', ['70cl'], 6, True),
+    ('Bourbon', ['70cl', '100cl'], 6, True),
+    ('Cognac', ['70cl'], 6, True),
+    ('Orange Liqueur', ['50cl', '70cl'], 6, True),
+    ('Coffee Liqueur', ['70cl'], 6, True),
+    ('Raspberry Liqueur', ['50cl'], 6, True),
+    ('Sweet Vermouth', ['75cl'], 6, True),
+    ('Dry Vermouth', ['75cl'], 6, True),
+    ('Red Wine', ['75cl', '150cl'], 6, True),
+    ('White Wine', ['75cl', '150cl'], 6, True),
+    ('Rose Wine', ['75cl'], 6, True),
+    ('Prosecco', ['20cl', '75cl'], 6, False),
+    ('Champagne', ['75cl'], 6, False),
+    ('Lager', ['33cl', '50cl', '50l Keg'], 24, False),
+    ('Pale Ale', ['33cl', '50cl'], 24, False),
+    ('Stout', ['44cl', '30l Keg'], 24, False),
+    ('Cider', ['50cl', '50l Keg'], 12, False),
+    ('Tonic Water', ['20cl', '100cl'], 24, False),
+    ('Cola', ['20cl', '33cl', '10l Bag'], 24, False),
+    ('Lemonade', ['20cl', '33cl'], 24, False),
+    ('Ginger Beer', ['20cl'], 24, False),
+    ('Orange Juice', ['100cl'], 12, False),
+    ('Cranberry Juice', ['100cl'], 12, False),
+    ('Sugar Syrup', ['70cl'], 6, True),
+    ('Salted Crisps', ['40g', '150g'], 24, False),
+    ('Roasted Peanuts', ['50g'], 24, False),
+]
+PRODUCT_SIZES = [(name, size, case, tenths) for name, sizes, case, tenths in PRODUCTS for size in sizes]
+NAME_SPACE = len(BRANDS) * len(VARIANTS) * len(PRODUCT_SIZES)
+
+
+def item_name(index):
+    '''
+    Names the index-th combination of brand, variant, product and size, with an edition number
+    after every combination is used.
+
+    Return: tuple - name, case size, counted in tenths
+    '''
+    index, edition = index % NAME_SPACE, index // NAME_SPACE
+    index, product = divmod(index, len(PRODUCT_SIZES))
+    brand, variant = divmod(index, len(VARIANTS))
+    name, size, case, tenths = PRODUCT_SIZES[product]
+    words = [BRANDS[brand], VARIANTS[variant], name, size]
+    if edition:
+        words.append(str(edition + 1))
+    return ' '.join(word for word in words if word), case, tenths
+
+
+def generate_items(rng, count):
+    '''
+    Distinct Item names, drawn at random from every combination, with a par level, the stock usually held,
+    log-normally distributed around the case size, so most Items hold a few cases and a few hold many.
+
+    Return: list of tuples - name, case size, par level, counted in tenths
+    '''
+    editions = -(-count // NAME_SPACE)
+    items = []
+    for index in rng.sample(range(NAME_SPACE * editions), count):
+        name, case, tenths = item_name(index)
+        par = min(round(rng.lognormvariate(0, 0.8) * case * 2), 5000)
+        items.append((name, case, max(par, 1), tenths))
+    return items
+
+
+def generate_amount(rng, list_type, case, par, tenths):
+    '''
+    An amount for an Item in a List: Counts find between none and half as much again as the par level,
+    Additions deliver whole cases, Subtractions sell up to the par level.
+
+    Return: int - the amount in tenths
+    '''
+    if list_type == List.COUNT:
+        amount = par * rng.uniform(0, 1.5)
+    elif list_type == List.ADDITION:
+        return case * rng.choice([1, 1, 1, 2, 2, 3, 4]) * 10
+    else:
+        amount = rng.uniform(1, par)
+    return round(amount * 10) if tenths else round(amount) * 10
+
+
+def insert_rows(model, field_names, rows, batch_size=STOCKDATA_BATCH_SIZE):
+    '''
+    Inserts rows of values, already prepared for the database, with one executemany() per batch.
+    Skips model instances, save(), signals and auto_now_add, so it is much faster than bulk_create() for
+    millions of rows.
+
+    Return: int - number of rows
+    '''
+    columns = [connection.ops.quote_name(model._meta.get_field(name).column) for name in field_names]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(model._meta.db_table), ', '.join(columns), ', '.join(['%s'] * len(columns))
+    )
+    inserted = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                cursor.executemany(sql, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            inserted += len(batch)
+    return inserted
+
+
+def generate_store(user, name, items, lists, rng, batch_size=STOCKDATA_BATCH_SIZE):
+    '''
+    Creates a Store with items Items and lists Lists, in stocktake periods of a Count then a Delivery and Sales,
+    a day apart, each with a ListItem for a LIST_COVERAGE fraction of the Items. Rows are written with
+    insert_rows(), stamped with one Store version, then the balances are built. In one transaction.
+
+    Return: tuple - Store, number of ListItems
+    '''
+    amount_field = ListItem._meta.get_field('amount')
+    date_field = List._meta.get_field('date_added')
+    # amounts repeat, each is prepared for the database once
+    amounts = {}
+
+    def amount_value(amount_tenths):
+        if amount_tenths not in amounts:
+            amounts[amount_tenths] = amount_field.get_db_prep_save(Decimal(amount_tenths) / 10, connection)
+        return amounts[amount_tenths]
+
+    item_data = generate_items(rng, items)
+    with transaction.atomic():
+        store = Store.objects.create(user=user, name=name)
+        version = Store.objects.filter(pk=store.pk).next_version()
+
+        insert_rows(Item, ['store', 'name', 'version'], ((store.pk, name, version) for name, case, par, tenths in item_data), batch_size)
+        item_ids = list(Item.objects.filter(store=store).order_by('id').values_list('id', flat=True))
+
+        list_rows = []
+        for index in range(lists):
+            list_type, list_name = LIST_CYCLE[index % len(LIST_CYCLE)]
+            date_added = date_field.get_db_prep_save(STOCKDATA_START + LIST_INTERVAL * index, connection)
+            list_rows.append((store.pk, '{} {}'.format(list_name, index // len(LIST_CYCLE) + 1), list_type, date_added, version))
+        insert_rows(List, ['store', 'name', 'type', 'date_added', 'version'], list_rows, batch_size)
+        list_ids = list(List.objects.filter(store=store).order_by('id').values_list('id', flat=True))
+
+        list_item_count = 0
+        for list_id, (store_id, list_name, list_type, date_added, list_version) in zip(list_ids, list_rows):
+            coverage = LIST_COVERAGE[list_type]
+            date_counted = date_added if list_type == List.COUNT else None
+            list_item_count += insert_rows(ListItem, ['list', 'item', 'amount', 'date_counted', 'op_id', 'version'], (
+                (list_id, item_id, amount_value(generate_amount(rng, list_type, case, par, tenths)), date_counted, '', version)
+                for item_id, (name, case, par, tenths) in zip(item_ids, item_data) if rng.random() < coverage
+            ), batch_size)
+
+        rebuild_balances(store)
+    return store, list_item_count
+
+
+def generate_stockdata(users, stores, items, lists, seed=0, prefix='stockdata', password='stockdata', batch_size=STOCKDATA_BATCH_SIZE):
+    '''
+    Creates users Users, named prefix1, prefix2..., each with stores Stores of items Items and lists Lists,
+    see generate_store(). Each Store draws from its own random generator, seeded with seed and its position,
+    so the same arguments generate the same data, and a Store's data doesn't depend on how many others there are.
+    Every User has the same password, hashed once.
+
+    Return: tuple - Users, Stores and ListItems created
+    '''
+    password = make_password(password)
+    usernames = ['{}{}'.format(prefix, user_index + 1) for user_index in range(users)]
+    User.objects.bulk_create([User(username=username, password=password) for username in usernames])
+    created_users = User.objects.in_bulk(usernames, field_name='username')
+
+    created_stores = 0
+    list_items = 0
+    for user_index, username in enumerate(usernames):
+        user = created_users[username]
+        for store_index in range(stores):
+            rng = random.Random('{}:{}:{}'.format(seed, user_index, store_index))
+            store, count = generate_store(user, 'Store {}'.format(store_index + 1), items, lists, rng, batch_size)
+            created_stores += 1
+            list_items += count
+    return len(created_users), created_stores, list_items
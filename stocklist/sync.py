@@ -0,0 +1,165 @@
+import datetime
+import math
+from django.db import transaction
+from django.utils import timezone
+
+from .broadcast import publish_list_items
+from .importer import IMPORT_BATCH_SIZE, clean_item_amount, upsert_list_item_rows
+from .models import Store, Item, List, ListItem, SyncOperation, MAX_OP_ID_LENGTH
+
+
+MAX_SYNC_OPERATIONS = 500
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+REJECTED_DISPLAY = dict(SyncOperation.STATUS_CHOICES)[SyncOperation.REJECTED]
+
+
+def is_id(value):
+    '''
+    Checks a List or Item id sent by a client is a whole number.
+
+    Return: bool
+    '''
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def clean_op_id(op_id):
+    '''
+    Checks an operation id generated by a client.
+
+    Return: error message or None
+    '''
+    if not isinstance(op_id, str) or op_id == '':
+        return "Operation id {!r} must be a string.".format(op_id)
+    if len(op_id) > MAX_OP_ID_LENGTH:
+        return "Ensure operation id has at most {} characters (it has {}).".format(MAX_OP_ID_LENGTH, len(op_id))
+    return None
+
+
+def clean_timestamp(timestamp, now):
+    '''
+    Converts a client timestamp, in milliseconds since the epoch, to a datetime.
+    Timestamps later than now count as now, so a client with a fast clock can't win every conflict.
+
+    Return: tuple - datetime or None, error message or None
+    '''
+    if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)) or not math.isfinite(timestamp) or timestamp < 0:
+        return None, "Timestamp {!r} must be milliseconds since the epoch.".format(timestamp)
+    try:
+        date_counted = EPOCH + datetime.timedelta(milliseconds=timestamp)
+    except OverflowError:
+        return now, None
+    return min(date_counted, now), None
+
+
+def clean_operation(store, operation, list_ids, item_ids, now):
+    '''
+    Converts a count operation sent by a client to an unsaved SyncOperation.
+    Invalid operations are rejected with a message.
+
+    Return: SyncOperation
+    '''
+    sync_operation = SyncOperation(store=store, op_id=operation["op_id"], status=SyncOperation.APPLIED)
+    errors = []
+
+    list_id = operation.get("list_id")
+    if is_id(list_id) and list_id in list_ids:
+        sync_operation.list_id = list_id
+    else:
+        errors.append("List {!r} is not in this Store.".format(list_id))
+    item_id = operation.get("item_id")
+    if is_id(item_id) and item_id in item_ids:
+        sync_operation.item_id = item_id
+    else:
+        errors.append("Item {!r} is not in this Store.".format(item_id))
+    sync_operation.amount, amount_error = clean_item_amount(operation.get("amount", ""), required=True)
+    if amount_error:
+        errors.append(amount_error)
+    sync_operation.date_counted, timestamp_error = clean_timestamp(operation.get("timestamp"), now)
+    if timestamp_error:
+        errors.append(timestamp_error)
+
+    if errors:
+        sync_operation.status = SyncOperation.REJECTED
+        sync_operation.message = ' '.join(errors)[:SyncOperation._meta.get_field('message').max_length]
+    return sync_operation
+
+
+def latest_operations(operations, list_items):
+    '''
+    Picks the operation that wins each ListItem: the latest by (date_counted, op_id), whatever order they arrived in.
+    An operation only wins if it is later than the count already saved, from list_items.
+
+    Return: dict - SyncOperation for each (list id, item id)
+    '''
+    latest = {}
+    for operation in operations:
+        key = (operation.list_id, operation.item_id)
+        if key not in latest or (operation.date_counted, operation.op_id) > (latest[key].date_counted, latest[key].op_id):
+            latest[key] = operation
+
+    for list_id, item_id, date_counted, op_id in list_items:
+        operation = latest.get((list_id, item_id))
+        if operation is not None and date_counted is not None and (date_counted, op_id) >= (operation.date_counted, operation.op_id):
+            del latest[(list_id, item_id)]
+    return latest
+
+
+def apply_operations(store, operations, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    Applies count operations sent by a client, each at most once, in one transaction.
+    Each operation is a dict: "op_id", "timestamp", "list_id", "item_id", "amount".
+    An op_id the Store has already seen returns its first result again, without being applied.
+    Conflicting counts for a ListItem are resolved by latest_operations(): the others are superseded.
+    Invalid operations are rejected, so they don't hold up the rest of a client's queue.
+
+    Return: tuple - a result for each operation, the Store version
+    '''
+    now = timezone.now()
+    with transaction.atomic():
+
+        # locks the Store, so a replay of the same operations waits for this one
+        version = Store.objects.filter(pk=store.pk).next_version()
+
+        op_ids = [operation.get("op_id") if isinstance(operation, dict) else None for operation in operations]
+        seen = {sync_operation.op_id: sync_operation for sync_operation in store.sync_operations.filter(op_id__in=[op_id for op_id in op_ids if isinstance(op_id, str)])}
+        list_ids = set(store.lists.values_list('id', flat=True))
+        item_ids = set(Item.objects.filter(store=store, pk__in=[
+            operation.get("item_id") for operation in operations if isinstance(operation, dict) and is_id(operation.get("item_id"))
+        ]).values_list('id', flat=True))
+
+        results = []
+        new_operations = {}
+        for operation, op_id in zip(operations, op_ids):
+            op_id_error = clean_op_id(op_id)
+            if op_id_error:
+                results.append({"op_id": op_id, "status": REJECTED_DISPLAY, "message": op_id_error, "duplicate": False})
+            elif op_id in seen or op_id in new_operations:
+                results.append((seen.get(op_id) or new_operations[op_id], True))
+            else:
+                new_operations[op_id] = clean_operation(store, operation, list_ids, item_ids, now)
+                results.append((new_operations[op_id], False))
+
+        valid_operations = [operation for operation in new_operations.values() if operation.status == SyncOperation.APPLIED]
+        list_items = ListItem.objects.filter(
+            list__store=store,
+            list_id__in={operation.list_id for operation in valid_operations},
+            item_id__in={operation.item_id for operation in valid_operations},
+        ).values_list('list_id', 'item_id', 'date_counted', 'op_id')
+        latest = latest_operations(valid_operations, list_items)
+        for operation in valid_operations:
+            if latest.get((operation.list_id, operation.item_id)) is not operation:
+                operation.status = SyncOperation.SUPERSEDED
+
+        # save the winning counts, and the result of every new operation
+        upsert_list_item_rows([
+            (operation.list_id, operation.item_id, operation.amount, operation.date_counted, operation.op_id) for operation in latest.values()
+        ], version, batch_size=batch_size)
+        List.objects.filter(pk__in={operation.list_id for operation in latest.values()}).update(version=version)
+        publish_list_items(store.pk, version, [(operation.list_id, operation.item_id, operation.amount) for operation in latest.values()])
+        SyncOperation.objects.bulk_create(new_operations.values(), batch_size=batch_size)
+
+    return [
+        result if isinstance(result, dict) else dict(result[0].serialize(), duplicate=result[1])
+        for result in results
+    ], version
@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+from stocklist.management.commands.benchmark_api import compare_results, parse_sizes, seed_store
+from stocklist.models import User, Store, List, ListItem, Item, ItemBalance
+
+
+def result(median_ms=10, queries=5, peak_memory_kib=100):
+    return {"runs": 3, "median_ms": median_ms, "p95_ms": median_ms, "min_ms": median_ms, "queries": queries, "peak_memory_kib": peak_memory_kib}
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_seed_store(self):
+        user = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        store = seed_store(user, 10, 4, seed=1)
+        self.assertEqual(Item.objects.filter(store=store).count(), 10)
+        self.assertEqual(list(store.lists.order_by('id').values_list('type', flat=True)), [List.ADDITION, List.SUBTRACTION, List.COUNT, List.ADDITION])
+        self.assertEqual(ListItem.objects.filter(list__store=store).count(), 40)
+        self.assertEqual(ItemBalance.objects.filter(item__store=store).count(), 10)
+
+        # the same seed, the same amounts
+        other = seed_store(user, 10, 4, seed=1)
+        self.assertEqual(
+            list(ListItem.objects.filter(list__store=store).order_by('id').values_list('amount', flat=True)),
+            list(ListItem.objects.filter(list__store=other).order_by('id').values_list('amount', flat=True)),
+        )
+
+    def test_parse_sizes(self):
+        self.assertEqual(parse_sizes('100,5000'), [100, 5000])
+        for value in ['', '100,x', '0']:
+            with self.assertRaises(CommandError):
+                parse_sizes(value)
+
+    def test_compare_results(self):
+        baseline = {"results": {"items 100x2": result(), "create_lists 100x2": result()}}
+        self.assertEqual(compare_results({"results": {"items 100x2": result(median_ms=12), "import_items 100x2": result(median_ms=99)}}, baseline, 0.25), [])
+
+        regressions = compare_results({"results": {"items 100x2": result(median_ms=20, queries=6, peak_memory_kib=200)}}, baseline, 0.25)
+        self.assertEqual(regressions, [
+            'items 100x2: median 20 ms, budget 10 ms',
+            'items 100x2: 6 queries, budget 5',
+            'items 100x2: peak memory 200 KiB, budget 100 KiB',
+        ])
+
+    def test_compare_results_ignores_small_latency_changes(self):
+        baseline = {"results": {"items 100x2": result(median_ms=1)}}
+        self.assertEqual(compare_results({"results": {"items 100x2": result(median_ms=2)}}, baseline, 0.25), [])
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_benchmark_api_command(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'results.json')
+
+        out = StringIO()
+        call_command('benchmark_api', '--database', '--sizes', '10', '--lists', '2', '--repeat', '1', '--import-rows', '10', '--output', output, stdout=out)
+        with open(output) as output_file:
+            results = json.load(output_file)
+        self.assertEqual(len(results["results"]), 6)
+        self.assertGreater(results["results"]["items 10x2"]["queries"], 0)
+        self.assertIsNotNone(results["results"]["delete_store 10x2"]["peak_memory_kib"])
+        # the benchmark User and Stores are deleted
+        self.assertFalse(Store.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+        # a budget of fewer queries fails, whatever the tolerance of latency
+        for name in results["results"]:
+            results["results"][name]["queries"] -= 1
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file)
+        with self.assertRaisesRegex(CommandError, '6 regressions'):
+            call_command('benchmark_api', '--database', '--sizes', '10', '--lists', '2', '--repeat', '1', '--import-rows', '10', '--no-memory', '--budget', output, '--tolerance', '1000', stdout=out)
+
+    def test_benchmark_api_command_uses_a_throwaway_database(self):
+        # run as a process, against the configured database
+        database = settings.BASE_DIR / 'db.sqlite3'
+        before = database.stat() if database.exists() else None
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'results.json')
+
+        subprocess.run([
+            sys.executable, 'manage.py', 'benchmark_api', '--sizes', '10', '--lists', '2', '--repeat', '1', '--import-rows', '10',
+            '--paths', 'items,create_list_item', '--no-memory', '--output', output,
+        ], cwd=settings.BASE_DIR, check=True, capture_output=True)
+        with open(output) as output_file:
+            self.assertEqual(len(json.load(output_file)["results"]), 2)
+        after = database.stat() if database.exists() else None
+        self.assertEqual(before and (before.st_size, before.st_mtime_ns), after and (after.st_size, after.st_mtime_ns))
+
+    def test_benchmark_api_unknown_path(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_api', '--paths', 'items,stock', stdout=StringIO())
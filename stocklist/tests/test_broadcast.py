@@ -0,0 +1,151 @@
+import asyncio
+import json
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+
+from stocklist.broadcast import MAX_QUEUED_EVENTS, Broadcaster, broadcaster, format_event
+from stocklist.events import EventsRouter
+from stocklist.models import User, Store, List, ListItem, Item
+
+
+def parse_event(message):
+    fields = dict(line.split(': ', 1) for line in message.decode().strip().split('\n'))
+    return fields['event'], json.loads(fields['data'])
+
+
+class BroadcasterTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, List, Item
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.list = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.item = Item.objects.create(store=cls.store1, name="Vodka")
+
+        return super().setUpTestData()
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def subscribe(self, broadcaster, store_id):
+        async def subscribe():
+            return broadcaster.subscribe(store_id)
+        return self.loop.run_until_complete(subscribe())
+
+    def next_event(self, queue):
+        return parse_event(self.loop.run_until_complete(asyncio.wait_for(queue.get(), 1)))
+
+    def test_format_event(self):
+        self.assertEqual(format_event('changed', {'version': 3}), b'id: 3\nevent: changed\ndata: {"version": 3}\n\n')
+
+    def test_publish_only_reaches_store_subscribers(self):
+        test_broadcaster = Broadcaster()
+        queue1 = self.subscribe(test_broadcaster, 1)
+        queue2 = self.subscribe(test_broadcaster, 2)
+
+        self.assertEqual(test_broadcaster.publish(1, 'changed', {'version': 1}), 1)
+        self.assertEqual(self.next_event(queue1), ('changed', {'version': 1}))
+        self.assertTrue(queue2.empty())
+
+        test_broadcaster.unsubscribe(1, queue1)
+        self.assertEqual(test_broadcaster.subscriber_count(1), 0)
+        self.assertEqual(test_broadcaster.publish(1, 'changed', {'version': 2}), 0)
+
+    def test_slow_subscriber_gets_changed_event(self):
+        test_broadcaster = Broadcaster()
+        queue = self.subscribe(test_broadcaster, 1)
+        for version in range(MAX_QUEUED_EVENTS + 1):
+            test_broadcaster.publish(1, 'list_items', {'version': version, 'list_items': []})
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(self.next_event(queue), ('changed', {}))
+
+    def test_list_item_save_publishes_after_commit(self):
+        queue = self.subscribe(broadcaster, self.store1.pk)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                list_item = ListItem.objects.create(list=self.list, item=self.item, amount=3)
+                self.loop.run_until_complete(asyncio.sleep(0))
+                self.assertTrue(queue.empty())
+
+            event, data = self.next_event(queue)
+        finally:
+            broadcaster.unsubscribe(self.store1.pk, queue)
+        self.assertEqual(event, 'list_items')
+        self.assertEqual(data, {'version': list_item.version, 'list_items': [{'list_id': self.list.id, 'item_id': self.item.id, 'amount': '3'}]})
+
+
+class StoreEventsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+
+        return super().setUpTestData()
+
+    def request(self, path, cookie=b'', publish=None, application=None):
+        '''
+        Runs an ASGI request, publishing an event once streaming starts, and disconnecting after the first event.
+        '''
+        sent = []
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'headers': [(b'cookie', cookie)]}
+
+        async def run():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                body = message.get('body', b'')
+                if body.startswith(b'retry') and publish:
+                    broadcaster.publish(*publish)
+                elif body.startswith(b'id') or not message.get('more_body', True):
+                    disconnected.set()
+
+            await EventsRouter(application)(scope, receive, send)
+
+        async_to_sync(run)()
+        return sent
+
+    def session_cookie(self):
+        self.client.login(username='Mike', password='1X<ISRUkw+tuK')
+        return 'sessionid={}'.format(self.client.cookies['sessionid'].value).encode()
+
+    def test_store_events_streams_published_events(self):
+        path = '/events/{}'.format(self.store1.pk)
+        sent = self.request(path, self.session_cookie(), publish=(self.store1.pk, 'changed', {'version': 7}))
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(parse_event(sent[2]['body']), ('changed', {'version': 7}))
+        self.assertEqual(broadcaster.subscriber_count(self.store1.pk), 0)
+
+    def test_store_events_returns_404_if_not_logged_in(self):
+        sent = self.request('/events/{}'.format(self.store1.pk))
+        self.assertEqual(sent[0]['status'], 404)
+
+    def test_store_events_returns_404_for_other_users_store(self):
+        store2 = Store.objects.create(user=User.objects.create_user('Other'), name="Other Store")
+        sent = self.request('/events/{}'.format(store2.pk), self.session_cookie())
+        self.assertEqual(sent[0]['status'], 404)
+
+    def test_events_router_passes_other_requests_to_application(self):
+        calls = []
+
+        async def application(scope, receive, send):
+            calls.append(scope['path'])
+
+        self.request('/items/1', application=application)
+        self.assertEqual(calls, ['/items/1'])
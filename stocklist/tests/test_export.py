@@ -0,0 +1,215 @@
+import csv
+import io
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from stocklist.export import (
+    ExportRouter, columnar_batches, columnar_tables, export_csv_lines, export_filename, export_header, export_rows,
+    pyarrow, write_columnar,
+)
+from stocklist.models import User, Store, List, ListItem, Item
+
+
+class ExportCSVTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, Lists, Items
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.stock = List.objects.create(store=cls.store1, name="Stock", type=List.ADDITION)
+        cls.end = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.item1 = Item.objects.create(store=cls.store1, name="Vodka")
+        cls.item2 = Item.objects.create(store=cls.store1, name="Gin, London")
+        cls.item3 = Item.objects.create(store=cls.store1, name="Rum")
+        ListItem.objects.create(list=cls.stock, item=cls.item1, amount=10)
+        ListItem.objects.create(list=cls.end, item=cls.item1, amount='2.5')
+        ListItem.objects.create(list=cls.end, item=cls.item2, amount=4)
+
+        return super().setUpTestData()
+
+    def expected_rows(self):
+        return [
+            ['Item', 'Stock', 'End Count'],
+            ['Vodka', '10.0', '2.5'],
+            ['Gin, London', '', '4.0'],
+            ['Rum', '', ''],
+        ]
+
+    def test_export_header(self):
+        self.assertEqual(export_header([self.stock, self.end]), ['Item', 'Stock', 'End Count'])
+
+    def test_export_rows_pivots_list_items(self):
+        rows = list(export_rows(self.store1, [self.stock, self.end], chunk_size=2))
+        self.assertEqual([row[0] for row in rows], ['Vodka', 'Gin, London', 'Rum'])
+        self.assertEqual(rows[2], ['Rum', '', ''])
+
+    def test_export_csv_lines(self):
+        content = ''.join(export_csv_lines(self.store1))
+        self.assertEqual(list(csv.reader(io.StringIO(content))), self.expected_rows())
+
+    def test_export_csv_lines_query_count_independent_of_items(self):
+        for i in range(20):
+            Item.objects.create(store=self.store1, name="Item {}".format(i))
+
+        # Lists, Items with their ListItems
+        with self.assertNumQueries(2):
+            lines = list(export_csv_lines(self.store1, chunk_size=5))
+        self.assertEqual(len(lines), 24)
+
+    def test_export_filename(self):
+        self.assertEqual(export_filename(Store(name='Bar "1"/2')), 'Bar 12.csv')
+        self.assertEqual(export_filename(Store(name='"')), 'Store.csv')
+
+    def test_GET_export_csv_streams_csv(self):
+        self.client.login(username='Mike', password='1X<ISRUkw+tuK')
+        response = self.client.get('/export/{}.csv'.format(self.store1.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="Test Store.csv"')
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(list(csv.reader(io.StringIO(content))), self.expected_rows())
+
+    def test_GET_export_csv_redirects_to_login_if_not_logged_in(self):
+        response = self.client.get('/export/{}.csv'.format(self.store1.pk))
+        self.assertEqual(response.status_code, 302)
+
+    def test_GET_export_csv_returns_404_for_other_users_store(self):
+        store2 = Store.objects.create(user=User.objects.create_user('Other'), name="Other Store")
+        self.client.login(username='Mike', password='1X<ISRUkw+tuK')
+        response = self.client.get('/export/{}.csv'.format(store2.pk))
+        self.assertEqual(response.status_code, 404)
+
+    def test_POST_export_csv_returns_400(self):
+        self.client.login(username='Mike', password='1X<ISRUkw+tuK')
+        response = self.client.post('/export/{}.csv'.format(self.store1.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def request(self, path, cookie=b'', application=None):
+        '''
+        Runs an ASGI request through ExportRouter.
+        '''
+        sent = []
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'headers': [(b'cookie', cookie)]}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(ExportRouter(application))(scope, receive, send)
+        return sent
+
+    def session_cookie(self):
+        self.client.login(username='Mike', password='1X<ISRUkw+tuK')
+        return 'sessionid={}'.format(self.client.cookies['sessionid'].value).encode()
+
+    def test_store_export_streams_csv_under_asgi(self):
+        sent = self.request('/export/{}.csv'.format(self.store1.pk), self.session_cookie())
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/csv; charset=utf-8'), sent[0]['headers'])
+        self.assertFalse(sent[-1]['more_body'])
+        content = b''.join(message['body'] for message in sent[1:]).decode()
+        self.assertEqual(list(csv.reader(io.StringIO(content))), self.expected_rows())
+
+    def test_store_export_returns_404_if_not_logged_in(self):
+        sent = self.request('/export/{}.csv'.format(self.store1.pk))
+        self.assertEqual(sent[0]['status'], 404)
+
+    def test_export_router_passes_other_requests_to_application(self):
+        calls = []
+
+        async def application(scope, receive, send):
+            calls.append(scope['path'])
+
+        self.request('/export/{}'.format(self.store1.pk), application=application)
+        self.assertEqual(calls, ['/export/{}'.format(self.store1.pk)])
+
+
+class ColumnarExportTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, Lists, Items
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.stock = List.objects.create(store=cls.store1, name="Stock", type=List.ADDITION)
+        cls.end = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.item1 = Item.objects.create(store=cls.store1, name="Vodka")
+        cls.item2 = Item.objects.create(store=cls.store1, name="Gin")
+        cls.item3 = Item.objects.create(store=cls.store1, name="Rum")
+        ListItem.objects.create(list=cls.stock, item=cls.item1, amount=10)
+        ListItem.objects.create(list=cls.end, item=cls.item1, amount='2.5')
+        ListItem.objects.create(list=cls.end, item=cls.item2, amount=4)
+
+        return super().setUpTestData()
+
+    def test_columnar_tables(self):
+        tables = {name: (queryset, fields) for name, queryset, fields in columnar_tables(self.store1)}
+        self.assertEqual(list(tables), ['items', 'lists', 'list_items'])
+        self.assertEqual(tables['list_items'][0].count(), 3)
+
+    def test_columnar_batches_transposes_rows(self):
+        queryset = Item.objects.filter(store=self.store1).order_by('id')
+        batches = list(columnar_batches(queryset, ['id', 'name'], batch_size=2))
+        self.assertEqual(batches, [
+            {'id': [self.item1.pk, self.item2.pk], 'name': ['Vodka', 'Gin']},
+            {'id': [self.item3.pk], 'name': ['Rum']},
+        ])
+
+    def test_columnar_batches_keeps_decimal_amounts_and_datetimes(self):
+        queryset = ListItem.objects.filter(list=self.end).order_by('id')
+        batch = next(columnar_batches(queryset, ['amount'], batch_size=10))
+        self.assertEqual(batch['amount'], [Decimal('2.5'), Decimal('4.0')])
+        self.assertIsInstance(batch['amount'][0], Decimal)
+
+        batch = next(columnar_batches(List.objects.filter(pk=self.stock.pk), ['date_added'], batch_size=10))
+        self.assertEqual(batch['date_added'], [self.stock.date_added])
+
+    def test_columnar_batches_empty_queryset(self):
+        self.assertEqual(list(columnar_batches(Item.objects.none(), ['id'])), [])
+
+    def test_write_columnar_unknown_format_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            write_columnar(self.store1, tempfile.gettempdir(), format='xml')
+
+    @mock.patch('stocklist.export.pyarrow', None)
+    def test_export_columnar_command_without_pyarrow_raises_CommandError(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaisesMessage(CommandError, 'pyarrow'):
+                call_command('export_columnar', self.store1.pk, directory, stdout=io.StringIO())
+
+    def test_export_columnar_command_invalid_store_raises_CommandError(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(CommandError):
+                call_command('export_columnar', 0, directory, stdout=io.StringIO())
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_write_columnar_parquet(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_columnar(self.store1, directory, format='parquet', batch_size=2)
+            self.assertEqual([os.path.basename(path) for path in paths], ['items.parquet', 'lists.parquet', 'list_items.parquet'])
+
+            list_items = pyarrow.parquet.read_table(paths[2])
+            self.assertEqual(list_items.schema.field('amount').type, pyarrow.decimal128(7, 1))
+            self.assertEqual(list_items.column('amount').to_pylist(), [Decimal('10.0'), Decimal('2.5'), Decimal('4.0')])
+
+            lists = pyarrow.parquet.read_table(paths[1])
+            self.assertEqual(lists.schema.field('date_added').type, pyarrow.timestamp('us', tz='UTC'))
+            self.assertEqual(lists.column('date_added').to_pylist(), [self.stock.date_added, self.end.date_added])
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_write_columnar_feather(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_columnar(self.store1, directory, format='feather')
+            items = pyarrow.ipc.open_file(paths[0]).read_all()
+            self.assertEqual(items.column('name').to_pylist(), ['Vodka', 'Gin', 'Rum'])
@@ -0,0 +1,370 @@
+import codecs
+import csv
+import datetime
+import io
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from stocklist.importer import (
+    ImportValidationError, batched, cell_text, clean_header_row, commit_lists, clean_item_amount, clean_list_item_amounts, import_lists,
+    import_xlsx, is_xlsx, openpyxl, read_csv, read_sheet, upsert_list_items, validate_lists, xlsx_preview, xlsx_rows,
+)
+from stocklist.models import User, Store, List, ListItem, Item
+
+
+class ImportListsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, Item
+        cls.user1 = User.objects.create_user('Mike')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.item_name = "Bacardi Superior 70CL BTL"
+        cls.item = Item.objects.create(store=cls.store1, name=cls.item_name)
+
+        return super().setUpTestData()
+
+    def test_clean_item_amount_defaults_missing_amounts(self):
+        for amount in ['', 'null', None]:
+            self.assertEqual(clean_item_amount(amount), (Decimal('0'), None))
+
+    def test_clean_item_amount_returns_error_for_missing_required_amount(self):
+        for amount in ['', 'null', None]:
+            self.assertEqual(clean_item_amount(amount, required=True), (None, "Amount is required."))
+
+    def test_clean_item_amount_converts_numbers(self):
+        self.assertEqual(clean_item_amount(9.5), (Decimal('9.5'), None))
+        self.assertEqual(clean_item_amount('100000'), (Decimal('100000'), None))
+        self.assertEqual(clean_item_amount('1.50'), (Decimal('1.50'), None))
+
+    def test_clean_item_amount_returns_error_for_invalid_amount(self):
+        for amount in ['-1', '100000.1', '1.25', 'ten', 'NaN']:
+            value, error = clean_item_amount(amount)
+            self.assertIsNone(value)
+            self.assertTrue(error)
+
+    def test_import_lists_uses_existing_items(self):
+        data = [{'name':'Stock', 'type':'AD', 'items':[{'name':self.item_name, 'amount':'3'}, {'name':'New Item', 'amount':'4'}]}]
+        import_lists(self.store1, data, batch_size=1)
+
+        self.assertEqual(Item.objects.filter(store=self.store1).count(), 2)
+        list_item = ListItem.objects.get(item=self.item)
+        self.assertEqual(list_item.amount, Decimal('3'))
+        self.assertEqual(ListItem.objects.get(item__name='New Item').amount, Decimal('4'))
+
+    def test_import_lists_shares_new_items_between_lists(self):
+        data = [
+            {'name':'Import', 'type':'AD', 'items':[{'name':'New Item', 'amount':'4'}]},
+            {'name':'Start', 'items':[{'name':'New Item', 'amount':'2'}]},
+        ]
+        import_lists(self.store1, data)
+
+        self.assertEqual(Item.objects.filter(store=self.store1, name='New Item').count(), 1)
+        self.assertEqual(ListItem.objects.filter(item__name='New Item').count(), 2)
+
+    def test_import_lists_links_normalized_names_to_existing_items(self):
+        data = [{'name':'Stock', 'type':'AD', 'items':[{'name':'bacardi superior 70cl btl', 'amount':'3'}]}]
+        import_lists(self.store1, data)
+
+        self.assertEqual(Item.objects.filter(store=self.store1).count(), 1)
+        self.assertEqual(ListItem.objects.get(item=self.item).amount, Decimal('3'))
+
+    def test_import_lists_shares_new_items_for_normalized_names(self):
+        data = [
+            {'name':'Import', 'type':'AD', 'items':[{'name':'New Item', 'amount':'4'}]},
+            {'name':'Start', 'items':[{'name':'NEW ITEM.', 'amount':'2'}]},
+        ]
+        import_lists(self.store1, data)
+
+        self.assertEqual(Item.objects.filter(store=self.store1, name__iexact='New Item').count(), 1)
+        self.assertEqual(ListItem.objects.filter(item__name='New Item').count(), 2)
+
+    def test_import_lists_reports_similar_items(self):
+        data = [{'name':'Stock', 'type':'AD', 'items':[{'name':'Bacardi Superior 70 CL BTL'}, {'name':'Havana Club'}]}]
+        matches = []
+        import_lists(self.store1, data, matches=matches)
+
+        self.assertEqual(len(matches), 1)
+        self.assertEqual(matches[0]['name'], 'Bacardi Superior 70 CL BTL')
+        self.assertEqual(matches[0]['candidates'][0]['item_id'], self.item.pk)
+        self.assertEqual(Item.objects.filter(store=self.store1).count(), 3)
+
+    def test_import_lists_returns_skipped_rows(self):
+        data = [{'name':'Stock', 'items':[{'name':'', 'amount':'3'}, {'amount':'3'}, {'name':'New Item'}]}]
+        imported, skipped = import_lists(self.store1, data)
+
+        self.assertEqual(imported, 1)
+        self.assertEqual(skipped, 2)
+        self.assertEqual(List.objects.get(name='Stock').list_items.count(), 1)
+
+    def test_import_lists_raises_for_duplicate_item_in_list(self):
+        data = [{'name':'Stock', 'items':[{'name':'New Item'}, {'name':'New Item'}]}]
+        with self.assertRaises(ValidationError):
+            import_lists(self.store1, data)
+
+    def test_import_lists_raises_for_normalized_duplicate_item_in_list(self):
+        data = [{'name':'Stock', 'items':[{'name':'New Item'}, {'name':'new  item'}]}]
+        with self.assertRaises(ImportValidationError) as context:
+            import_lists(self.store1, data)
+        self.assertEqual(context.exception.report[0]['row'], 1)
+
+    def test_import_lists_saves_nothing_for_duplicate_item_in_later_batch(self):
+        data = [{'name':'Stock', 'items':[{'name':'New Item'}, {'name':'Other Item'}, {'name':'New Item'}]}]
+        with self.assertRaises(ImportValidationError) as context:
+            import_lists(self.store1, data, batch_size=2)
+        self.assertEqual(context.exception.report[0]['row'], 2)
+        self.assertFalse(List.objects.filter(name='Stock').exists())
+
+    def test_commit_lists_saves_each_batch_with_its_own_version(self):
+        data = [{'name':'Stock', 'items':[{'name':'Item {}'.format(i)} for i in range(5)] + [{'name':''}]}, {'name':'End'}]
+        progress = []
+        imported, skipped = commit_lists(self.store1, data, lambda *args: progress.append(args), batch_size=2)
+
+        stock = List.objects.get(name='Stock')
+        end = List.objects.get(name='End')
+        self.assertEqual((imported, skipped), (5, 1))
+        self.assertEqual(progress, [(stock.pk, 0, 0), (stock.pk, 2, 0), (stock.pk, 2, 0), (stock.pk, 1, 1), (end.pk, 0, 0)])
+        self.assertEqual(len(set(stock.list_items.values_list('version', flat=True))), 3)
+        self.assertEqual(stock.version, stock.list_items.order_by('-version').first().version)
+
+    def test_commit_lists_resumes_after_saved_rows(self):
+        data = [{'name':'Stock', 'items':[{'name':'Item {}'.format(i)} for i in range(5)]}, {'name':'End'}]
+
+        # interrupted in the second batch
+        saved = []
+        def progress(list_id, imported, skipped):
+            if len(saved) == 2:
+                raise RuntimeError('interrupted')
+            saved.append((list_id, imported + skipped))
+        with self.assertRaises(RuntimeError):
+            commit_lists(self.store1, data, progress, batch_size=2)
+
+        stock = List.objects.get(name='Stock')
+        imported, skipped = commit_lists(self.store1, data, lambda *args: None, batch_size=2, list_ids=[stock.pk], skip_rows=2)
+        self.assertEqual((imported, skipped), (3, 0))
+        self.assertEqual(List.objects.filter(name='Stock').count(), 1)
+        self.assertEqual(sorted(stock.list_items.values_list('item__name', flat=True)), ['Item {}'.format(i) for i in range(5)])
+        self.assertTrue(List.objects.filter(name='End').exists())
+
+    def test_validate_lists_limits_report(self):
+        data = [{'name':'Stock', 'items':[{'name':'Item {}'.format(i), 'amount':'-1'} for i in range(10)]}]
+        with self.assertRaises(ImportValidationError) as context:
+            validate_lists(data, max_errors=3)
+        self.assertEqual(len(context.exception.report), 3)
+        self.assertEqual(context.exception.error_count, 10)
+        self.assertEqual(context.exception.messages[-1], '7 more errors.')
+
+    def test_validate_lists_allows_same_item_in_different_lists(self):
+        data = [{'name':'Start', 'items':[{'name':'New Item'}]}, {'name':'End', 'items':[{'name':'New Item'}]}]
+        validate_lists(data)
+
+    def test_validate_lists_reports_malformed_lists_and_rows(self):
+        data = [{'name':['Stock'], 'type':'AD'}, {'name':'Start', 'items':'Vodka'}, {'name':'End', 'items':[None, {'name':'Gin'}]}]
+        with self.assertRaises(ImportValidationError) as context:
+            validate_lists(data)
+        self.assertEqual(
+            [(error['list'], error['row'], error['field']) for error in context.exception.report],
+            [(0, None, 'name'), (1, None, 'items'), (2, 0, 'row')]
+        )
+
+
+class UpsertListItemsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, List, Items
+        cls.user1 = User.objects.create_user('Mike')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.list = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.items = [Item.objects.create(store=cls.store1, name="Item {}".format(i)) for i in range(5)]
+
+        return super().setUpTestData()
+
+    def test_clean_list_item_amounts(self):
+        data = [{'item_id':self.items[0].id, 'amount':'1.5'}, {'item_id':self.items[1].id, 'amount':0}]
+        self.assertEqual(clean_list_item_amounts(self.list, data), {self.items[0].id: Decimal('1.5'), self.items[1].id: Decimal('0')})
+
+    def test_clean_list_item_amounts_raises_for_missing_amounts(self):
+        data = [{'item_id':self.items[0].id}, {'item_id':self.items[1].id, 'amount':''}, {'item_id':self.items[2].id, 'amount':None}]
+        with self.assertRaises(ImportValidationError) as context:
+            clean_list_item_amounts(self.list, data)
+        self.assertEqual([error['field'] for error in context.exception.report], ['amount'] * 3)
+
+    def test_clean_list_item_amounts_raises_for_invalid_item_ids(self):
+        data = [{'item_id':'1'}, {'item_id':True}, {'amount':'1'}, 'row']
+        with self.assertRaises(ImportValidationError) as context:
+            clean_list_item_amounts(self.list, data)
+        self.assertEqual(context.exception.error_count, 4)
+
+    def test_upsert_list_items_creates_and_updates_in_batches(self):
+        ListItem.objects.create(list=self.list, item=self.items[0], amount=1)
+        amounts = {item.id: Decimal(i) for i, item in enumerate(self.items)}
+
+        # savepoint, version, List, one statement for each batch, then saved amounts, Lists & 2 for balances
+        with self.assertNumQueries(5 + 3 + 4):
+            version = upsert_list_items(self.list, amounts, batch_size=2)
+
+        self.assertEqual(dict(ListItem.objects.filter(list=self.list).values_list('item_id', 'amount')), amounts)
+        self.assertEqual(set(ListItem.objects.filter(list=self.list).values_list('version', flat=True)), {version})
+        self.assertEqual(List.objects.get(pk=self.list.pk).version, version)
+
+
+class ReadCSVTestCase(TestCase):
+
+    CSV_LINES = [
+        'Item,Size,Amount\r\n',
+        'Vodka,70cl,10\r\n',
+        'Gin,,5\r\n',
+        ',,\r\n',
+    ]
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_read_csv_joins_name_fields(self):
+        rows = list(read_csv(self.CSV_LINES, ['Item', 'Size'], 'Amount'))
+        self.assertEqual(rows[0], {'name':'Vodka 70cl', 'amount':'10'})
+        self.assertEqual(rows[1], {'name':'Gin', 'amount':'5'})
+        self.assertEqual(rows[2], {'name':'', 'amount':''})
+
+    def test_read_csv_without_amount_field(self):
+        rows = list(read_csv(self.CSV_LINES, ['Item']))
+        self.assertEqual(rows[0], {'name':'Vodka', 'amount':''})
+
+    def test_read_csv_raises_for_missing_name_fields(self):
+        with self.assertRaises(ValidationError):
+            read_csv(self.CSV_LINES, [])
+
+    def test_read_csv_raises_for_unknown_field(self):
+        with self.assertRaises(ValidationError):
+            read_csv(self.CSV_LINES, ['Item'], 'Cost')
+
+    def test_read_csv_raises_for_non_utf8_line(self):
+        lines = codecs.iterdecode([line.encode() for line in self.CSV_LINES[:2]] + [b'Caf\xe9,,2\r\n'], 'utf-8')
+        with self.assertRaisesMessage(ValidationError, 'line 3 is not UTF-8'):
+            list(read_csv(lines, ['Item'], 'Amount'))
+
+    def test_read_csv_raises_for_unreadable_line(self):
+        lines = self.CSV_LINES[:2] + ['{},,2\r\n'.format('x' * (csv.field_size_limit() + 1))]
+        with self.assertRaisesMessage(ValidationError, 'line 3 can\'t be read'):
+            list(read_csv(lines, ['Item'], 'Amount'))
+
+
+def xlsx_file(sheets, name='test_data.xlsx'):
+    '''
+    An uploaded XLSX file with a sheet for each (title, rows) in sheets.
+    '''
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets:
+        worksheet = workbook.create_sheet(title)
+        for row in rows:
+            worksheet.append(row)
+    content = io.BytesIO()
+    workbook.save(content)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+class ReadSheetTestCase(TestCase):
+
+    SHEET_ROWS = [
+        ('Stock Take', None, None),
+        ('Item', 'Size', 'Amount'),
+        ('Vodka', '70cl', 10),
+        ('Gin', None, 2.5),
+        (1664, 33.0),
+        (None, None, None),
+    ]
+
+    def test_is_xlsx(self):
+        self.assertTrue(is_xlsx(SimpleUploadedFile('Stock.XLSX', b'')))
+        self.assertFalse(is_xlsx(SimpleUploadedFile('stock.csv', b'')))
+
+    def test_clean_header_row(self):
+        self.assertEqual(clean_header_row(None), 1)
+        self.assertEqual(clean_header_row('3'), 3)
+        for value in ['0', '-1', 'two']:
+            with self.assertRaises(ValidationError):
+                clean_header_row(value)
+
+    def test_cell_text(self):
+        self.assertEqual(cell_text(None), '')
+        self.assertEqual(cell_text(33.0), '33')
+        self.assertEqual(cell_text(2.5), '2.5')
+        self.assertEqual(cell_text(datetime.date(2022, 3, 1)), '2022-03-01')
+
+    def test_read_sheet_skips_to_header_row(self):
+        rows = list(read_sheet(self.SHEET_ROWS, ['Item', 'Size'], 'Amount', header_row=2))
+        self.assertEqual(rows[0], {'name':'Vodka 70cl', 'amount':10})
+        self.assertEqual(rows[1], {'name':'Gin', 'amount':2.5})
+        self.assertEqual(rows[2], {'name':'1664 33', 'amount':None})
+        self.assertEqual(rows[3], {'name':'', 'amount':None})
+
+    def test_read_sheet_without_amount_field(self):
+        rows = list(read_sheet(self.SHEET_ROWS, ['Item'], header_row=2))
+        self.assertEqual(rows[0], {'name':'Vodka', 'amount':''})
+
+    def test_read_sheet_raises_for_missing_name_fields(self):
+        with self.assertRaises(ValidationError):
+            read_sheet(self.SHEET_ROWS, [], header_row=2)
+
+    def test_read_sheet_raises_for_unknown_field(self):
+        with self.assertRaises(ValidationError):
+            read_sheet(self.SHEET_ROWS, ['Item'], header_row=1)
+
+    def test_read_sheet_raises_for_missing_header_row(self):
+        with self.assertRaises(ValidationError):
+            read_sheet(self.SHEET_ROWS, ['Item'], header_row=10)
+
+    def test_read_sheet_rows_are_valid_import_data(self):
+        validate_lists([{'name':'Import', 'items':read_sheet(self.SHEET_ROWS, ['Item', 'Size'], 'Amount', header_row=2)}])
+
+    @mock.patch('stocklist.importer.openpyxl', None)
+    def test_xlsx_rows_without_openpyxl_raises_ValidationError(self):
+        with self.assertRaisesMessage(ValidationError, 'openpyxl'):
+            next(xlsx_rows(SimpleUploadedFile('test_data.xlsx', b'')))
+
+
+@skipUnless(openpyxl, 'openpyxl is not installed')
+class ImportXLSXTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        return super().setUpTestData()
+
+    def setUp(self):
+        self.xlsx_file = xlsx_file([
+            ('Notes', [('Not this sheet',)]),
+            ('Stock', ReadSheetTestCase.SHEET_ROWS),
+        ])
+
+    def test_xlsx_preview(self):
+        sheets = xlsx_preview(self.xlsx_file, preview_rows=3)
+        self.assertEqual([sheet['name'] for sheet in sheets], ['Notes', 'Stock'])
+        self.assertEqual(len(sheets[1]['rows']), 3)
+        self.assertEqual(sheets[1]['rows'][2], ['Vodka', '70cl', 10])
+
+    def test_xlsx_rows_reads_selected_sheet(self):
+        self.assertEqual(next(xlsx_rows(self.xlsx_file))[0], 'Not this sheet')
+        self.assertEqual(next(xlsx_rows(self.xlsx_file, 'Stock'))[0], 'Stock Take')
+
+    def test_xlsx_rows_raises_for_unknown_sheet(self):
+        with self.assertRaises(ValidationError):
+            next(xlsx_rows(self.xlsx_file, 'Counts'))
+
+    def test_xlsx_rows_raises_for_invalid_file(self):
+        with self.assertRaises(ValidationError):
+            next(xlsx_rows(SimpleUploadedFile('test_data.xlsx', b'Item,Amount')))
+
+    def test_import_xlsx(self):
+        imported, skipped = import_xlsx(self.store1, self.xlsx_file, ['Item', 'Size'], 'Amount', sheet='Stock', header_row=2)
+        self.assertEqual((imported, skipped), (3, 1))
+        self.assertEqual(ListItem.objects.get(item__name='Gin', list__store=self.store1).amount, Decimal('2.5'))
+        self.assertEqual(ListItem.objects.get(item__name='1664 33', list__store=self.store1).amount, Decimal('0'))
@@ -0,0 +1,214 @@
+import datetime
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from stocklist.importer import openpyxl
+from stocklist.jobs import JobHeartbeat, claim_next_job, enqueue_import, requeue_interrupted_jobs, run_import_job, work
+from stocklist.models import User, Store, List, ListItem, Item, ImportJob
+from stocklist.tests import test_importer
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImportJobTestCase(TestCase):
+
+    import_data = [
+        {'name':'Import', 'type':'AD', 'items':[{'name':'Vodka', 'amount':'10'}, {'name':'', 'amount':'1'}]},
+        {'name':'Start'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store
+        cls.user1 = User.objects.create_user('Mike')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+
+        return super().setUpTestData()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_enqueue_import_creates_pending_job(self):
+        job = enqueue_import(self.store1, self.import_data)
+        self.assertEqual(job.status, ImportJob.PENDING)
+        self.assertEqual(List.objects.count(), 0)
+
+    def test_claim_next_job_claims_oldest_pending_job(self):
+        job1 = enqueue_import(self.store1, self.import_data)
+        job2 = enqueue_import(self.store1, self.import_data)
+
+        self.assertEqual(claim_next_job(), job1)
+        self.assertEqual(claim_next_job(), job2)
+        self.assertIsNone(claim_next_job())
+        self.assertEqual(ImportJob.objects.get(pk=job1.pk).status, ImportJob.RUNNING)
+
+    def test_requeue_interrupted_jobs(self):
+        job = enqueue_import(self.store1, self.import_data)
+        claim_next_job()
+
+        # another worker's job is left running while its heartbeat is fresh
+        self.assertEqual(requeue_interrupted_jobs(), 0)
+        self.assertEqual(ImportJob.objects.get(pk=job.pk).status, ImportJob.RUNNING)
+
+        ImportJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual(requeue_interrupted_jobs(), 1)
+        self.assertEqual(ImportJob.objects.get(pk=job.pk).status, ImportJob.PENDING)
+
+    def test_run_import_job_records_result(self):
+        job = run_import_job(enqueue_import(self.store1, self.import_data))
+
+        job = ImportJob.objects.get(pk=job.pk)
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.rows_processed, 1)
+        self.assertEqual(job.rows_skipped, 1)
+        self.assertIsNotNone(job.date_finished)
+        self.assertEqual(List.objects.filter(store=self.store1).count(), 2)
+        self.assertEqual(job.list_ids, list(List.objects.filter(store=self.store1).order_by('id').values_list('id', flat=True)))
+
+    def test_run_import_job_resumes_interrupted_job(self):
+        import_data = [{'name':'Import', 'type':'AD', 'items':[{'name':'Vodka', 'amount':'10'}, {'name':'Gin', 'amount':'5'}]}, {'name':'Start'}]
+        job = enqueue_import(self.store1, import_data)
+
+        # the worker saved the first row, then stopped
+        import_list = List.objects.create(store=self.store1, name='Import', type=List.ADDITION)
+        ListItem.objects.create(list=import_list, item=Item.objects.create(store=self.store1, name='Vodka'), amount=10)
+        ImportJob.objects.filter(pk=job.pk).update(list_ids=[import_list.pk], rows_processed=1)
+        job = run_import_job(claim_next_job())
+
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.rows_processed, 2)
+        self.assertEqual(List.objects.filter(store=self.store1, name='Import').count(), 1)
+        self.assertEqual(sorted(import_list.list_items.values_list('item__name', flat=True)), ['Gin', 'Vodka'])
+        self.assertTrue(List.objects.filter(store=self.store1, name='Start').exists())
+
+    def test_run_import_job_records_similar_items(self):
+        item = Item.objects.create(store=self.store1, name='Absolut Vodka 70cl')
+        job = run_import_job(enqueue_import(self.store1, [{'name':'Import', 'items':[{'name':'Absolut Vodka 70 cl'}]}]))
+
+        job = ImportJob.objects.get(pk=job.pk)
+        self.assertEqual(job.serialize()['matches'][0]['candidates'][0]['item_id'], item.pk)
+
+    def test_run_import_job_saves_nothing_for_invalid_data(self):
+        import_data = [{'name':'Import', 'items':[{'name':'Vodka', 'amount':'10'}, {'name':'Gin', 'amount':'-1'}]}]
+        job = run_import_job(enqueue_import(self.store1, import_data))
+
+        job = ImportJob.objects.get(pk=job.pk)
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertTrue(job.errors)
+        self.assertEqual(List.objects.count(), 0)
+        self.assertEqual(Item.objects.count(), 0)
+
+    def test_run_import_job_imports_csv_file(self):
+        csv_file = SimpleUploadedFile('test_data.csv', b'Item,Amount\nVodka,10\nGin,5\n')
+        job = enqueue_import(self.store1, [{'name':'Import', 'type':'AD'}], csv_file, ['Item'], 'Amount')
+        job = run_import_job(job)
+
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.rows_processed, 2)
+        self.assertFalse(job.csv_file)
+        self.assertEqual(ListItem.objects.get(item__name='Gin').amount, Decimal('5'))
+
+    @skipUnless(openpyxl, 'openpyxl is not installed')
+    def test_run_import_job_imports_xlsx_sheet(self):
+        xlsx_file = test_importer.xlsx_file([('Notes', []), ('Stock', [('Count',), ('Item', 'Amount'), ('Vodka', 10), ('Gin', 5)])])
+        job = enqueue_import(self.store1, [{'name':'Import', 'type':'AD'}], xlsx_file, ['Item'], 'Amount', 'Stock', 2)
+        job = run_import_job(job)
+
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.rows_processed, 2)
+        self.assertEqual(ListItem.objects.get(item__name='Gin').amount, Decimal('5'))
+
+    def test_work_once_runs_queued_jobs(self):
+        enqueue_import(self.store1, self.import_data)
+        enqueue_import(self.store1, [{'name':'Start'}])
+
+        self.assertEqual(work(once=True), 2)
+        self.assertFalse(ImportJob.objects.exclude(status=ImportJob.DONE).exists())
+
+    def test_import_worker_command_runs_interrupted_jobs(self):
+        job = enqueue_import(self.store1, self.import_data)
+        claim_next_job()
+        ImportJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - datetime.timedelta(seconds=30))
+
+        out = StringIO()
+        call_command('import_worker', once=True, lease=10, stdout=out)
+        self.assertIn('Requeued 1 interrupted jobs.', out.getvalue())
+        self.assertEqual(ImportJob.objects.get(pk=job.pk).status, ImportJob.DONE)
+
+
+class JobHeartbeatTestCase(TransactionTestCase):
+
+    def test_heartbeat_records_heartbeat_from_its_own_connection(self):
+        store = Store.objects.create(user=User.objects.create_user('Mike'), name="Test Store")
+        job = enqueue_import(store, [{'name':'Start'}])
+        claim_next_job()
+        ImportJob.objects.filter(pk=job.pk).update(heartbeat=None)
+
+        heartbeat = JobHeartbeat(job.pk, interval=0.05)
+        heartbeat.start()
+        try:
+            for i in range(100):
+                job = ImportJob.objects.get(pk=job.pk)
+                if job.heartbeat:
+                    break
+                time.sleep(0.05)
+        finally:
+            heartbeat.stop()
+        self.assertIsNotNone(job.heartbeat)
+
+    def test_job_progress_is_seen_from_another_connection_while_it_runs(self):
+        store = Store.objects.create(user=User.objects.create_user('Mike'), name="Test Store")
+        job = enqueue_import(store, [{'name':'Import', 'items':[{'name':'Item {}'.format(i)} for i in range(5)]}])
+        job = claim_next_job()
+        reached = threading.Event()
+        resume = threading.Event()
+
+        def rows(data):
+            # the saving pass stops before its third row, after the first batch is saved
+            for i, row in enumerate(data[0]['items']):
+                if i == 2 and calls == 2:
+                    reached.set()
+                    resume.wait(10)
+                yield row
+
+        def import_data(job):
+            nonlocal calls
+            calls += 1
+            return [dict(job.lists[0], items=rows(job.lists))]
+
+        def run():
+            try:
+                run_import_job(job, batch_size=2)
+            finally:
+                connection.close()
+
+        calls = 0
+        with mock.patch('stocklist.jobs.job_import_data', import_data):
+            worker = threading.Thread(target=run)
+            worker.start()
+            try:
+                self.assertTrue(reached.wait(10))
+                running = ImportJob.objects.get(pk=job.pk)
+                self.assertEqual((running.status, running.rows_processed), (ImportJob.RUNNING, 2))
+                self.assertEqual(ListItem.objects.filter(list__store=store).count(), 2)
+            finally:
+                resume.set()
+                worker.join()
+
+        job = ImportJob.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.rows_processed), (ImportJob.DONE, 5))
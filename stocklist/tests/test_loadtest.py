@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from urllib.parse import urlsplit
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, LiveServerTestCase
+
+from stocklist.loadtest import Client, Results, run_users
+from stocklist.management.commands.load_test import summarize_results
+from stocklist.models import List, ListItem
+from stocklist.stockdata import generate_stockdata
+
+
+class LoadTestResultsTestCase(SimpleTestCase):
+
+    def test_results_record(self):
+        results = Results()
+        results.record('items', 0.1)
+        results.record('create_list_item', 0.2, '500', locked=True)
+        results.record('create_list_item', 0.3, '500')
+        self.assertEqual(results.as_dict(), {
+            "latencies": {"items": [0.1], "create_list_item": [0.2, 0.3]},
+            "errors": {"create_list_item": {"500": 2}},
+            "locked": {"create_list_item": 1},
+        })
+
+    def test_summarize_results_merges_processes(self):
+        first, second = Results(), Results()
+        for i in range(99):
+            first.record('create_list_item', 0.01)
+        second.record('create_list_item', 1, '500', locked=True)
+        second.record('export_csv', 0.5, 'timeout')
+        summary = summarize_results([first.as_dict(), second.as_dict()], 10)
+
+        self.assertEqual(list(summary), ['create_list_item', 'export_csv', 'total'])
+        self.assertEqual(summary['create_list_item']['requests'], 100)
+        self.assertEqual(summary['create_list_item']['error_rate'], 0.01)
+        self.assertEqual(summary['create_list_item']['locked'], 1)
+        self.assertEqual(summary['create_list_item']['p50_ms'], 10)
+        self.assertEqual(summary['create_list_item']['p99_ms'], 1000)
+        self.assertEqual(summary['total']['requests'], 101)
+        self.assertEqual(summary['total']['error_kinds'], {'500': 1, 'timeout': 1})
+        self.assertEqual(summary['total']['per_second'], 10.1)
+
+    def test_client_keeps_cookies(self):
+        client = Client('127.0.0.1', 80, 1)
+        client.set_cookie('csrftoken=abc; expires=Thu, 01 Jan 2099 00:00:00 GMT; Max-Age=31449600; Path=/; SameSite=Lax')
+        client.set_cookie('sessionid=xyz; HttpOnly; Path=/')
+        self.assertEqual(client.cookies, {'csrftoken': 'abc', 'sessionid': 'xyz'})
+        client.set_cookie('sessionid=""; expires=Thu, 01 Jan 1970 00:00:00 GMT; Max-Age=0; Path=/')
+        self.assertEqual(client.cookies, {'csrftoken': 'abc'})
+
+
+class LoadTestTestCase(LiveServerTestCase):
+
+    def setUp(self):
+        generate_stockdata(1, 1, 20, 3, seed=1)
+        url = urlsplit(self.live_server_url)
+        self.options = {
+            "host": url.hostname, "port": url.port, "accounts": 1, "prefix": "stockdata", "password": "stockdata", "sessions": 1,
+            "counts": 10, "batch_size": 0, "import_every": 5, "export_every": 10, "think_time": 0, "timeout": 30, "seed": 0,
+        }
+
+    # the test database is in memory, where concurrent writes fail, so virtual users run one at a time
+    def test_run_users(self):
+        result = run_users(range(1), self.options)
+        self.assertEqual(result["failed"], [])
+        self.assertEqual(result["errors"], {})
+        self.assertEqual({name: len(values) for name, values in result["latencies"].items()}, {
+            "login": 2, "open_store": 2, "items": 1, "create_list_item": 10, "import_items": 2, "export_csv": 1,
+        })
+        # counted into the Store's latest Count, with a Delivery imported every 5 counts
+        count_list = List.counts.filter(store__user__username='stockdata1').order_by('id').last()
+        self.assertTrue(ListItem.objects.filter(list=count_list, date_counted__gt=count_list.date_added).exists())
+        self.assertEqual(List.additions.filter(store__user__username='stockdata1', name='Load Delivery 1').count(), 2)
+
+    def test_run_users_in_batches(self):
+        result = run_users(range(1), dict(self.options, batch_size=4, import_every=0, export_every=0))
+        self.assertEqual(result["failed"], [])
+        self.assertEqual(len(result["latencies"]["update_list_items"]), 3)
+
+    def test_run_users_login_fails(self):
+        result = run_users(range(1), dict(self.options, password='wrong'))
+        self.assertEqual(result["failed"], ['Could not log in as stockdata1.'])
+        self.assertEqual(result["errors"], {"login": {"200": 1}})
+
+    def test_load_test_command(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'results.json')
+
+        out = StringIO()
+        call_command(
+            'load_test', '--url', self.live_server_url, '--users', '1', '--processes', '1',
+            '--counts', '4', '--batch-size', '2', '--output', output, stdout=out,
+        )
+        self.assertIn('update_list_items', out.getvalue())
+        with open(output) as output_file:
+            results = json.load(output_file)
+        self.assertEqual(results["results"]["update_list_items"]["requests"], 2)
+        self.assertEqual(results["results"]["total"]["errors"], 0)
+
+        with self.assertRaises(CommandError):
+            call_command('load_test', '--url', 'https://localhost', stdout=out)
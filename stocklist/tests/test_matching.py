@@ -0,0 +1,88 @@
+import random
+from django.test import TestCase
+
+from stocklist.matching import ItemIndex, normalize_name, similarity, trigrams
+from stocklist.models import User, Store, Item
+
+
+class NormalizeNameTestCase(TestCase):
+
+    def test_normalize_name_ignores_case_punctuation_and_spaces(self):
+        self.assertEqual(normalize_name("Absolut Vodka 70CL BTL"), normalize_name("absolut  vodka 70cl btl."))
+        self.assertEqual(normalize_name(" Gin - London_Dry "), "gin london dry")
+
+    def test_normalize_name_ignores_accents(self):
+        self.assertEqual(normalize_name("Rosé"), "rose")
+
+    def test_trigrams_pads_words(self):
+        self.assertEqual(trigrams("gin"), {"  g", " gi", "gin", "in "})
+        self.assertEqual(trigrams(""), frozenset())
+
+    def test_similarity(self):
+        grams = trigrams("absolut vodka 70cl")
+        self.assertEqual(similarity(grams, grams), 1.0)
+        self.assertEqual(similarity(grams, trigrams("rum")), 0.0)
+        self.assertGreater(similarity(grams, trigrams("absolut vodka 70 cl")), 0.7)
+
+
+class ItemIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.index = ItemIndex([
+            (1, "Absolut Vodka 70cl Btl"),
+            (2, "Absolut Vodka 1L Btl"),
+            (3, "Gordons Gin 70cl"),
+            (4, "GORDONS GIN 70CL"),
+        ])
+
+    def test_get_matches_normalized_names(self):
+        self.assertEqual(self.index.get("absolut vodka 70CL btl"), 1)
+        self.assertIsNone(self.index.get("Absolut Vodka"))
+
+    def test_get_returns_oldest_item_for_normalized_name(self):
+        self.assertEqual(self.index.get("Gordons Gin 70cl"), 3)
+
+    def test_candidates_finds_similar_names(self):
+        candidates = self.index.candidates("Absolut Vodka 70 cl Btl")
+        self.assertEqual(candidates[0][0], 1)
+        self.assertGreaterEqual(candidates[0][1], self.index.threshold)
+
+    def test_candidates_ignores_names_below_threshold(self):
+        self.assertEqual(self.index.candidates("Bacardi Rum 70cl"), [])
+        self.assertEqual(self.index.candidates("!!"), [])
+
+    def test_candidates_finds_items_added_after_trigrams_are_built(self):
+        self.index.candidates("Absolut Vodka 70 cl Btl")
+        self.index.add(5, "Bacardi Rum 70cl")
+        self.assertEqual(self.index.candidates("Bacardi Rum 70 cl")[0][0], 5)
+
+    def test_candidates_matches_comparing_every_item(self):
+        random.seed(1)
+        words = ["Absolut", "Vodka", "Gin", "Rum", "70cl", "1L", "Btl", "Can", "Case", "12", "Dry", "Gold"]
+        names = {' '.join(random.sample(words, random.randint(2, 5))) for i in range(300)}
+        index = ItemIndex(enumerate(sorted(names)))
+        for name in random.sample(sorted(names), 30):
+            name = name.replace('a', 'e', 1)
+            grams = trigrams(normalize_name(name))
+            expected = sorted(
+                (item_id for item_id, other_grams in enumerate(trigrams(normalize_name(other)) for other in sorted(names))
+                 if similarity(grams, other_grams) >= index.threshold)
+            )
+            self.assertEqual(sorted(item_id for item_id, score in index.candidates(name, limit=len(names))), expected)
+
+    def test_matches_skips_normalized_names(self):
+        matches = self.index.matches(["absolut vodka 70cl btl", "Absolut Vodka 70 cl Btl", "Bacardi Rum"])
+        self.assertEqual([match["name"] for match in matches], ["Absolut Vodka 70 cl Btl"])
+        self.assertEqual(matches[0]["candidates"][0]["item_id"], 1)
+        self.assertEqual(matches[0]["candidates"][0]["name"], "Absolut Vodka 70cl Btl")
+
+    def test_for_store(self):
+        user = User.objects.create_user('Mike')
+        store = Store.objects.create(user=user, name="Test Store")
+        item = Item.objects.create(store=store, name="Vodka")
+        Item.objects.create(store=Store.objects.create(user=user, name="Other"), name="Gin")
+
+        with self.assertNumQueries(1):
+            index = ItemIndex.for_store(store)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.get("VODKA"), item.pk)
@@ -0,0 +1,244 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+from django.db import OperationalError
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve
+
+from stocklist.importer import import_lists, upsert_list_items
+from stocklist.metrics import REGISTRY, MetricsMiddleware, Registry, format_labels, format_value
+from stocklist.models import User, Store, List, ListItem, Item
+
+
+class MetricsTestCase(TestCase):
+    '''
+    Each test counts into its own METRICS_DB file.
+    '''
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'metrics.sqlite3')
+        settings = override_settings(METRICS_DB=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        REGISTRY.clear()
+        self.addCleanup(REGISTRY.clear)
+
+    def sample(self, name, labels='', sample='', registry=REGISTRY):
+        return registry.collect().get(name, {}).get(labels, {}).get(sample, 0)
+
+
+class RegistryTestCase(MetricsTestCase):
+
+    def test_format_value(self):
+        self.assertEqual(format_value(3.0), '3')
+        self.assertEqual(format_value(0.25), '0.25')
+        self.assertEqual(format_value(float('inf')), '+Inf')
+
+    def test_format_labels_escapes_values(self):
+        self.assertEqual(format_labels(['view', 'method'], {'method': 'GET', 'view': 'a"b\\c'}), 'view="a\\"b\\\\c",method="GET"')
+
+    @override_settings(METRICS_DB=None)
+    def test_counter_exposition(self):
+        registry = Registry()
+        counter = registry.counter('test_total', 'Tests.', ['view'])
+        counter.inc(view='items')
+        counter.inc(2, view='items')
+        text = registry.exposition()
+        self.assertIn('# HELP test_total Tests.\n# TYPE test_total counter\n', text)
+        self.assertIn('test_total{view="items"} 3\n', text)
+
+    @override_settings(METRICS_DB=None)
+    def test_histogram_exposition_is_cumulative(self):
+        registry = Registry()
+        histogram = registry.histogram('test_seconds', 'Test latency.', buckets=(0.1, 1))
+        for value in [0.05, 0.5, 0.5, 5]:
+            histogram.observe(value)
+        lines = registry.exposition().splitlines()
+        self.assertEqual(lines[2:], [
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 6.05',
+            'test_seconds_count 4',
+        ])
+
+    def test_metrics_without_samples_are_listed(self):
+        text = Registry().exposition()
+        self.assertEqual(text, '\n')
+        self.assertIn('# TYPE stocklist_requests_total counter', REGISTRY.exposition())
+
+    def test_registries_share_metrics_db(self):
+        registries = [Registry(), Registry()]
+        for registry in registries:
+            registry.counter('test_total', 'Tests.').inc(2)
+            registry.flush()
+        self.assertEqual(self.sample('test_total', registry=registries[0]), 4)
+        self.assertEqual(registries[0].values, {})
+
+    @skipUnless(hasattr(os, 'fork'), 'fork is not available')
+    def test_worker_processes_add_to_metrics_db(self):
+        counter = REGISTRY.metrics['stocklist_import_rows_total']
+        counter.inc(5)
+        REGISTRY.flush()
+
+        def worker():
+            # counts from before the fork belong to the parent
+            counter.inc(1)
+            REGISTRY.flush()
+
+        processes = [multiprocessing.get_context('fork').Process(target=worker) for i in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual([process.exitcode for process in processes], [0, 0, 0])
+        self.assertEqual(self.sample('stocklist_import_rows_total'), 8)
+
+    def test_threads_count_every_increment(self):
+        counter = REGISTRY.metrics['stocklist_import_rows_total']
+
+        def increment():
+            for i in range(10000):
+                counter.inc()
+
+        threads = [threading.Thread(target=increment) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.sample('stocklist_import_rows_total'), 80000)
+
+    def test_failed_flush_keeps_samples(self):
+        REGISTRY.metrics['stocklist_import_rows_total'].inc(3)
+        with override_settings(METRICS_DB=os.path.dirname(self.path)):
+            with self.assertLogs('stocklist.metrics', level='ERROR'):
+                REGISTRY.flush()
+        self.assertEqual(self.sample('stocklist_import_rows_total'), 3)
+
+    def test_flusher_flushes_in_background(self):
+        registry = Registry()
+        with override_settings(METRICS_DB=None):
+            registry.start_flusher()
+        self.assertIsNone(registry.flusher)
+
+        registry.counter('test_total', 'Tests.').inc(2)
+        with mock.patch('stocklist.metrics.METRICS_FLUSH_INTERVAL', 0.01):
+            registry.start_flusher()
+            self.addCleanup(registry.stopped.set)
+            for i in range(500):
+                if self.sample('test_total'):
+                    break
+                time.sleep(0.01)
+        self.assertEqual(self.sample('test_total'), 2)
+        self.assertEqual(registry.values, {})
+
+    def test_after_fork_clears_samples(self):
+        REGISTRY.metrics['stocklist_import_rows_total'].inc(3)
+        REGISTRY.after_fork()
+        self.assertEqual(REGISTRY.values, {})
+        self.assertIsNone(REGISTRY.flusher)
+
+
+class ImportMetricsTestCase(MetricsTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, List, Item
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.list1 = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.item1 = Item.objects.create(store=cls.store1, name="Vodka")
+        cls.item2 = Item.objects.create(store=cls.store1, name="Gin")
+
+        return super().setUpTestData()
+
+    def test_import_rows_and_rate(self):
+        import_lists(self.store1, [{"name": "Stock", "type": List.ADDITION, "items": [
+            {"name": "Vodka", "amount": "2"},
+            {"name": "Rum", "amount": "3"},
+            {"name": "", "amount": "4"},
+        ]}])
+        self.assertEqual(self.sample('stocklist_import_rows_total'), 2)
+        self.assertEqual(self.sample('stocklist_import_rows_skipped_total'), 1)
+        self.assertEqual(self.sample('stocklist_import_duration_seconds', sample='count'), 1)
+        self.assertEqual(self.sample('stocklist_import_rows_per_second', sample='count'), 1)
+
+    def test_batch_update_rows(self):
+        upsert_list_items(self.list1, {self.item1.pk: 2, self.item2.pk: 3})
+        self.assertEqual(self.sample('stocklist_batch_update_rows', sample='count'), 1)
+        self.assertEqual(self.sample('stocklist_batch_update_rows', sample='sum'), 2)
+
+
+@override_settings(METRICS=True)
+class MetricsViewTestCase(MetricsTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, List, Item
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.list1 = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.item1 = Item.objects.create(store=cls.store1, name="Vodka")
+        ListItem.objects.create(list=cls.list1, item=cls.item1, amount=2)
+
+        return super().setUpTestData()
+
+    def test_requests_are_counted_by_url_name(self):
+        self.client.login(username='Mike', password='1X<ISRUkw+tuK')
+        self.client.get('/items/{}'.format(self.store1.pk))
+        self.client.get('/items/{}'.format(self.store1.pk))
+        self.client.post('/create_list_item/{}/{}'.format(self.list1.pk, self.item1.pk), json.dumps({"amount": 3}), content_type='application/json')
+
+        self.assertEqual(self.sample('stocklist_requests_total', 'view="items",method="GET",status="200"'), 2)
+        self.assertEqual(self.sample('stocklist_requests_total', 'view="create_list_item",method="POST",status="201"'), 1)
+        self.assertEqual(self.sample('stocklist_request_duration_seconds', 'view="items"', 'count'), 2)
+        self.assertGreater(self.sample('stocklist_request_queries', 'view="items"', 'sum'), 0)
+
+    def test_unmatched_requests(self):
+        self.client.get('/no-such-page')
+        self.assertEqual(self.sample('stocklist_requests_total', 'view="unmatched",method="GET",status="404"'), 1)
+
+    def test_requests_are_flushed_outside_the_request(self):
+        flushed_by = []
+        with mock.patch.object(REGISTRY, 'flush', side_effect=lambda: flushed_by.append(threading.current_thread())):
+            self.client.get('/no-such-page')
+        self.assertNotIn(threading.current_thread(), flushed_by)
+        self.assertTrue(REGISTRY.flusher.is_alive())
+
+    def test_database_locked_is_counted(self):
+        request = RequestFactory().post('/create_list_item/{}/{}'.format(self.list1.pk, self.item1.pk))
+        request.resolver_match = resolve(request.path)
+        middleware = MetricsMiddleware(lambda request: HttpResponse())
+        self.assertIsNone(middleware.process_exception(request, OperationalError('database is locked')))
+        middleware.process_exception(request, OperationalError('no such table: stocklist_item'))
+        self.assertEqual(self.sample('stocklist_database_locked_total', 'view="create_list_item"'), 1)
+
+    def test_GET_metrics(self):
+        self.client.get('/metrics')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('# TYPE stocklist_request_duration_seconds histogram\n', text)
+        self.assertIn('stocklist_requests_total{view="metrics",method="GET",status="200"} 1\n', text)
+
+    def test_GET_metrics_returns_404_for_other_addresses(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS=False)
+    def test_GET_metrics_returns_404_if_metrics_off(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 404)
+
+    def test_POST_metrics_returns_400(self):
+        response = self.client.post('/metrics')
+        self.assertEqual(response.status_code, 400)
@@ -5,7 +5,7 @@ from django.test import TestCase
 from django.core.exceptions import ValidationError
 from django.db.utils import IntegrityError
 
-from stocklist.models import User, Store, List, ListItem, Item
+from stocklist.models import User, Store, List, ListItem, Item, Deletion
 
 
 class UserTestCase(TestCase):
@@ -64,6 +64,107 @@ class StoreTestCase(TestCase):
         with self.assertRaises(ValidationError):
             store = Store.objects.create(user=self.user1, name=long_store_name)
             store.full_clean()
+
+    def test_store_version_changes_with_items_lists_and_list_items(self):
+        def version():
+            return Store.objects.get(pk=self.store.pk).version
+
+        start_version = version()
+        list = List.objects.create(store=self.store, name="Start", type=List.COUNT)
+        self.assertEqual(version(), start_version + 1)
+        item = Item.objects.create(store=self.store, name="Vodka")
+        self.assertEqual(version(), start_version + 2)
+        list_item = ListItem.objects.create(list=list, item=item, amount=3)
+        self.assertEqual(version(), start_version + 3)
+        list_item.amount = 4
+        list_item.save()
+        self.assertEqual(version(), start_version + 4)
+        list_item.delete()
+        self.assertEqual(version(), start_version + 5)
+        item.delete()
+        list.delete()
+        self.assertEqual(version(), start_version + 7)
+
+    def test_store_bump_version_only_changes_filtered_stores(self):
+        store2 = Store.objects.create(user=self.user1, name="Test Store 2")
+        Store.objects.filter(pk=self.store.pk).bump_version()
+        self.assertEqual(Store.objects.get(pk=self.store.pk).version, self.store.version + 1)
+        self.assertEqual(Store.objects.get(pk=store2.pk).version, 0)
+
+    def test_store_etag(self):
+        self.assertEqual(self.store.etag(), '"{}-{}"'.format(self.store.id, self.store.version))
+        self.assertNotEqual(self.store.etag('matrix'), self.store.etag())
+
+    def test_store_changes_are_stamped_with_store_version(self):
+        list = List.objects.create(store=self.store, name="Start", type=List.COUNT)
+        self.assertEqual(list.version, Store.objects.get(pk=self.store.pk).version)
+        item = Item.objects.create(store=self.store, name="Vodka")
+        self.assertEqual(item.version, list.version + 1)
+        list_item = ListItem.objects.create(list=list, item=item, amount=3)
+        self.assertEqual(list_item.version, item.version + 1)
+
+        # the List count changed
+        list.refresh_from_db()
+        self.assertEqual(list.version, list_item.version)
+
+    def test_store_deletions_are_recorded(self):
+        list = List.objects.create(store=self.store, name="Start", type=List.COUNT)
+        item = Item.objects.create(store=self.store, name="Vodka")
+        list_item = ListItem.objects.create(list=list, item=item, amount=3)
+        list_item_id = list_item.id
+        list_item.delete()
+        item_id = item.id
+        item.delete()
+
+        deletions = Deletion.objects.filter(store=self.store).order_by('version')
+        self.assertEqual([(d.model, d.object_id) for d in deletions], [(Deletion.LIST_ITEM, list_item_id), (Deletion.ITEM, item_id)])
+        self.assertEqual(deletions.last().version, Store.objects.get(pk=self.store.pk).version)
+
+    # serializer
+    def test_store_serialize_changes(self):
+        list1 = List.objects.create(store=self.store, name="Start", type=List.COUNT)
+        list2 = List.objects.create(store=self.store, name="End", type=List.COUNT)
+        item1 = Item.objects.create(store=self.store, name="Vodka")
+        item2 = Item.objects.create(store=self.store, name="Gin")
+        list_item1 = ListItem.objects.create(list=list1, item=item1, amount=3)
+        since = Store.objects.get(pk=self.store.pk).version
+
+        list_item = ListItem.objects.create(list=list2, item=item2, amount=4)
+        item1_id = item1.id
+        item1.delete()
+        store = Store.objects.get(pk=self.store.pk)
+
+        with self.assertNumQueries(4):
+            changes = store.serialize_changes(since)
+        self.assertEqual(changes["version"], store.version)
+        self.assertEqual(changes["since"], since)
+        self.assertEqual(changes["items"], [])
+        # deleting item1 deleted its ListItem, so list1's count changed
+        self.assertEqual([(list["id"], list["count"]) for list in changes["lists"]], [(list1.id, 0), (list2.id, 1)])
+        self.assertEqual(changes["list_items"], [{"id": list_item.id, "list_id": list2.id, "item_id": item2.id, "amount": Decimal(4)}])
+        self.assertEqual(changes["deleted"], {"items": [item1_id], "lists": [], "list_items": [list_item1.id]})
+
+    def test_store_serialize_changes_since_current_version_is_empty(self):
+        List.objects.create(store=self.store, name="Start", type=List.COUNT)
+        store = Store.objects.get(pk=self.store.pk)
+        changes = store.serialize_changes(store.version)
+        self.assertEqual(changes["items"] + changes["lists"] + changes["list_items"], [])
+
+    def test_store_serialize_matrix(self):
+        list1 = List.objects.create(store=self.store, name="Start", type=List.COUNT)
+        list2 = List.objects.create(store=self.store, name="End", type=List.COUNT)
+        item1 = Item.objects.create(store=self.store, name="Vodka")
+        item2 = Item.objects.create(store=self.store, name="Gin")
+        ListItem.objects.create(list=list1, item=item1, amount=3)
+        ListItem.objects.create(list=list2, item=item2, amount=4)
+
+        with self.assertNumQueries(3):
+            matrix = self.store.serialize_matrix()
+        self.assertEqual(matrix["item_ids"], [item1.id, item2.id])
+        self.assertEqual(matrix["item_names"], ["Vodka", "Gin"])
+        self.assertEqual([list["id"] for list in matrix["lists"]], [list1.id, list2.id])
+        self.assertEqual([list["count"] for list in matrix["lists"]], [1, 1])
+        self.assertEqual(matrix["amounts"], [[Decimal(3), None], [None, Decimal(4)]])
             
 
 
@@ -179,6 +280,16 @@ class ListTestCase(TestCase):
         self.assertEqual(list.get_type_display(), serialized_list["type"])
         self.assertEqual(0,serialized_list["count"])
 
+    def test_list_serializer_uses_count_annotation(self):
+        list = List.objects.create(store=self.store1, name='Start', type=List.COUNT)
+        item = Item.objects.create(store=self.store1, name='Vodka')
+        ListItem.objects.create(list=list, item=item, amount=1)
+
+        list = List.objects.with_counts().get(pk=list.pk)
+        with self.assertNumQueries(0):
+            serialized_list = list.serialize()
+        self.assertEqual(1, serialized_list["count"])
+
     # TODO
     # def test_store_serializer_list_date(self):
 
@@ -248,6 +359,15 @@ class ItemTestCase(TestCase):
         list_item_to_test = serialized_item["list_items"][0]
         self.assertEqual(list_item.amount, list_item_to_test['amount'])
    
+    def test_item_serializer_doesnt_query_lists(self):
+        list = List.objects.create(store=self.store1, name="Test List", type=List.COUNT)
+        list_item = ListItem.objects.create(item=self.item, list=list, amount=11)
+
+        item = Item.objects.prefetch_related("list_items").get(pk=self.item.pk)
+        with self.assertNumQueries(0):
+            serialized_item = item.serialize()
+        self.assertEqual(list.id, serialized_item["list_items"][0]["list_id"])
+
     def test_item_serializer_item_list_items_length(self):
         list = List.objects.create(store=self.store1, name="Test List", type=List.COUNT)
         list_item = ListItem.objects.create(item=self.item, list=list, amount=11)
@@ -0,0 +1,187 @@
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import TestCase
+
+from stocklist.search import FTS_TABLE, decode_cursor, encode_cursor, fts_available, parse_limit, search_items
+from stocklist.models import User, Store, List, ListItem, Item
+
+
+def fts_names(query):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM {} WHERE {} MATCH %s ORDER BY name".format(FTS_TABLE, FTS_TABLE), ['"{}"'.format(query)])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class SearchItemsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, Lists, Items
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.store2 = Store.objects.create(user=User.objects.create_user('Other'), name="Other Store")
+        cls.stock = List.objects.create(store=cls.store1, name="Stock", type=List.ADDITION)
+        cls.end = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.vodka = Item.objects.create(store=cls.store1, name="Absolut Vodka 70cl")
+        cls.gin = Item.objects.create(store=cls.store1, name="Gordons Gin 70cl")
+        cls.rum = Item.objects.create(store=cls.store1, name="Bacardi Rum 1L")
+        cls.vodka2 = Item.objects.create(store=cls.store1, name="Smirnoff Vodka 70cl")
+        Item.objects.create(store=cls.store2, name="Absolut Vodka 70cl")
+        ListItem.objects.create(list=cls.stock, item=cls.vodka, amount=10)
+        ListItem.objects.create(list=cls.stock, item=cls.gin, amount=10)
+        ListItem.objects.create(list=cls.end, item=cls.vodka, amount=2)
+
+        return super().setUpTestData()
+
+    def names(self, results):
+        return [item["name"] for item in results["items"]]
+
+    def test_search_items_substring(self):
+        results = search_items(self.store1, "vodka")
+        self.assertEqual(self.names(results), ["Absolut Vodka 70cl", "Smirnoff Vodka 70cl"])
+        self.assertEqual(results["items"][0], {"id": self.vodka.pk, "name": "Absolut Vodka 70cl"})
+        self.assertIsNone(results["next"])
+
+    def test_search_items_short_substring(self):
+        self.assertEqual(self.names(search_items(self.store1, "1l")), ["Bacardi Rum 1L"])
+
+    def test_search_items_prefix(self):
+        self.assertEqual(self.names(search_items(self.store1, "abs", mode="prefix")), ["Absolut Vodka 70cl"])
+        self.assertEqual(self.names(search_items(self.store1, "vodka", mode="prefix")), [])
+
+    def test_search_items_quotes_in_query(self):
+        Item.objects.create(store=self.store1, name='Jack Daniels "Old No. 7"')
+        self.assertEqual(self.names(search_items(self.store1, '"old no')), ['Jack Daniels "Old No. 7"'])
+
+    def test_search_items_without_query_returns_all_items(self):
+        self.assertEqual(len(search_items(self.store1)["items"]), 4)
+
+    def test_search_items_in_list(self):
+        self.assertEqual(self.names(search_items(self.store1, in_list=self.stock)), ["Absolut Vodka 70cl", "Gordons Gin 70cl"])
+
+    def test_search_items_not_in_list(self):
+        results = search_items(self.store1, "70cl", in_list=self.stock, not_in_list=self.end)
+        self.assertEqual(self.names(results), ["Gordons Gin 70cl"])
+
+    def test_search_items_pages_with_cursor(self):
+        first = search_items(self.store1, "", limit=3)
+        self.assertEqual(len(first["items"]), 3)
+        second = search_items(self.store1, "", cursor=first["next"], limit=3)
+        self.assertEqual(self.names(second), ["Smirnoff Vodka 70cl"])
+        self.assertIsNone(second["next"])
+
+    def test_search_items_pages_items_with_the_same_name(self):
+        store = Store.objects.create(user=self.user1, name="Store 2")
+        for i in range(3):
+            Item.objects.create(store=store, name="Gin {}".format(i))
+        # Item names are unique in a Store, so ties are checked on the cursor directly
+        cursor = encode_cursor({"id": 0, "name": "Gin 1"})
+        self.assertEqual(self.names(search_items(store, "gin", cursor=cursor)), ["Gin 1", "Gin 2"])
+
+    def test_search_items_query_count(self):
+        # the connection has checked for the FTS5 table
+        fts_available()
+        with self.assertNumQueries(1):
+            search_items(self.store1, "vodka", in_list=self.stock, not_in_list=self.end)
+
+    def test_search_items_invalid_mode_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            search_items(self.store1, "vodka", mode="fuzzy")
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor({"id": 3, "name": "Gin"})), ("Gin", 3))
+
+    def test_decode_invalid_cursor_raises_ValueError(self):
+        for cursor in ["", "abc", encode_cursor({"id": "3", "name": "Gin"})]:
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit(""), 20)
+        self.assertEqual(parse_limit("5"), 5)
+        for limit in ["0", "101", "ten"]:
+            with self.assertRaises(ValueError):
+                parse_limit(limit)
+
+    def test_fts_available_is_checked_once_per_connection(self):
+        available = fts_available()
+        with self.assertNumQueries(0):
+            self.assertEqual(fts_available(), available)
+
+        # a new connection checks again
+        connection_created.send(sender=connection.__class__, connection=connection)
+        with self.assertNumQueries(1 if connection.vendor == 'sqlite' else 0):
+            self.assertEqual(fts_available(), available)
+
+    def test_fts_table_tracks_item_names(self):
+        if not fts_available():
+            self.skipTest('SQLite FTS5 trigram tokenizer is not available')
+        self.assertEqual(fts_names("vodka"), ["Absolut Vodka 70cl", "Absolut Vodka 70cl", "Smirnoff Vodka 70cl"])
+
+        self.vodka2.name = "Smirnoff Red 70cl"
+        self.vodka2.save()
+        self.assertEqual(fts_names("smirnoff"), ["Smirnoff Red 70cl"])
+
+        self.vodka.delete()
+        self.assertEqual(fts_names("vodka"), ["Absolut Vodka 70cl"])
+
+
+class SearchViewTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, Lists, Items
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.end = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.vodka = Item.objects.create(store=cls.store1, name="Absolut Vodka 70cl")
+        cls.gin = Item.objects.create(store=cls.store1, name="Gordons Gin 70cl")
+        ListItem.objects.create(list=cls.end, item=cls.vodka, amount=2)
+
+        return super().setUpTestData()
+
+    def setUp(self):
+        self.client.login(username='Mike', password='1X<ISRUkw+tuK')
+
+    def test_GET_search(self):
+        response = self.client.get('/search/{}'.format(self.store1.pk), {"q": "vodka"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"items": [{"id": self.vodka.pk, "name": "Absolut Vodka 70cl"}], "next": None})
+
+    def test_GET_search_uncounted(self):
+        response = self.client.get('/search/{}'.format(self.store1.pk), {"q": "70cl", "uncounted": self.end.pk})
+        self.assertEqual([item["name"] for item in response.json()["items"]], ["Gordons Gin 70cl"])
+
+    def test_GET_search_pages(self):
+        response = self.client.get('/search/{}'.format(self.store1.pk), {"limit": 1})
+        self.assertEqual(response.json()["items"][0]["name"], "Absolut Vodka 70cl")
+        response = self.client.get('/search/{}'.format(self.store1.pk), {"limit": 1, "cursor": response.json()["next"]})
+        self.assertEqual(response.json(), {"items": [{"id": self.gin.pk, "name": "Gordons Gin 70cl"}], "next": None})
+
+    def test_GET_search_invalid_parameters_returns_400(self):
+        for query in [{"match": "fuzzy"}, {"cursor": "abc"}, {"limit": "0"}, {"list": "abc"}]:
+            response = self.client.get('/search/{}'.format(self.store1.pk), query)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("error", response.json())
+
+    def test_GET_search_other_stores_list_returns_404(self):
+        store2 = Store.objects.create(user=User.objects.create_user('Other'), name="Other Store")
+        list2 = List.objects.create(store=store2, name="End", type=List.COUNT)
+        response = self.client.get('/search/{}'.format(self.store1.pk), {"list": list2.pk})
+        self.assertEqual(response.status_code, 404)
+
+    def test_GET_search_other_users_store_returns_404(self):
+        store2 = Store.objects.create(user=User.objects.create_user('Other'), name="Other Store")
+        response = self.client.get('/search/{}'.format(store2.pk))
+        self.assertEqual(response.status_code, 404)
+
+    def test_POST_search_returns_400(self):
+        response = self.client.post('/search/{}'.format(self.store1.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_GET_search_redirects_to_login_if_not_logged_in(self):
+        self.client.logout()
+        response = self.client.get('/search/{}'.format(self.store1.pk))
+        self.assertEqual(response.status_code, 302)
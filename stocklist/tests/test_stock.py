@@ -0,0 +1,307 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from stocklist.importer import import_lists, upsert_list_items
+from stocklist.models import User, Store, List, ListItem, Item, ItemBalance
+from stocklist.stock import balance_levels, check_balances, last_count_list, parse_as_of, parse_threshold, rebuild_balances, stock_levels, variance_report
+from stocklist.sync import EPOCH, apply_operations
+
+
+class StockTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, Items
+        cls.user1 = User.objects.create_user('Mike')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.item1 = Item.objects.create(store=cls.store1, name="Vodka")
+        cls.item2 = Item.objects.create(store=cls.store1, name="Gin")
+        cls.start = timezone.now() - datetime.timedelta(days=10)
+
+        return super().setUpTestData()
+
+    def add_list(self, type, days, amounts):
+        new_list = List.objects.create(store=self.store1, name="List {}".format(days), type=type)
+        List.objects.filter(pk=new_list.pk).update(date_added=self.start + datetime.timedelta(days=days))
+        new_list.refresh_from_db()
+        for item, amount in amounts.items():
+            ListItem.objects.create(list=new_list, item=item, amount=amount)
+        return new_list
+
+
+class StockLevelsTestCase(StockTestCase):
+
+    def levels(self, as_of=None):
+        return {level['item_id']: level for level in stock_levels(self.store1, as_of)}
+
+    def test_stock_levels_without_lists(self):
+        levels = self.levels()
+        self.assertEqual(levels[self.item1.id], {
+            'item_id': self.item1.id,
+            'name': 'Vodka',
+            'last_count': None,
+            'last_count_list_id': None,
+            'additions': Decimal('0.0'),
+            'subtractions': Decimal('0.0'),
+            'on_hand': Decimal('0.0'),
+        })
+
+    def test_stock_levels_start_from_last_count(self):
+        self.add_list(List.ADDITION, 1, {self.item1: '100'})
+        self.add_list(List.COUNT, 2, {self.item1: '10', self.item2: '4'})
+        self.add_list(List.ADDITION, 3, {self.item1: '2.5'})
+        self.add_list(List.SUBTRACTION, 4, {self.item1: '3', self.item2: '1'})
+        self.add_list(List.COUNT, 5, {self.item2: '2'})
+
+        levels = self.levels()
+        self.assertEqual(levels[self.item1.id]['last_count'], Decimal('10'))
+        self.assertEqual(levels[self.item1.id]['additions'], Decimal('2.5'))
+        self.assertEqual(levels[self.item1.id]['subtractions'], Decimal('3'))
+        self.assertEqual(levels[self.item1.id]['on_hand'], Decimal('9.5'))
+        self.assertEqual(levels[self.item2.id]['last_count'], Decimal('2'))
+        self.assertEqual(levels[self.item2.id]['on_hand'], Decimal('2'))
+
+    def test_stock_levels_without_count(self):
+        self.add_list(List.ADDITION, 1, {self.item1: '5'})
+        self.add_list(List.SUBTRACTION, 2, {self.item1: '7'})
+        self.assertEqual(self.levels()[self.item1.id]['on_hand'], Decimal('-2'))
+
+    def test_stock_levels_as_of_date(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10'})
+        self.add_list(List.SUBTRACTION, 2, {self.item1: '3'})
+        self.add_list(List.COUNT, 3, {self.item1: '1'})
+
+        self.assertEqual(self.levels(self.start)[self.item1.id]['on_hand'], Decimal('0'))
+        self.assertEqual(self.levels(self.start + datetime.timedelta(days=2))[self.item1.id]['on_hand'], Decimal('7'))
+        self.assertEqual(self.levels()[self.item1.id]['on_hand'], Decimal('1'))
+
+    def test_stock_levels_orders_lists_added_together_by_id(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10'})
+        self.add_list(List.COUNT, 1, {self.item1: '6'})
+        self.assertEqual(self.levels()[self.item1.id]['on_hand'], Decimal('6'))
+
+    def test_stock_levels_ignores_other_stores(self):
+        store2 = Store.objects.create(user=self.user1, name="Other Store")
+        other_list = List.objects.create(store=store2, name="Other", type=List.COUNT)
+        ListItem.objects.create(list=other_list, item=Item.objects.create(store=store2, name="Rum"), amount=3)
+        self.add_list(List.ADDITION, 1, {self.item1: '1'})
+        self.assertEqual(set(self.levels()), {self.item1.id, self.item2.id})
+
+    def test_stock_levels_with_one_query(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10', self.item2: '4'})
+        self.add_list(List.ADDITION, 2, {self.item1: '1', self.item2: '1'})
+        with self.assertNumQueries(1):
+            stock_levels(self.store1)
+
+    def test_parse_as_of(self):
+        self.assertEqual(parse_as_of('2026-01-02T03:04:05Z'), datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc))
+        end_of_day = timezone.localtime(parse_as_of('2026-01-02'))
+        self.assertEqual((end_of_day.date(), end_of_day.hour, end_of_day.minute), (datetime.date(2026, 1, 2), 23, 59))
+        with self.assertRaises(ValueError):
+            parse_as_of('yesterday')
+
+
+class VarianceReportTestCase(StockTestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        sup = super().setUpTestData()
+        cls.item3 = Item.objects.create(store=cls.store1, name="Rum")
+        return sup
+
+    def setUp(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10', self.item2: '4', self.item3: '5'})
+        self.add_list(List.ADDITION, 2, {self.item1: '5', self.item2: '4'})
+        self.add_list(List.SUBTRACTION, 3, {self.item1: '3'})
+        self.end = self.add_list(List.COUNT, 4, {self.item1: '11', self.item2: '8'})
+
+    def report(self, **kwargs):
+        return variance_report(self.store1, List.objects.get(pk=self.end.pk), **kwargs)
+
+    def test_variance_report(self):
+        report = self.report(sort='name')
+        self.assertEqual(report['list_id'], self.end.id)
+        self.assertEqual(report['items'], [
+            {'item_id': self.item2.id, 'name': 'Gin', 'expected': Decimal('8'), 'counted': Decimal('8'), 'variance': Decimal('0'), 'percentage': Decimal('0')},
+            {'item_id': self.item3.id, 'name': 'Rum', 'expected': Decimal('5'), 'counted': Decimal('0'), 'variance': Decimal('-5'), 'percentage': Decimal('-100')},
+            {'item_id': self.item1.id, 'name': 'Vodka', 'expected': Decimal('12'), 'counted': Decimal('11'), 'variance': Decimal('-1'), 'percentage': Decimal('-8.3')},
+        ])
+        self.assertEqual(report['totals'], {'expected': Decimal('25'), 'counted': Decimal('19'), 'variance': Decimal('-6')})
+
+    def test_variance_report_ignores_later_lists(self):
+        self.add_list(List.ADDITION, 5, {self.item1: '100'})
+        self.assertEqual(self.report()['totals']['expected'], Decimal('25'))
+
+    def test_variance_report_sort(self):
+        names = lambda report: [row['name'] for row in report['items']]
+        self.assertEqual(names(self.report()), ['Rum', 'Vodka', 'Gin'])
+        self.assertEqual(names(self.report(sort='-percentage')), ['Gin', 'Vodka', 'Rum'])
+        with self.assertRaises(ValueError):
+            self.report(sort='item_id')
+
+    def test_variance_report_percentage_is_none_without_expected_stock(self):
+        item4 = Item.objects.create(store=self.store1, name="Beer")
+        ListItem.objects.create(list=self.end, item=item4, amount=2)
+        rows = self.report(sort='-percentage')['items']
+        self.assertEqual((rows[-1]['name'], rows[-1]['percentage']), ('Beer', None))
+
+    def test_variance_report_threshold(self):
+        self.assertEqual([row['name'] for row in self.report(threshold=Decimal('1'))['items']], ['Rum', 'Vodka'])
+        self.assertEqual([row['name'] for row in self.report(threshold_percentage=Decimal('10'))['items']], ['Rum'])
+        self.assertEqual(self.report(threshold=Decimal('10'))['totals']['variance'], Decimal('-6'))
+
+    def test_variance_report_with_one_query(self):
+        count_list = List.objects.get(pk=self.end.pk)
+        with self.assertNumQueries(1):
+            variance_report(self.store1, count_list)
+
+    def test_last_count_list(self):
+        self.assertEqual(last_count_list(self.store1), self.end)
+
+    def test_parse_threshold(self):
+        self.assertEqual(parse_threshold('2.5'), Decimal('2.5'))
+        for invalid in ['-1', 'NaN', 'Infinity', 'ten']:
+            with self.assertRaises(ValueError):
+                parse_threshold(invalid)
+
+    def test_variance_report_command(self):
+        out = StringIO()
+        call_command('variance_report', self.store1.pk, '--threshold', '1', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[2].startswith('Rum'))
+        self.assertIn('-6', lines[-1])
+
+        out = StringIO()
+        call_command('variance_report', self.store1.pk, '--csv', '--sort', 'name', stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[:2], ['name,expected,counted,variance,percentage', 'Gin,8.0,8.0,0.0,0.0'])
+
+        with self.assertRaises(CommandError):
+            call_command('variance_report', self.store1.pk, '--sort', 'colour', stdout=out)
+
+
+class ItemBalanceTestCase(StockTestCase):
+
+    def on_hand(self, item=None):
+        return ItemBalance.objects.get(item=item or self.item1).on_hand
+
+    def assertBalancesMatch(self):
+        self.assertEqual(check_balances(self.store1), [])
+
+    def test_list_item_changes_update_balance(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10'})
+        addition = self.add_list(List.ADDITION, 2, {self.item1: '5'})
+        self.add_list(List.SUBTRACTION, 3, {self.item1: '3'})
+        self.assertEqual(self.on_hand(), Decimal('12'))
+
+        list_item = ListItem.objects.get(list=addition, item=self.item1)
+        list_item.amount = Decimal('7.5')
+        list_item.save()
+        self.assertEqual(self.on_hand(), Decimal('14.5'))
+
+        list_item.delete()
+        self.assertEqual(self.on_hand(), Decimal('7'))
+        self.assertBalancesMatch()
+
+    def test_new_count_resets_balance(self):
+        self.add_list(List.ADDITION, 1, {self.item1: '5'})
+        count = self.add_list(List.COUNT, 2, {self.item1: '2'})
+        balance = ItemBalance.objects.get(item=self.item1)
+        self.assertEqual((balance.last_count, balance.last_count_list_id, balance.additions, balance.on_hand), (Decimal('2'), count.id, Decimal('0'), Decimal('2')))
+        self.assertBalancesMatch()
+
+    def test_changes_before_last_count_do_not_change_balance(self):
+        addition = self.add_list(List.ADDITION, 1, {self.item1: '5'})
+        self.add_list(List.COUNT, 2, {self.item1: '2'})
+        ListItem.objects.create(list=addition, item=self.item2, amount=4)
+        list_item = ListItem.objects.get(list=addition, item=self.item1)
+        list_item.amount = 50
+        list_item.save()
+        self.assertEqual(self.on_hand(), Decimal('2'))
+        self.assertEqual(self.on_hand(self.item2), Decimal('4'))
+        self.assertBalancesMatch()
+
+    def test_deleting_last_count_recomputes_balance(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10'})
+        self.add_list(List.ADDITION, 2, {self.item1: '5'})
+        count = self.add_list(List.COUNT, 3, {self.item1: '1'})
+        ListItem.objects.get(list=count, item=self.item1).delete()
+        self.assertEqual(self.on_hand(), Decimal('15'))
+        self.assertBalancesMatch()
+
+    def test_counting_before_later_lists_recomputes_balance(self):
+        count = self.add_list(List.COUNT, 1, {})
+        self.add_list(List.SUBTRACTION, 2, {self.item1: '3'})
+        ListItem.objects.create(list=count, item=self.item1, amount=10)
+        self.assertEqual(self.on_hand(), Decimal('7'))
+        self.assertBalancesMatch()
+
+    def test_counting_before_later_lists_of_other_items_sets_balance(self):
+        count = self.add_list(List.COUNT, 1, {})
+        self.add_list(List.SUBTRACTION, 2, {self.item2: '3'})
+        ListItem.objects.create(list=count, item=self.item1, amount=10)
+        self.assertEqual(self.on_hand(), Decimal('10'))
+        self.assertBalancesMatch()
+
+    def test_deleting_list_updates_balances(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10', self.item2: '3'})
+        addition = self.add_list(List.ADDITION, 2, {self.item1: '5'})
+        count = self.add_list(List.COUNT, 3, {self.item2: '1'})
+        addition.delete()
+        count.delete()
+        self.assertEqual(self.on_hand(), Decimal('10'))
+        self.assertEqual(self.on_hand(self.item2), Decimal('3'))
+        self.assertBalancesMatch()
+
+    def test_imports_and_bulk_counts_update_balances(self):
+        import_lists(self.store1, [
+            {"name": "Start", "type": "CO", "items": [{"name": "Vodka", "amount": "10"}, {"name": "Rum", "amount": "2"}]},
+            {"name": "Delivery", "type": "AD", "items": [{"name": "Vodka", "amount": "6"}]},
+        ])
+        self.assertEqual(self.on_hand(), Decimal('16'))
+        self.assertEqual(self.on_hand(Item.objects.get(store=self.store1, name="Rum")), Decimal('2'))
+
+        end = List.objects.create(store=self.store1, name="End", type=List.COUNT)
+        upsert_list_items(end, {self.item1.id: Decimal('4'), self.item2.id: Decimal('1')})
+        self.assertEqual(self.on_hand(), Decimal('4'))
+
+        timestamp = int((timezone.now() - EPOCH).total_seconds() * 1000)
+        apply_operations(self.store1, [{'op_id': 'a', 'timestamp': timestamp, 'list_id': end.id, 'item_id': self.item1.id, 'amount': '3'}])
+        self.assertEqual(self.on_hand(), Decimal('3'))
+        self.assertBalancesMatch()
+
+    def test_balance_levels_match_stock_levels(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10'})
+        self.add_list(List.ADDITION, 2, {self.item1: '2.5', self.item2: '1'})
+        Item.objects.create(store=self.store1, name="Rum")
+        with self.assertNumQueries(1):
+            levels = balance_levels(self.store1)
+        self.assertEqual(levels, stock_levels(self.store1))
+
+    def test_rebuild_balances(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10'})
+        ItemBalance.objects.filter(item=self.item1).update(on_hand=99)
+        self.assertEqual(len(check_balances(self.store1)), 1)
+
+        self.assertEqual(rebuild_balances(self.store1), 2)
+        self.assertBalancesMatch()
+        self.assertEqual(self.on_hand(), Decimal('10'))
+
+    def test_rebuild_balances_command(self):
+        self.add_list(List.COUNT, 1, {self.item1: '10'})
+        ItemBalance.objects.filter(item=self.item1).update(additions=1)
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--check', stdout=out)
+        self.assertIn('Item {}'.format(self.item1.id), out.getvalue())
+
+        call_command('rebuild_balances', self.store1.pk, stdout=out)
+        call_command('rebuild_balances', '--check', stdout=out)
+        self.assertIn('Balances match.', out.getvalue())
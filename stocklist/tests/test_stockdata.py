@@ -0,0 +1,78 @@
+import random
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from stocklist.models import User, Store, List, ListItem, Item, ItemBalance
+from stocklist.stock import check_balances
+from stocklist.stockdata import NAME_SPACE, generate_amount, generate_items, generate_stockdata, insert_rows, item_name
+
+
+class StockdataTestCase(TestCase):
+
+    def store_data(self, store):
+        return (
+            list(store.items.order_by('id').values_list('name', flat=True)),
+            list(store.lists.order_by('id').values_list('name', 'type', 'date_added')),
+            list(ListItem.objects.filter(list__store=store).order_by('id').values_list('item__name', 'amount', 'date_counted')),
+        )
+
+    def test_item_name(self):
+        self.assertEqual(item_name(0), ('Abbey Vodka 70cl', 6, True))
+        self.assertEqual(item_name(NAME_SPACE), ('Abbey Vodka 70cl 2', 6, True))
+
+    def test_generate_items_names_are_distinct(self):
+        items = generate_items(random.Random(0), NAME_SPACE + 10)
+        self.assertEqual(len({name for name, case, par, tenths in items}), NAME_SPACE + 10)
+        self.assertEqual(generate_items(random.Random(0), 10), generate_items(random.Random(0), 10))
+
+    def test_generate_amount(self):
+        rng = random.Random(0)
+        for i in range(100):
+            self.assertEqual(generate_amount(rng, List.ADDITION, 6, 12, True) % 60, 0)
+            self.assertEqual(generate_amount(rng, List.SUBTRACTION, 24, 48, False) % 10, 0)
+            self.assertTrue(0 <= generate_amount(rng, List.COUNT, 6, 12, True) <= 180)
+
+    def test_insert_rows(self):
+        user = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        store = Store.objects.create(user=user, name="Test Store")
+        self.assertEqual(insert_rows(Item, ['store', 'name', 'version'], [(store.pk, 'Item {}'.format(i), 1) for i in range(5)], batch_size=2), 5)
+        self.assertEqual(list(store.items.order_by('id').values_list('name', flat=True)), ['Item 0', 'Item 1', 'Item 2', 'Item 3', 'Item 4'])
+
+    def test_generate_stockdata(self):
+        self.assertEqual(generate_stockdata(2, 2, 20, 6, seed=1), (2, 4, ListItem.objects.count()))
+        user = User.objects.get(username='stockdata2')
+        self.assertTrue(user.check_password('stockdata'))
+        store = user.stores.get(name='Store 2')
+        self.assertEqual(store.items.count(), 20)
+        self.assertEqual(
+            [(list.name, list.type) for list in store.lists.order_by('id')],
+            [('Count 1', List.COUNT), ('Delivery 1', List.ADDITION), ('Sales 1', List.SUBTRACTION), ('Count 2', List.COUNT), ('Delivery 2', List.ADDITION), ('Sales 2', List.SUBTRACTION)],
+        )
+        self.assertEqual(ItemBalance.objects.filter(store=store).count(), 20)
+        self.assertEqual(check_balances(store), [])
+
+    def test_generate_stockdata_is_deterministic(self):
+        generate_stockdata(2, 2, 20, 6, seed=1)
+        generate_stockdata(1, 1, 20, 6, seed=1, prefix='other')
+        generate_stockdata(1, 1, 20, 6, seed=2, prefix='seed')
+        store = Store.objects.get(user__username='stockdata1', name='Store 1')
+        # a Store's data doesn't depend on how many Users and Stores are generated
+        self.assertEqual(self.store_data(store), self.store_data(Store.objects.get(user__username='other1')))
+        self.assertNotEqual(self.store_data(store), self.store_data(Store.objects.get(user__username='seed1')))
+        self.assertNotEqual(self.store_data(store), self.store_data(Store.objects.get(user__username='stockdata1', name='Store 2')))
+
+    def test_generate_stockdata_command(self):
+        out = StringIO()
+        call_command('generate_stockdata', '--users', '2', '--items', '10', '--lists', '3', stdout=out)
+        self.assertIn('Created 2 Users, 2 Stores, 20 Items', out.getvalue())
+
+        with self.assertRaisesRegex(CommandError, 'stockdata1, stockdata2'):
+            call_command('generate_stockdata', '--users', '2', '--items', '10', '--lists', '3', stdout=out)
+
+        call_command('generate_stockdata', '--items', '5', '--lists', '3', '--replace', stdout=out)
+        self.assertEqual(Item.objects.filter(store__user__username='stockdata1').count(), 5)
+
+        with self.assertRaises(CommandError):
+            call_command('generate_stockdata', '--items', '0', stdout=out)
@@ -0,0 +1,123 @@
+import datetime
+from decimal import Decimal
+from django.test import TestCase
+from django.utils import timezone
+
+from stocklist.models import User, Store, List, ListItem, Item, SyncOperation
+from stocklist.sync import EPOCH, apply_operations, clean_timestamp, latest_operations
+
+
+def timestamp(date):
+    return int((date - EPOCH).total_seconds() * 1000)
+
+
+class ApplyOperationsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, List, Items
+        cls.user1 = User.objects.create_user('Mike')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.list = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.item1 = Item.objects.create(store=cls.store1, name="Vodka")
+        cls.item2 = Item.objects.create(store=cls.store1, name="Gin")
+        cls.now = timestamp(timezone.now())
+
+        return super().setUpTestData()
+
+    def operation(self, op_id, amount, ms_ago=0, item=None):
+        return {
+            'op_id': op_id,
+            'timestamp': self.now - ms_ago,
+            'list_id': self.list.id,
+            'item_id': (item or self.item1).id,
+            'amount': amount,
+        }
+
+    def amount(self, item=None):
+        return ListItem.objects.get(list=self.list, item=item or self.item1).amount
+
+    def test_clean_timestamp(self):
+        now = timezone.now()
+        date_counted, error = clean_timestamp(1000, now)
+        self.assertEqual(date_counted, EPOCH + datetime.timedelta(seconds=1))
+        self.assertEqual(clean_timestamp(timestamp(now) + 60000, now), (now, None))
+        for invalid in ['1000', None, True, -1]:
+            self.assertIsNone(clean_timestamp(invalid, now)[0])
+
+    def test_clean_timestamp_rejects_non_finite_numbers(self):
+        now = timezone.now()
+        for invalid in [float('nan'), float('inf'), float('-inf')]:
+            date_counted, error = clean_timestamp(invalid, now)
+            self.assertIsNone(date_counted)
+            self.assertTrue(error)
+
+    def test_apply_operations_creates_list_items(self):
+        results, version = apply_operations(self.store1, [self.operation('a', '3'), self.operation('b', '4', item=self.item2)])
+        self.assertEqual([result['status'] for result in results], ['Applied', 'Applied'])
+        self.assertEqual(self.amount(), Decimal('3'))
+        self.assertEqual(self.amount(self.item2), Decimal('4'))
+        self.assertEqual(ListItem.objects.get(list=self.list, item=self.item1).op_id, 'a')
+        self.assertEqual(version, Store.objects.get(pk=self.store1.pk).version)
+
+    def test_apply_operations_applies_each_op_id_once(self):
+        apply_operations(self.store1, [self.operation('a', '3')])
+        ListItem.objects.filter(list=self.list, item=self.item1).update(amount=5)
+
+        results, version = apply_operations(self.store1, [self.operation('a', '3')])
+        self.assertEqual(results, [{'op_id':'a', 'status':'Applied', 'message':'', 'duplicate':True}])
+        self.assertEqual(self.amount(), Decimal('5'))
+        self.assertEqual(SyncOperation.objects.filter(store=self.store1).count(), 1)
+
+    def test_apply_operations_ignores_repeated_op_id_in_batch(self):
+        results, version = apply_operations(self.store1, [self.operation('a', '3'), self.operation('a', '7')])
+        self.assertEqual([result['duplicate'] for result in results], [False, True])
+        self.assertEqual(self.amount(), Decimal('3'))
+
+    def test_apply_operations_latest_count_wins_in_any_order(self):
+        operations = [self.operation('a', '3', ms_ago=1000), self.operation('b', '4', ms_ago=2000)]
+        results, version = apply_operations(self.store1, operations)
+        self.assertEqual([result['status'] for result in results], ['Applied', 'Superseded'])
+        self.assertEqual(self.amount(), Decimal('3'))
+
+    def test_apply_operations_older_count_does_not_replace_newer(self):
+        apply_operations(self.store1, [self.operation('b', '4', ms_ago=1000)])
+        results, version = apply_operations(self.store1, [self.operation('a', '3', ms_ago=2000)])
+        self.assertEqual(results[0]['status'], 'Superseded')
+        self.assertEqual(self.amount(), Decimal('4'))
+
+    def test_apply_operations_breaks_ties_with_op_id(self):
+        results, version = apply_operations(self.store1, [self.operation('b', '4'), self.operation('a', '3')])
+        self.assertEqual([result['status'] for result in results], ['Applied', 'Superseded'])
+        self.assertEqual(self.amount(), Decimal('4'))
+
+    def test_apply_operations_rejects_invalid_operations(self):
+        other_store = Store.objects.create(user=self.user1, name="Other Store")
+        other_item = Item.objects.create(store=other_store, name="Rum")
+        operations = [
+            self.operation('a', '-1'),
+            self.operation('b', '3', item=other_item),
+            dict(self.operation('c', '3'), timestamp='now'),
+            self.operation('', '3'),
+            'operation',
+            self.operation('d', '3', item=self.item2),
+        ]
+        results, version = apply_operations(self.store1, operations)
+        self.assertEqual([result['status'] for result in results], ['Rejected'] * 5 + ['Applied'])
+        self.assertTrue(all(result['message'] for result in results[:5]))
+        self.assertEqual(SyncOperation.objects.filter(store=self.store1, status=SyncOperation.REJECTED).count(), 3)
+        self.assertFalse(ListItem.objects.filter(list=self.list, item=self.item1).exists())
+
+    def test_apply_operations_rejects_missing_amounts(self):
+        apply_operations(self.store1, [self.operation('a', '5', ms_ago=1000)])
+        operations = [self.operation('b', None), self.operation('c', ''), self.operation('d', 'null')]
+        del operations[0]['amount']
+        results, version = apply_operations(self.store1, operations)
+        self.assertEqual([result['status'] for result in results], ['Rejected'] * 3)
+        self.assertEqual(self.amount(), Decimal('5'))
+
+    def test_latest_operations_keeps_saved_count_when_later(self):
+        operation = SyncOperation(op_id='a', list_id=1, item_id=1, date_counted=timezone.now() - datetime.timedelta(minutes=1))
+        self.assertEqual(latest_operations([operation], [(1, 1, None, '')]), {(1, 1): operation})
+        self.assertEqual(latest_operations([operation], [(1, 1, timezone.now(), '')]), {})
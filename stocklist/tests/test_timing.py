@@ -0,0 +1,118 @@
+import json
+import re
+from asgiref.sync import async_to_sync
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+
+from stocklist.timing import Timing, TimingMiddleware, current_timing, instrument, span
+from stocklist.models import User, Store, List, ListItem, Item
+
+
+def server_timing(response):
+    '''
+    Return: dict - {metric: (duration, description)}
+    '''
+    metrics = {}
+    for metric in response['Server-Timing'].split(', '):
+        match = re.match(r'^(\w+);dur=([0-9.]+)(?:;desc="(.*)")?$', metric)
+        metrics[match.group(1)] = (float(match.group(2)), match.group(3))
+    return metrics
+
+
+@override_settings(REQUEST_TIMING=True, REQUEST_TIMING_VIEWS=['items', 'import_items'], REQUEST_TIMING_SLOW_MS=None, REQUEST_TIMING_MAX_QUERIES=None)
+class TimingMiddlewareTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+
+        # Create User, Store, List, Items
+        cls.user1 = User.objects.create_user('Mike', password='1X<ISRUkw+tuK')
+        cls.store1 = Store.objects.create(user=cls.user1, name="Test Store")
+        cls.list1 = List.objects.create(store=cls.store1, name="End", type=List.COUNT)
+        cls.item1 = Item.objects.create(store=cls.store1, name="Vodka")
+        ListItem.objects.create(list=cls.list1, item=cls.item1, amount=2)
+
+        return super().setUpTestData()
+
+    def setUp(self):
+        self.client.login(username='Mike', password='1X<ISRUkw+tuK')
+
+    def test_timed_view_has_server_timing_header(self):
+        with self.assertLogs('stocklist.timing', level='INFO'):
+            response = self.client.get('/items/{}'.format(self.store1.pk))
+        metrics = server_timing(response)
+        self.assertEqual(list(metrics), ['db', 'view', 'serialize', 'total'])
+        self.assertRegex(metrics['db'][1], r'^[1-9][0-9]* queries$')
+        self.assertGreaterEqual(metrics['total'][0], metrics['view'][0])
+
+    def test_timed_view_logs_json_line(self):
+        with self.assertLogs('stocklist.timing', level='INFO') as logs:
+            response = self.client.post('/import_items/{}'.format(self.store1.pk), json.dumps([
+                {"name": "Stock", "type": "AD", "items": [{"name": "Gin", "amount": "1"}]}
+            ]), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["view"], "import_items")
+        self.assertEqual(line["status"], 201)
+        self.assertGreater(line["queries"], 0)
+        self.assertEqual(set(line), {"method", "path", "view", "status", "queries", "db_ms", "view_ms", "serialize_ms", "total_ms"})
+
+    @override_settings(REQUEST_TIMING_MAX_QUERIES=0, REQUEST_TIMING_SLOW_MS=0)
+    def test_requests_over_thresholds_log_warning(self):
+        with self.assertLogs('stocklist.timing', level='INFO') as logs:
+            self.client.get('/items/{}'.format(self.store1.pk))
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertEqual(json.loads(logs.records[0].getMessage())["exceeded"], ["slow_ms", "max_queries"])
+
+    def test_untimed_view_has_no_server_timing_header(self):
+        response = self.client.get('/stock/{}'.format(self.store1.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(REQUEST_TIMING_VIEWS=None)
+    def test_every_view_timed_if_views_is_none(self):
+        with self.assertLogs('stocklist.timing', level='INFO'):
+            response = self.client.get('/stock/{}'.format(self.store1.pk))
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(REQUEST_TIMING=False)
+    def test_timing_off(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            TimingMiddleware(lambda request: HttpResponse())
+        response = self.client.get('/items/{}'.format(self.store1.pk))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_async_view_queries_are_counted(self):
+        client = AsyncClient()
+        client.force_login(self.user1)
+        # ASGIHandler sends request_started in the thread that runs the view's queries, AsyncClient does not
+        instrument(connection)
+
+        async def get():
+            return await client.get('/items/{}'.format(self.store1.pk))
+
+        with self.assertLogs('stocklist.timing', level='INFO') as logs:
+            response = async_to_sync(get)()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Server-Timing', response)
+        self.assertGreater(json.loads(logs.records[0].getMessage())["queries"], 0)
+
+    def test_span_records_named_time(self):
+        timing = Timing()
+        token = current_timing.set(timing)
+        try:
+            with span('serialize'):
+                pass
+            with span('serialize'):
+                pass
+        finally:
+            current_timing.reset(token)
+        self.assertEqual(list(timing.spans), ['db', 'view', 'serialize'])
+        self.assertGreater(timing.spans['serialize'], 0)
+
+    def test_span_outside_request_does_nothing(self):
+        with span('serialize'):
+            self.assertIsNone(current_timing.get())
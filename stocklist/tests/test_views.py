@@ -1,9 +1,19 @@
+import asyncio
 import json
 import copy
+from asgiref.sync import sync_to_async
 from decimal import Decimal
+from unittest import mock, skipUnless
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 
-from stocklist.models import User, Store, List, ListItem, Item, MAX_STORE_NAME_LENGTH 
+from stocklist import views
+from stocklist.importer import openpyxl
+from stocklist.tests import test_importer
+from stocklist.jobs import run_import_job
+from stocklist.models import User, Store, List, ListItem, Item, ImportJob, MAX_STORE_NAME_LENGTH 
 
 
 class BaseTestCase(TestCase):
@@ -104,6 +114,183 @@ class ItemsTestCase(ImportTestCase):
         self.assertEqual(lists[0]['name'], 'Stock')
 
 
+    def test_GET_items_query_count_is_constant(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        items = [{'name':'Item {}'.format(i), 'amount':str(i)} for i in range(50)]
+        json_data = [
+            {'name':'Import', 'type':'AD', 'items':items},
+            {'name':'Start', 'items':items},
+            {'name':'End', 'items':items[:10]},
+        ]
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(json_data))
+
+        # session, user, store, items, list_items, lists
+        path = "/items/{}".format(self.store.pk)
+        with self.assertNumQueries(6):
+            response = self.client.get(path)
+
+        data = response.json()
+        self.assertEqual(len(data['items']), 50)
+        self.assertEqual([list['count'] for list in data['lists']], [50, 50, 10])
+        self.assertEqual(len(data['items'][0]['list_items']), 3)
+
+    def test_GET_items_returns_etag(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/items/{}".format(self.store.pk)
+        response = self.client.get(path)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"{}-{}"'.format(self.store.pk, self.store.version))
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.get(path + "?format=matrix")['ETag'], '"{}-{}-matrix"'.format(self.store.pk, self.store.version))
+
+    def test_GET_items_returns_400_for_unknown_format(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/items/{}".format(self.store.pk)
+        for format in ['csv', 'matrix"', 'matrix%0AX-Injected:%201']:
+            response = self.client.get("{}?format={}".format(path, format))
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.has_header('ETag'))
+
+    def test_GET_items_returns_304_for_matching_etag_without_reading_items(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(self.json_data))
+        path = "/items/{}".format(self.store.pk)
+        etag = self.client.get(path)['ETag']
+
+        # session, user, store
+        with self.assertNumQueries(3):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_GET_items_returns_200_after_list_item_changes(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(self.json_data))
+        path = "/items/{}".format(self.store.pk)
+        etag = self.client.get(path)['ETag']
+
+        list_item = ListItem.objects.filter(list__store=self.store).first()
+        path_create_list_item = "/create_list_item/{}/{}".format(list_item.list_id, list_item.item_id)
+        self.client.generic('POST', path_create_list_item, json.dumps({'amount':'5'}))
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_GET_items_returns_version(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(self.json_data))
+        version = Store.objects.get(pk=self.store.pk).version
+
+        path = "/items/{}".format(self.store.pk)
+        self.assertEqual(self.client.get(path).json()['version'], version)
+        self.assertEqual(self.client.get(path + "?format=matrix").json()['version'], version)
+
+    def test_GET_items_since_returns_only_changes(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(self.json_data))
+        path = "/items/{}".format(self.store.pk)
+        version = self.client.get(path).json()['version']
+
+        list_item = ListItem.objects.filter(list__store=self.store).order_by('id').first()
+        path_create_list_item = "/create_list_item/{}/{}".format(list_item.list_id, list_item.item_id)
+        self.client.generic('POST', path_create_list_item, json.dumps({'amount':'5'}))
+
+        response = self.client.get("{}?since={}".format(path, version))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['since'], version)
+        self.assertEqual(data['version'], version + 1)
+        self.assertEqual(data['items'], [])
+        self.assertEqual(data['lists'], [])
+        self.assertEqual(data['list_items'], [{'id':list_item.id, 'list_id':list_item.list_id, 'item_id':list_item.item_id, 'amount':'5.0'}])
+        self.assertEqual(data['deleted'], {'items':[], 'lists':[], 'list_items':[]})
+
+    def test_GET_items_since_returns_deleted_lists(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(self.json_data))
+        path = "/items/{}".format(self.store.pk)
+        version = self.client.get(path).json()['version']
+
+        list = List.objects.get(store=self.store)
+        list_id = list.id
+        list.delete()
+
+        data = self.client.get("{}?since={}".format(path, version)).json()
+        self.assertEqual(data['deleted']['lists'], [list_id])
+
+    def test_GET_items_since_returns_deleted_items_list_items_and_list_counts(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(self.json_data))
+        path = "/items/{}".format(self.store.pk)
+        version = self.client.get(path).json()['version']
+
+        list = List.objects.get(store=self.store)
+        list_item = list.list_items.order_by('id').first()
+        count = list.list_items.count()
+        item_id = list_item.item_id
+        list_item.item.delete()
+
+        data = self.client.get("{}?since={}".format(path, version)).json()
+        self.assertEqual(data['deleted']['items'], [item_id])
+        self.assertEqual(data['deleted']['list_items'], [list_item.id])
+        self.assertEqual([(list_data['id'], list_data['count']) for list_data in data['lists']], [(list.id, count - 1)])
+
+    def test_GET_items_since_returns_304_for_matching_etag(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/items/{}?since=0".format(self.store.pk)
+        etag = self.client.get(path)['ETag']
+        self.assertNotEqual(etag, self.client.get("/items/{}".format(self.store.pk))['ETag'])
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_GET_items_since_returns_400_for_unknown_version(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/items/{}".format(self.store.pk)
+        for since in ['-1', 'a', '1000']:
+            response = self.client.get("{}?since={}".format(path, since))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['version'], self.store.version)
+
+    def test_GET_items_matrix_returns_amounts_matrix(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        json_data_copy = copy.deepcopy(self.json_data)
+        json_data_copy.append({'name':'Start', 'type':'CO', 'items':[{'name':'Bacardi Superior Rum 70CL BTL', 'amount':'4.5'}]})
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(json_data_copy))
+
+        path = "/items/{}?format=matrix".format(self.store.pk)
+        response = self.client.get(path)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['item_ids'], list(Item.objects.filter(store=self.store).order_by('id').values_list('id', flat=True)))
+        self.assertEqual(data['item_names'][0], 'Absolut Vodka 70CL BTL')
+        self.assertEqual([list['name'] for list in data['lists']], ['Stock', 'Start'])
+        self.assertEqual([list['count'] for list in data['lists']], [3, 1])
+        self.assertEqual(data['amounts'], [['12.0', None], ['9.0', '4.5'], ['0.0', None]])
+
+    def test_GET_items_matrix_query_count_independent_of_items(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/items/{}?format=matrix".format(self.store.pk)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(path)
+        empty_store_queries = len(context.captured_queries)
+
+        import_path = "/import_items/{}".format(self.store.pk)
+        self.client.generic('POST', import_path, json.dumps(self.json_data))
+        with self.assertNumQueries(empty_store_queries):
+            self.client.get(path)
+
+
 class ImportItemsTestCase(ImportTestCase):
 
     @classmethod
@@ -186,10 +373,14 @@ class ImportItemsTestCase(ImportTestCase):
         response = self.client.generic('POST', path, json.dumps(json_data_copy))
         
         lists = List.objects.filter(store=self.store)
-        self.assertEqual(lists.count(), 1)
+        self.assertEqual(lists.count(), 0)
         items = Item.objects.filter(store=self.store)
-        self.assertEqual(items.count(), 3)
+        self.assertEqual(items.count(), 0)
         self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0]['row'], 3)
+        self.assertEqual(errors[0]['field'], 'name')
 
     def test_POST_import_items_handles_missing_item_name(self):
         logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
@@ -238,10 +429,10 @@ class ImportItemsTestCase(ImportTestCase):
         response = self.client.generic('POST', path, json.dumps(json_data_copy))
         
         lists = List.objects.filter(store=self.store)
-        self.assertEqual(lists.count(), 1)
-        list_items = ListItem.objects.filter(list=lists[0].pk)
-        self.assertEqual(list_items.count(), 3)
+        self.assertEqual(lists.count(), 0)
+        self.assertEqual(ListItem.objects.count(), 0)
         self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['field'], 'amount')
 
     def test_POST_import_items_returns_400_for_invalid_list_items_amount2(self):
         logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
@@ -258,10 +449,10 @@ class ImportItemsTestCase(ImportTestCase):
         response = self.client.generic('POST', path, json.dumps(json_data_copy))
         
         lists = List.objects.filter(store=self.store)
-        self.assertEqual(lists.count(), 1)
-        list_items = ListItem.objects.filter(list=lists[0].pk)
-        self.assertEqual(list_items.count(), 3)
+        self.assertEqual(lists.count(), 0)
+        self.assertEqual(ListItem.objects.count(), 0)
         self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['field'], 'amount')
 
     def test_POST_import_items_creates_listitem_for_missing_item_amount(self):
         logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
@@ -336,13 +527,331 @@ class ImportItemsTestCase(ImportTestCase):
         response = self.client.generic('POST', path, json.dumps(json_data_copy))
         
         lists = List.objects.filter(store=self.store)
-        self.assertEqual(lists.count(), 1)
-        list_items = ListItem.objects.filter(list=lists[0].pk)
-        self.assertEqual(list_items.count(), 3)
+        self.assertEqual(lists.count(), 0)
+        self.assertEqual(ListItem.objects.count(), 0)
         items = Item.objects.filter(store=self.store.pk)
-        self.assertEqual(items.count(), 3)
+        self.assertEqual(items.count(), 0)
+        self.assertEqual(response.status_code, 400)
+
+    def test_POST_import_items_returns_similar_items(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        item = Item.objects.create(store=self.store, name='Absolut Vodka 70CL BTL')
+
+        json_data_copy = copy.deepcopy(self.json_data)
+        json_data_copy[0]['items'] = [{'name':'Absolut Vodka 70 CL BTL', 'amount':'1'}]
+        path = "/import_items/{}".format(self.store.pk)
+        response = self.client.generic('POST', path, json.dumps(json_data_copy))
+
+        self.assertEqual(response.status_code, 201)
+        matches = response.json()['matches']
+        self.assertEqual([match['name'] for match in matches], ['Absolut Vodka 70 CL BTL'])
+        self.assertEqual(matches[0]['candidates'][0]['item_id'], item.pk)
+
+    def test_POST_import_items_returns_every_error_and_saves_nothing(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+
+        json_data_copy = copy.deepcopy(self.json_data)
+        json_data_copy.append({'name':'Start', 'type':'CO', 'items':[
+            {'name':'A'*(80+1), 'amount':'1'},
+            {'name':'Test Fail for precision', 'amount':'1.25'},
+            {'name':'Test Fail for text', 'amount':'ten'},
+        ]})
+        json_data_copy.append({'name':'End', 'type':'ZZ'})
+
+        path = "/import_items/{}".format(self.store.pk)
+        response = self.client.generic('POST', path, json.dumps(json_data_copy))
+
+        self.assertEqual(response.status_code, 400)
+        data = response.json()
+        self.assertEqual(data['error_count'], 4)
+        self.assertEqual(
+            [(error['list'], error['row'], error['field']) for error in data['errors']],
+            [(1, 0, 'name'), (1, 1, 'amount'), (1, 2, 'amount'), (2, None, 'type')]
+        )
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+        self.assertEqual(Item.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_import_items_returns_400_for_malformed_json(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+
+        path = "/import_items/{}".format(self.store.pk)
+        for body in ['[{"name":', '{"a":1}', '["Import"]', '']:
+            response = self.client.generic('POST', path, body)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error'], "Import data must be a JSON array.")
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_import_items_returns_400_for_malformed_lists_and_rows(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+
+        json_data = [
+            {'name':5, 'items':[{'name':'Vodka'}]},
+            {'name':'Start', 'items':{'name':'Vodka'}},
+            {'name':'End', 'items':['Vodka', {'name':'Gin'}, 7]},
+        ]
+        path = "/import_items/{}".format(self.store.pk)
+        response = self.client.generic('POST', path, json.dumps(json_data))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [(error['list'], error['row'], error['field']) for error in response.json()['errors']],
+            [(0, None, 'name'), (1, None, 'items'), (2, 0, 'row'), (2, 2, 'row')]
+        )
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+        self.assertEqual(Item.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_import_items_query_count_independent_of_rows(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/import_items/{}".format(self.store.pk)
+
+        def import_query_count(list_name, num_rows):
+            json_data_copy = copy.deepcopy(self.json_data)
+            json_data_copy[0]['name'] = list_name
+            json_data_copy[0]['items'] = [{'name':'{} {}'.format(list_name, i), 'amount':str(i)} for i in range(num_rows)]
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.generic('POST', path, json.dumps(json_data_copy))
+            self.assertEqual(response.status_code, 201)
+            return len(context.captured_queries)
+
+        self.assertEqual(import_query_count('Small', 3), import_query_count('Large', 140))
+        self.assertEqual(ListItem.objects.filter(list__name='Large').count(), 140)
+
+
+class UploadCSVTestCase(BaseTestCase):
+
+    CSV_FILE = b'Item,Size,Amount\nVodka,70cl,10\nGin,70cl,5\n,,\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        return sup
+
+    def upload(self, csv_file=CSV_FILE, **data):
+        path = "/upload_csv/{}".format(self.store.pk)
+        data.setdefault('file', SimpleUploadedFile('test_data.csv', csv_file, content_type='text/csv'))
+        return self.client.post(path, data)
+
+    def test_POST_upload_csv_redirects_to_login_if_not_logged_in(self):
+        response = self.client.post("/upload_csv/1")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, "/login/?next=/upload_csv/1")
+
+    def test_POST_upload_csv_returns_404_for_invalid_store(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.post("/upload_csv/2")
+        self.assertEqual(response.status_code, 404)
+
+    def test_GET_upload_csv_returns_400_for_user_logged_in(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/upload_csv/{}".format(self.store.pk))
         self.assertEqual(response.status_code, 400)
 
+    def test_POST_upload_csv_returns_400_for_missing_file(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.post("/upload_csv/{}".format(self.store.pk), {'name_fields':'Item'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_POST_upload_csv_returns_400_for_missing_name_fields(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.upload(amount_field='Amount')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_upload_csv_returns_400_for_invalid_row_and_saves_nothing(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.upload(self.CSV_FILE + b'Rum,70cl,-1\n', name_fields='Item', amount_field='Amount')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['row'], 3)
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+        self.assertEqual(Item.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_upload_csv_returns_400_for_non_utf8_file(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.upload(self.CSV_FILE + 'Caf\xe9,,2\n'.encode('latin-1'), name_fields='Item', amount_field='Amount')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 5 is not UTF-8', response.json()['error'][0])
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_upload_csv_returns_400_for_malformed_lists(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        for lists in ['[{"name":', '{"name":"Import"}', '["Import"]']:
+            response = self.upload(name_fields='Item', lists=lists)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error'], "Lists must be a JSON array.")
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_upload_csv_creates_list_items(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.upload(name_fields=['Item', 'Size'], amount_field='Amount')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['imported'], 2)
+        self.assertEqual(response.json()['skipped'], 1)
+        list_item = ListItem.objects.get(item__name='Vodka 70cl', list__store=self.store)
+        self.assertEqual(list_item.amount, Decimal('10'))
+        self.assertEqual(list_item.list.type, List.ADDITION)
+
+    def test_POST_upload_csv_creates_lists(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        lists = [{'name':'Import', 'type':'AD'}, {'name':'Start'}, {'name':'End'}]
+        response = self.upload(name_fields='Item', lists=json.dumps(lists))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(List.objects.filter(store=self.store).count(), 3)
+        self.assertEqual(List.objects.get(store=self.store, name='Import').list_items.count(), 2)
+        self.assertEqual(List.objects.get(store=self.store, name='Start').list_items.count(), 0)
+
+
+@skipUnless(openpyxl, 'openpyxl is not installed')
+class UploadXLSXTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        return sup
+
+    def setUp(self):
+        super().setUp()
+        self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        self.xlsx_file = test_importer.xlsx_file([('Notes', []), ('Stock', test_importer.ReadSheetTestCase.SHEET_ROWS)])
+
+    def test_POST_xlsx_sheets_returns_sheet_previews(self):
+        response = self.client.post("/xlsx_sheets/{}".format(self.store.pk), {'file': self.xlsx_file})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([sheet['name'] for sheet in response.json()['sheets']], ['Notes', 'Stock'])
+
+    def test_POST_upload_csv_imports_xlsx_sheet(self):
+        path = "/upload_csv/{}".format(self.store.pk)
+        response = self.client.post(path, {
+            'file': self.xlsx_file, 'sheet': 'Stock', 'header_row': '2', 'name_fields': ['Item', 'Size'], 'amount_field': 'Amount',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['imported'], 3)
+        self.assertEqual(ListItem.objects.get(item__name='Vodka 70cl', list__store=self.store).amount, Decimal('10'))
+
+    def test_POST_upload_csv_returns_400_for_unknown_sheet(self):
+        path = "/upload_csv/{}".format(self.store.pk)
+        response = self.client.post(path, {'file': self.xlsx_file, 'sheet': 'Counts', 'name_fields': 'Item'})
+        self.assertEqual(response.status_code, 400)
+
+
+class XLSXSheetsTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        return sup
+
+    def test_POST_xlsx_sheets_redirects_to_login_if_not_logged_in(self):
+        response = self.client.post("/xlsx_sheets/1")
+        self.assertEqual(response.status_code, 302)
+
+    def test_GET_xlsx_sheets_returns_400(self):
+        self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/xlsx_sheets/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_POST_xlsx_sheets_returns_400_for_missing_file(self):
+        self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.post("/xlsx_sheets/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_POST_xlsx_sheets_returns_400_for_invalid_file(self):
+        self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.post("/xlsx_sheets/{}".format(self.store.pk), {'file': SimpleUploadedFile('test_data.xlsx', b'Item,Amount')})
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('stocklist.importer.openpyxl', None)
+    def test_POST_upload_csv_returns_400_for_xlsx_without_openpyxl(self):
+        self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.post("/upload_csv/{}".format(self.store.pk), {'file': SimpleUploadedFile('test_data.xlsx', b''), 'name_fields': 'Item'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('openpyxl', response.json()['error'][0])
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_upload_csv_returns_400_for_invalid_header_row(self):
+        self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.post("/upload_csv/{}".format(self.store.pk), {
+            'file': SimpleUploadedFile('test_data.xlsx', b''), 'name_fields': 'Item', 'header_row': '0',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+
+
+class ImportJobsTestCase(ImportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        return sup
+
+    def test_POST_import_jobs_redirects_to_login_if_not_logged_in(self):
+        response = self.client.post("/import_jobs/1")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, "/login/?next=/import_jobs/1")
+
+    def test_POST_import_jobs_returns_404_for_invalid_store(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.post("/import_jobs/2")
+        self.assertEqual(response.status_code, 404)
+
+    def test_GET_import_jobs_returns_400_for_user_logged_in(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/import_jobs/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_POST_import_jobs_returns_job_id_without_importing(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/import_jobs/{}".format(self.store.pk)
+        response = self.client.generic('POST', path, json.dumps(self.json_data))
+
+        self.assertEqual(response.status_code, 202)
+        job = ImportJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(job.status, ImportJob.PENDING)
+        self.assertEqual(List.objects.filter(store=self.store).count(), 0)
+
+    def test_POST_import_jobs_returns_400_for_malformed_json(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/import_jobs/{}".format(self.store.pk)
+        for body in ['[{"name":', '{"name":"Import"}']:
+            response = self.client.generic('POST', path, body)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+        csv_file = SimpleUploadedFile('test_data.csv', b'Item,Amount\nVodka,10\n')
+        response = self.client.post(path, {'file': csv_file, 'name_fields': ['Item'], 'lists': '[{"name":'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_GET_import_job_returns_status(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/import_jobs/{}".format(self.store.pk)
+        job_id = self.client.generic('POST', path, json.dumps(self.json_data)).json()['job_id']
+        run_import_job(ImportJob.objects.get(pk=job_id))
+
+        response = self.client.get("/import_job/{}".format(job_id))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['status'], 'Done')
+        self.assertEqual(data['rows_processed'], 3)
+        self.assertEqual(data['rows_skipped'], 0)
+        self.assertEqual(data['errors'], [])
+
+    def test_GET_import_job_returns_404_for_other_users_job(self):
+        other_user = User.objects.create_user('other')
+        other_store = Store.objects.create(name='Other Store', user=other_user)
+        job = ImportJob.objects.create(store=other_store, lists=self.json_data)
+
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/import_job/{}".format(job.pk))
+        self.assertEqual(response.status_code, 404)
+
 
 class CreateListTestCase(ImportTestCase):
 
@@ -488,6 +997,26 @@ class CreateListItemTestCase(ImportTestCase):
         self.assertEqual(list_items[0].amount, 11)
         self.assertEqual(response.status_code, 201)
 
+    def test_POST_create_list_item_balance_queries_do_not_depend_on_lists(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        store = Store.objects.create(name='Test Store', user=self.user1)
+        list = List.objects.create(name='Test List', type='CO', store=store)
+        items = [Item.objects.create(store=store, name="Item {}".format(i)) for i in range(2)]
+
+        def balance_queries(item, amount):
+            path = "/create_list_item/{}/{}".format(list.pk, item.pk)
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self.client.generic('POST', path, json.dumps({'amount':amount})).status_code, 201)
+            return [query['sql'] for query in context.captured_queries if 'stocklist_itembalance' in query['sql']]
+
+        # read the balance, then upsert it
+        self.assertEqual(len(balance_queries(items[0], '1')), 2)
+        for i in range(10):
+            List.objects.create(name='Test List {}'.format(i), type='AD', store=store)
+        self.assertEqual(len(balance_queries(items[1], '1')), 2)
+        # the same amount again
+        self.assertEqual(balance_queries(items[1], '1'), [])
+
     def test_POST_create_list_item_returns_400_for_invalid_list_items_amount_min(self):
         logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
         store = Store.objects.create(name='Test Store', user=self.user1)
@@ -511,6 +1040,333 @@ class CreateListItemTestCase(ImportTestCase):
         self.assertEqual(response.status_code, 400)
 
 
+class UpdateListItemsTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        cls.list = List.objects.create(name='Test List', type='CO', store=cls.store)
+        cls.items = [Item.objects.create(store=cls.store, name="Item {}".format(i)) for i in range(3)]
+        return sup
+
+    def path(self):
+        return "/update_list_items/{}".format(self.list.pk)
+
+    def test_POST_update_list_items_redirects_to_login_if_not_logged_in(self):
+        response = self.client.generic('POST', self.path(), json.dumps([]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, "/login/?next={}".format(self.path()))
+
+    def test_POST_update_list_items_returns_404_for_other_users_list(self):
+        user2 = User.objects.create_user(username='other', password=self.PASSWORD)
+        logged_in = self.client.login(username='other', password=self.PASSWORD)
+        response = self.client.generic('POST', self.path(), json.dumps([]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_GET_update_list_items_returns_400_for_user_logged_in(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get(self.path())
+        self.assertEqual(response.status_code, 400)
+
+    def test_POST_update_list_items_creates_and_updates_list_items(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        ListItem.objects.create(list=self.list, item=self.items[0], amount=1)
+
+        data = [{'item_id':item.id, 'amount':str(i + 5)} for i, item in enumerate(self.items)]
+        response = self.client.generic('POST', self.path(), json.dumps(data))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(response.json()['version'], Store.objects.get(pk=self.store.pk).version)
+
+        amounts = dict(ListItem.objects.filter(list=self.list).values_list('item_id', 'amount'))
+        self.assertEqual(amounts, {item.id: Decimal(i + 5) for i, item in enumerate(self.items)})
+
+    def test_POST_update_list_items_query_count_independent_of_rows(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        items = Item.objects.bulk_create([Item(store=self.store, name="Bulk {}".format(i)) for i in range(140)])
+        item_ids = list(Item.objects.filter(store=self.store).values_list('id', flat=True))
+
+        def update_query_count(ids):
+            data = [{'item_id':item_id, 'amount':'2'} for item_id in ids]
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.generic('POST', self.path(), json.dumps(data))
+            self.assertEqual(response.status_code, 201)
+            return len(context.captured_queries)
+
+        self.assertEqual(update_query_count(item_ids[:2]), update_query_count(item_ids))
+        self.assertEqual(ListItem.objects.filter(list=self.list).count(), len(item_ids))
+
+    def test_POST_update_list_items_returns_400_and_saves_nothing_for_invalid_rows(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        other_store = Store.objects.create(name='Other Store', user=self.user1)
+        other_item = Item.objects.create(store=other_store, name="Other")
+
+        data = [
+            {'item_id':self.items[0].id, 'amount':'2'},
+            {'item_id':self.items[1].id, 'amount':'-1'},
+            {'item_id':other_item.id, 'amount':'2'},
+            {'item_id':self.items[0].id, 'amount':'3'},
+        ]
+        response = self.client.generic('POST', self.path(), json.dumps(data))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['row'] for error in response.json()['errors']], [1, 2, 3])
+        self.assertFalse(ListItem.objects.filter(list=self.list).exists())
+
+    def test_POST_update_list_items_returns_400_and_keeps_counts_for_missing_amounts(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        ListItem.objects.create(list=self.list, item=self.items[0], amount=7)
+
+        data = [{'item_id':self.items[0].id}, {'item_id':self.items[1].id, 'amount':''}, {'item_id':self.items[2].id, 'amount':None}]
+        response = self.client.generic('POST', self.path(), json.dumps(data))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([(error['row'], error['field']) for error in response.json()['errors']], [(0, 'amount'), (1, 'amount'), (2, 'amount')])
+        self.assertEqual(ListItem.objects.get(list=self.list, item=self.items[0]).amount, Decimal('7'))
+
+    def test_POST_update_list_items_returns_400_for_invalid_json_shape(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.generic('POST', self.path(), json.dumps({'item_id':1, 'amount':'1'}))
+        self.assertEqual(response.status_code, 400)
+
+
+class SyncTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        cls.list = List.objects.create(name='Test List', type='CO', store=cls.store)
+        cls.item = Item.objects.create(store=cls.store, name="TEST ITEM NAME")
+        return sup
+
+    def path(self):
+        return "/sync/{}".format(self.store.pk)
+
+    def operations(self):
+        return [{'op_id':'op-1', 'timestamp':1700000000000, 'list_id':self.list.id, 'item_id':self.item.id, 'amount':'2.5'}]
+
+    def test_POST_sync_redirects_to_login_if_not_logged_in(self):
+        response = self.client.generic('POST', self.path(), json.dumps([]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, "/login/?next={}".format(self.path()))
+
+    def test_POST_sync_returns_404_for_invalid_store(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.generic('POST', "/sync/1000", json.dumps([]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_GET_sync_returns_400_for_user_logged_in(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get(self.path())
+        self.assertEqual(response.status_code, 400)
+
+    def test_POST_sync_applies_operations_once(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.generic('POST', self.path(), json.dumps(self.operations()))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['results'], [{'op_id':'op-1', 'status':'Applied', 'message':'', 'duplicate':False}])
+        self.assertEqual(ListItem.objects.get(list=self.list, item=self.item).amount, Decimal('2.5'))
+
+        # replay after a lost response
+        response = self.client.generic('POST', self.path(), json.dumps(self.operations()))
+        self.assertEqual(response.json()['results'][0]['duplicate'], True)
+        self.assertEqual(ListItem.objects.filter(list=self.list, item=self.item).count(), 1)
+
+    def test_POST_sync_rejects_nan_timestamp(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        operations = [dict(self.operations()[0], timestamp=float('nan'))]
+        response = self.client.generic('POST', self.path(), json.dumps(operations))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['results'][0]['status'], 'Rejected')
+        self.assertFalse(ListItem.objects.filter(list=self.list, item=self.item).exists())
+
+    def test_POST_sync_returns_400_for_too_many_operations(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.generic('POST', self.path(), json.dumps(self.operations() * 501))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.generic('POST', self.path(), json.dumps(self.operations()[0]))
+        self.assertEqual(response.status_code, 400)
+
+
+class EventsTestCase(BaseTestCase):
+
+    def test_GET_events_redirects_to_login_if_not_logged_in(self):
+        response = self.client.get("/events/1")
+        self.assertEqual(response.status_code, 302)
+
+    def test_GET_events_returns_404_for_invalid_store(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/events/1")
+        self.assertEqual(response.status_code, 404)
+
+    def test_GET_events_returns_204_without_asgi(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        store = Store.objects.create(name='Test Store', user=self.user1)
+        response = self.client.get("/events/{}".format(store.pk))
+        self.assertEqual(response.status_code, 204)
+
+
+class StockTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        cls.list = List.objects.create(name='Test List', type='CO', store=cls.store)
+        cls.item = Item.objects.create(store=cls.store, name="TEST ITEM NAME")
+        ListItem.objects.create(list=cls.list, item=cls.item, amount=4)
+        return sup
+
+    def test_GET_stock_redirects_to_login_if_not_logged_in(self):
+        response = self.client.get("/stock/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 302)
+
+    def test_GET_stock_returns_404_for_invalid_store(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/stock/1000")
+        self.assertEqual(response.status_code, 404)
+
+    def test_POST_stock_returns_400(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.post("/stock/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 400)
+
+    def test_GET_stock_returns_levels(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/stock/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], Store.objects.get(pk=self.store.pk).version)
+        self.assertEqual(response.json()['stock'], [{
+            'item_id': self.item.id,
+            'name': 'TEST ITEM NAME',
+            'last_count': '4.0',
+            'last_count_list_id': self.list.id,
+            'additions': '0.0',
+            'subtractions': '0.0',
+            'on_hand': '4.0',
+        }])
+
+        # unchanged
+        response = self.client.get("/stock/{}".format(self.store.pk), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_GET_stock_as_of_date(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/stock/{}?as_of=2000-01-01".format(self.store.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stock'][0]['on_hand'], '0.0')
+
+        response = self.client.get("/stock/{}?as_of=yesterday".format(self.store.pk))
+        self.assertEqual(response.status_code, 400)
+
+
+class VarianceTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        cls.item = Item.objects.create(store=cls.store, name="TEST ITEM NAME")
+        cls.start = List.objects.create(name='Start', type='CO', store=cls.store)
+        ListItem.objects.create(list=cls.start, item=cls.item, amount=4)
+        cls.end = List.objects.create(name='End', type='CO', store=cls.store)
+        ListItem.objects.create(list=cls.end, item=cls.item, amount=3)
+        return sup
+
+    def test_GET_variance_redirects_to_login_if_not_logged_in(self):
+        response = self.client.get("/variance/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 302)
+
+    def test_GET_variance_returns_404_for_invalid_store_or_count(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/variance/1000")
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get("/variance/{}?list_id=1000".format(self.store.pk))
+        self.assertEqual(response.status_code, 404)
+
+    def test_GET_variance_returns_report_for_latest_count(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        response = self.client.get("/variance/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['list_id'], self.end.id)
+        self.assertEqual(response.json()['totals'], {'expected': '4.0', 'counted': '3.0', 'variance': '-1.0'})
+        self.assertEqual(response.json()['items'], [{
+            'item_id': self.item.id,
+            'name': 'TEST ITEM NAME',
+            'expected': '4.0',
+            'counted': '3.0',
+            'variance': '-1.0',
+            'percentage': '-25.0',
+        }])
+
+    def test_GET_variance_filters_and_sorts(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        path = "/variance/{}?list_id={}&threshold=2&sort=-variance".format(self.store.pk, self.end.pk)
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], [])
+
+        for query in ["threshold=-1", "threshold_percentage=x", "sort=colour"]:
+            response = self.client.get("/variance/{}?{}".format(self.store.pk, query))
+            self.assertEqual(response.status_code, 400)
+
+    def test_GET_variance_returns_400_without_count(self):
+        logged_in = self.client.login(username=self.TEST_USER, password=self.PASSWORD)
+        store = Store.objects.create(name='Empty Store', user=self.user1)
+        response = self.client.get("/variance/{}".format(store.pk))
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewsTestCase(BaseTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        sup = super().setUpTestData()
+        cls.store = Store.objects.create(name='Test Store', user=cls.user1)
+        cls.list = List.objects.create(name='Test List', type='CO', store=cls.store)
+        cls.item = Item.objects.create(store=cls.store, name="TEST ITEM NAME")
+        return sup
+
+    async def login(self):
+        return await sync_to_async(self.async_client.login)(username=self.TEST_USER, password=self.PASSWORD)
+
+    def test_api_views_are_async(self):
+        for view in [views.items, views.create_list_item, views.update_store, views.import_job, views.stock, views.variance]:
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    async def test_async_views_redirect_to_login_if_not_logged_in(self):
+        response = await self.async_client.get("/items/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, "/login/?next=/items/{}".format(self.store.pk))
+
+    async def test_GET_items_under_asgi(self):
+        await self.login()
+        response = await self.async_client.get("/items/{}".format(self.store.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'][0]['name'], "TEST ITEM NAME")
+
+        response = await self.async_client.get("/items/1000")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_POST_create_list_item_under_asgi(self):
+        await self.login()
+        path = "/create_list_item/{}/{}".format(self.list.pk, self.item.pk)
+        response = await self.async_client.post(path, json.dumps({'amount':'2'}), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], True)
+        amount = await sync_to_async(lambda: ListItem.objects.get(list=self.list, item=self.item).amount)()
+        self.assertEqual(amount, Decimal('2'))
+
+    async def test_PUT_update_store_under_asgi(self):
+        await self.login()
+        path = "/update_store/{}".format(self.store.pk)
+        response = await self.async_client.put(path, json.dumps({'name':'New Name'}), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        name = await sync_to_async(lambda: Store.objects.get(pk=self.store.pk).name)()
+        self.assertEqual(name, 'New Name')
+
+
 class CreateItemTestCase(BaseTestCase):
 
     @classmethod
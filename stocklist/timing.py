@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+# the Timing of the request being handled, None outside TimingMiddleware.
+# Context variables are copied into sync_to_async threads, so queries run by async views are recorded too
+current_timing = ContextVar('current_timing', default=None)
+
+
+class Timing:
+    '''
+    What a request spent its time on: queries, and named spans in milliseconds.
+    '''
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.spans = {'db': 0.0, 'view': 0.0}
+        self.url_name = None
+        self.view_start = None
+
+    def add(self, name, duration):
+        self.spans[name] = self.spans.get(name, 0.0) + duration * 1000
+
+    def server_timing(self):
+        '''
+        Return: str - a Server-Timing header value
+        '''
+        metrics = []
+        for name, duration in self.spans.items():
+            metric = '{};dur={:.1f}'.format(name, duration)
+            if name == 'db':
+                metric += ';desc="{} queries"'.format(self.queries)
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+    def exceeded(self):
+        '''
+        Return: list - the REQUEST_TIMING_SLOW_MS and REQUEST_TIMING_MAX_QUERIES thresholds the request exceeded
+        '''
+        exceeded = []
+        slow_ms = getattr(settings, 'REQUEST_TIMING_SLOW_MS', None)
+        if slow_ms is not None and self.spans['total'] > slow_ms:
+            exceeded.append('slow_ms')
+        max_queries = getattr(settings, 'REQUEST_TIMING_MAX_QUERIES', None)
+        if max_queries is not None and self.queries > max_queries:
+            exceeded.append('max_queries')
+        return exceeded
+
+
+def record_query(execute, sql, params, many, context):
+    '''
+    A database execute wrapper: counts each query, and its time, against the current request.
+    '''
+    timing = current_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.queries += 1
+        timing.add('db', time.perf_counter() - start)
+
+
+def instrument(connection, **kwargs):
+    '''
+    Adds record_query() to a database connection once. Connected to connection_created by install().
+    '''
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def instrument_connections(**kwargs):
+    '''
+    Adds record_query() to the current thread's connections. Connected to request_started by install():
+    Django sends it in the thread that runs the request's queries, the sync_to_async thread under ASGI.
+    '''
+    for connection in connections.all():
+        instrument(connection)
+
+
+def install():
+    '''
+    Counts queries against current_timing from now on, see instrument() & instrument_connections().
+    '''
+    connection_created.connect(instrument, dispatch_uid='stocklist.timing')
+    request_started.connect(instrument_connections, dispatch_uid='stocklist.timing')
+    instrument_connections()
+
+
+def start_timing():
+    '''
+    Times the current request, or joins its Timing if a middleware before this one already started it.
+
+    Return: tuple - Timing, and a token to reset current_timing with, None if joined
+    '''
+    timing = current_timing.get()
+    if timing is not None:
+        return timing, None
+    timing = Timing()
+    return timing, current_timing.set(timing)
+
+
+def stop_timing(token):
+    if token is not None:
+        current_timing.reset(token)
+
+
+@contextmanager
+def span(name):
+    '''
+    Times a block of a view, such as serialization, as a named Server-Timing metric.
+    Does nothing outside a timed request.
+    '''
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+class TimingMiddleware:
+    '''
+    Records each request's query count, database time, view time and any spans, such as serialization,
+    as a Server-Timing header and a JSON log line on the stocklist.timing logger. Requests that exceed
+    REQUEST_TIMING_SLOW_MS or REQUEST_TIMING_MAX_QUERIES are logged as warnings.
+
+    Only views named in REQUEST_TIMING_VIEWS are reported, every view if it is None.
+    With REQUEST_TIMING off, Django leaves the middleware out, so it costs nothing.
+    Runs in the event loop for async views, so it doesn't move them to a thread.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_TIMING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.views = getattr(settings, 'REQUEST_TIMING_VIEWS', None)
+
+        install()
+
+        if asyncio.iscoroutinefunction(get_response):
+            # marks the middleware as async for Django, and process_view too, so neither is run in a thread
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            self.process_view = self.async_process_view
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timing, token = start_timing()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_timing(token)
+        return self.finish(request, response, timing)
+
+    async def __acall__(self, request):
+        timing, token = start_timing()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_timing(token)
+        return self.finish(request, response, timing)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = current_timing.get()
+        if timing is not None:
+            timing.url_name = request.resolver_match.url_name
+            timing.view_start = time.perf_counter()
+        return None
+
+    async def async_process_view(self, request, view_func, view_args, view_kwargs):
+        return TimingMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    def finish(self, request, response, timing):
+        '''
+        Adds the Server-Timing header and logs the request, if its view is timed.
+
+        Return: HttpResponse
+        '''
+        end = time.perf_counter()
+        if timing.view_start is None or (self.views is not None and timing.url_name not in self.views):
+            return response
+
+        # the view, and the response phase of middleware after this one
+        timing.add('view', end - timing.view_start)
+        timing.add('total', end - timing.start)
+        response['Server-Timing'] = timing.server_timing()
+
+        exceeded = timing.exceeded()
+        line = {
+            "method": request.method,
+            "path": request.path,
+            "view": timing.url_name,
+            "status": response.status_code,
+            "queries": timing.queries,
+        }
+        line.update({'{}_ms'.format(name): round(duration, 1) for name, duration in timing.spans.items()})
+        if exceeded:
+            line["exceeded"] = exceeded
+            logger.warning(json.dumps(line))
+        else:
+            logger.info(json.dumps(line))
+        return response
@@ -12,8 +12,20 @@ urlpatterns = [
     path("delete_store/<int:store_id>", views.store, name="delete_store"),
     path("update_store/<int:store_id>", views.update_store, name="update_store"),
     path("import_items/<int:store_id>", views.import_items, name="import_items"),
+    path("upload_csv/<int:store_id>", views.upload_csv, name="upload_csv"),
+    path("xlsx_sheets/<int:store_id>", views.xlsx_sheets, name="xlsx_sheets"),
+    path("import_jobs/<int:store_id>", views.import_jobs, name="import_jobs"),
+    path("import_job/<int:job_id>", views.import_job, name="import_job"),
     path("create_lists/<int:store_id>", views.create_lists, name="create_lists"),
     path("create_list_item/<int:list_id>/<int:item_id>", views.create_list_item, name="create_list_item"),
+    path("update_list_items/<int:list_id>", views.update_list_items, name="update_list_items"),
+    path("export/<int:store_id>.csv", views.export_csv, name="export_csv"),
+    path("stock/<int:store_id>", views.stock, name="stock"),
+    path("variance/<int:store_id>", views.variance, name="variance"),
+    path("search/<int:store_id>", views.search, name="search"),
+    path("sync/<int:store_id>", views.sync, name="sync"),
+    path("events/<int:store_id>", views.events, name="events"),
     path("create_item/<int:store_id>", views.create_item, name="create_item"),
+    path("metrics", views.metrics, name="metrics"),
     
 ]
\ No newline at end of file
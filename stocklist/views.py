@@ -1,14 +1,32 @@
 import json
+from asgiref.sync import sync_to_async
+from calendar import timegm
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ValidationError
 from django.db.utils import IntegrityError
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.http import http_date
 
 from stocklist.forms import StoreNameForm
-from .models import User, Store, Item, List, ListItem, MIN_LIST_ITEM_AMOUNT
+from .decorators import async_login_required
+from .export import export_csv_lines, export_filename
+from .importer import (
+    ImportValidationError, clean_header_row, clean_list_item_amounts, import_csv, import_lists, import_xlsx, is_xlsx,
+    upsert_list_items, xlsx_preview,
+)
+from .jobs import enqueue_import
+from .metrics import METRICS_CONTENT_TYPE, REGISTRY
+from .search import parse_limit, search_items
+from .stock import balance_levels, last_count_list, parse_as_of, parse_threshold, stock_levels, variance_report
+from .sync import MAX_SYNC_OPERATIONS, apply_operations
+from .timing import span
+from .models import User, Store, Item, List, ListItem, ImportJob
 
 
 def index(request):
@@ -106,11 +124,21 @@ def store(request, store_id):
 
 
 
-@login_required
-def update_store(request, store_id): 
+def clean_and_save(instance):
+    '''
+    Validates, then saves a model instance.
+
+    Raises: ValidationError
+    '''
+    instance.full_clean()
+    instance.save()
+
+
+@async_login_required
+async def update_store(request, store_id): 
 
     # check for valid Store
-    store = get_object_or_404(Store, user=request.user, pk=store_id)
+    store = await sync_to_async(get_object_or_404)(Store, user=request.user, pk=store_id)
 
     if request.method == 'PUT':
 
@@ -121,13 +149,12 @@ def update_store(request, store_id):
             return JsonResponse({"validation_error": f"Store name cannot be empty"}, status=400)
         if new_store_name == store.name:
             return JsonResponse({"message": "No update necessary."}, status=201)
-        if Store.objects.filter(user=request.user, name=new_store_name).exists():  # must be done here
+        if await sync_to_async(Store.objects.filter(user=request.user, name=new_store_name).exists)():  # must be done here
             return JsonResponse({"integrity_error": f"Store name must be unique for user"}, status=400)
 
         try:
             store.name = new_store_name
-            store.full_clean()
-            store.save()
+            await sync_to_async(clean_and_save)(store)
         except ValidationError as e:
             return JsonResponse({"validation_error": e.messages}, status=400)
         else:
@@ -145,83 +172,332 @@ def import_items(request, store_id):
     if request.method == "POST":
         
         # list data
-        data = json.loads(request.body)
+        try:
+            data = parse_json_list(request.body)
+        except ValueError:
+            return JsonResponse({"error": "Import data must be a JSON array."}, status=400)
 
-        for dict in data:
-            list_name = dict.get("name", "")
-            list_type = dict.get("type", "")
-            items = dict.get("items", [])
+        # validate, then create Lists, Items & ListItems
+        matches = []
+        try:
+            import_lists(store, data, matches=matches)
+        except ImportValidationError as e:
+            return JsonResponse({"error": e.messages, "errors": e.report, "error_count": e.error_count}, status=400)
+
+        with span('serialize'):
+            return JsonResponse({"message": "Import successful.", "matches": matches}, status=201)
+    
+    return JsonResponse({"error": "POST request Required."}, status=400)
+
+
+@login_required
+def upload_csv(request, store_id):
+
+    # check for valid store
+    store = get_object_or_404(Store, user=request.user, pk=store_id)
+
+    if request.method == "POST":
+
+        # csv or xlsx file & column selections
+        csv_file = request.FILES.get("file")
+        if csv_file is None:
+            return JsonResponse({"error": "CSV file Required."}, status=400)
+        name_fields = request.POST.getlist("name_fields")
+        amount_field = request.POST.get("amount_field", "")
+        try:
+            lists = parse_json_list(request.POST.get("lists", "[]"))
+        except ValueError:
+            return JsonResponse({"error": "Lists must be a JSON array."}, status=400)
+
+        # validate, then create Lists, Items & ListItems
+        matches = []
+        try:
+            if is_xlsx(csv_file):
+                header_row = clean_header_row(request.POST.get("header_row"))
+                imported, skipped = import_xlsx(
+                    store, csv_file, name_fields, amount_field, lists, request.POST.get("sheet", ""), header_row, matches=matches
+                )
+            else:
+                imported, skipped = import_csv(store, csv_file, name_fields, amount_field, lists, matches=matches)
+        except ImportValidationError as e:
+            return JsonResponse({"error": e.messages, "errors": e.report, "error_count": e.error_count}, status=400)
+        except ValidationError as e:
+            return JsonResponse({"error": e.messages}, status=400)
+
+        return JsonResponse({"message": "Import successful.", "imported": imported, "skipped": skipped, "matches": matches}, status=201)
+
+    return JsonResponse({"error": "POST request Required."}, status=400)
+
+
+@login_required
+def xlsx_sheets(request, store_id):
+
+    # check for valid store
+    store = get_object_or_404(Store, user=request.user, pk=store_id)
+
+    if request.method == "POST":
+
+        # the first rows of each sheet, to select the sheet & header row
+        xlsx_file = request.FILES.get("file")
+        if xlsx_file is None:
+            return JsonResponse({"error": "XLSX file Required."}, status=400)
+        try:
+            sheets = xlsx_preview(xlsx_file)
+        except ValidationError as e:
+            return JsonResponse({"error": e.messages}, status=400)
 
-            # create List
+        return JsonResponse({"sheets": sheets})
+
+    return JsonResponse({"error": "POST request Required."}, status=400)
+
+
+def parse_json_list(text):
+    '''
+    Parses import data or Lists sent by a client, which must be a JSON array of objects.
+
+    Raises: ValueError
+    Return: list
+    '''
+    data = json.loads(text)
+    if not isinstance(data, list) or not all(isinstance(list_data, dict) for list_data in data):
+        raise ValueError("Expected a JSON array of objects.")
+    return data
+
+
+@login_required
+def import_jobs(request, store_id):
+
+    # check for valid store
+    store = get_object_or_404(Store, user=request.user, pk=store_id)
+
+    if request.method == "POST":
+
+        # queue a CSV or XLSX file, or import_items data
+        csv_file = request.FILES.get("file")
+        if csv_file is not None:
+            name_fields = request.POST.getlist("name_fields")
+            amount_field = request.POST.get("amount_field", "")
             try:
-                if list_type == '':
-                    list = List(name=list_name, store=store)
-                else:
-                    list = List(name=list_name, type=list_type, store=store)
-                list.full_clean()
-                list.save()
+                lists = parse_json_list(request.POST.get("lists", "[]"))
+            except ValueError:
+                return JsonResponse({"error": "Lists must be a JSON array."}, status=400)
+            try:
+                header_row = clean_header_row(request.POST.get("header_row"))
             except ValidationError as e:
                 return JsonResponse({"error": e.messages}, status=400)
+            job = enqueue_import(store, lists, csv_file, name_fields, amount_field, request.POST.get("sheet", ""), header_row)
+        else:
+            try:
+                data = parse_json_list(request.body)
+            except ValueError:
+                return JsonResponse({"error": "Import data must be a JSON array."}, status=400)
+            job = enqueue_import(store, data)
 
-            # create ListItems
-            for item_data in items:
+        return JsonResponse({"message": "Import queued.", "job_id": job.id}, status=202)
 
-                item_name = item_data.get("name", "")
-                if item_name == '':
-                    # skip rows with empty names - TODO - record total skipped?
-                    pass
-                else:
+    return JsonResponse({"error": "POST request Required."}, status=400)
+
+
+@async_login_required
+async def import_job(request, job_id):
+
+    # check for valid ImportJob
+    job = await sync_to_async(get_object_or_404)(ImportJob, store__user=request.user, pk=job_id)
+
+    if request.method == 'GET':
+        return JsonResponse(job.serialize())
+
+    return JsonResponse({"error": "GET request Required."}, status=400)
+
+
+@async_login_required
+async def items(request, store_id):
+
+     # check for valid store
+    store = await sync_to_async(get_object_or_404)(Store, user=request.user, pk=store_id)
+
+    if request.method == 'GET':
+
+        # only changes after a version the client has
+        since = request.GET.get("since", "")
+        if since != '':
+            try:
+                since = int(since)
+            except ValueError:
+                since = -1
+            if since < 0 or since > store.version:
+                return JsonResponse({"error": "Unknown version, fetch all items.", "version": store.version}, status=400)
+
+        # full items or matrix, the format is ignored for changes
+        format = request.GET.get("format", "")
+        if format not in ('', 'matrix'):
+            return JsonResponse({"error": "Unknown format, use matrix or none."}, status=400)
+
+        # 304 if the client has this version of the Store
+        if since != '':
+            etag = store.etag("since", since)
+        else:
+            etag = store.etag(format) if format else store.etag()
+        last_modified = timegm(store.date_modified.utctimetuple())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+        if response is None:
+
+            # created, updated & deleted Items, Lists & ListItems
+            if since != '':
+                data = await sync_to_async(store.serialize_changes)(since)
+
+            # item ids, names & amounts as arrays
+            elif format == "matrix":
+                data = await sync_to_async(store.serialize_matrix)()
+                data['version'] = store.version
+
+            else:
+                data = await sync_to_async(store.serialize_items)()
+                data['version'] = store.version
+
+            with span('serialize'):
+                response = JsonResponse(data, safe=False)
+
+        # clients must check the version before using a cached response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
-                    # check for Item in Store
-                    item_query = Item.objects.filter(name=item_name, store=store)
-                    if item_query.exists():
-                        item = item_query.first()
-                    else:
-
-                        # save Item to Store
-                        try:
-                            item = Item(name=item_name, store=store)
-                            item.full_clean()
-                            item.save()
-                        except ValidationError as ve: 
-                            # Collect these all up? currently stops loop after 1st ValidationError!
-                            # print(ve.messages)
-                            # IF not unique add item as ref
-                            return JsonResponse({"error": ve.messages}, status=400)
-
-                    # save ListItem to List
-                    item_amount = item_data.get("amount", '')
-                    if item_amount == '' or item_amount == 'null' or item_amount == None:
-                        item_amount = MIN_LIST_ITEM_AMOUNT
-                    try:
-                        list_item = ListItem(item=item, list=list, amount=item_amount)
-                        list_item.full_clean()
-                        list_item.save()
-                    except ValidationError as e:
-                        return JsonResponse({"error": e.messages}, status=400)
-              
-        return JsonResponse({"message": "Import successful."}, status=201)
-    
     return JsonResponse({"error": "POST request Required."}, status=400)
 
 
+@async_login_required
+async def stock(request, store_id):
+
+    # check for valid store
+    store = await sync_to_async(get_object_or_404)(Store, user=request.user, pk=store_id)
+
+    if request.method == 'GET':
+
+        # stock as of a date, default now
+        as_of = request.GET.get("as_of", "")
+        if as_of != '':
+            try:
+                as_of = parse_as_of(as_of)
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+        # levels only change with the Store version
+        etag = store.etag("stock") if as_of == '' else store.etag("stock", as_of.timestamp())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+
+            # current stock from the Item balances, past stock from the ListItems
+            if as_of == '':
+                levels = await sync_to_async(balance_levels)(store)
+            else:
+                levels = await sync_to_async(stock_levels)(store, as_of)
+            response = JsonResponse({"version": store.version, "stock": levels})
+
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return JsonResponse({"error": "GET request Required."}, status=400)
+
+
 @login_required
-def items(request, store_id):
+def export_csv(request, store_id):
 
-     # check for valid store
+    # check for valid store
     store = get_object_or_404(Store, user=request.user, pk=store_id)
 
     if request.method == 'GET':
 
-        items = Item.objects.filter(store_id=store_id).prefetch_related("list_items").order_by('id')
+        # streamed one line at a time, see capstone/asgi.py for ASGI
+        response = StreamingHttpResponse(export_csv_lines(store), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(export_filename(store))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
-        data = {
-            'items' : [item.serialize() for item in items],
-            'lists' : [list.serialize() for list in store.lists.all()]
-        }
-        return JsonResponse(data, safe=False)
+    return JsonResponse({"error": "GET request Required."}, status=400)
 
-    return JsonResponse({"error": "POST request Required."}, status=400)
+
+def variance_report_data(store, query):
+    '''
+    Runs the variance report for a Store with the report's query parameters.
+
+    Return: dict
+    Raises: Http404 for an invalid Count, ValueError for invalid parameters
+    '''
+    list_id = query.get("list_id", "")
+    if list_id != '':
+        count_list = get_object_or_404(List.counts, store=store, pk=list_id)
+    else:
+        count_list = last_count_list(store)
+        if count_list is None:
+            raise ValueError("No Count in Store.")
+
+    thresholds = {}
+    for name in ["threshold", "threshold_percentage"]:
+        if query.get(name, "") != '':
+            thresholds[name] = parse_threshold(query[name])
+
+    report = variance_report(store, count_list, sort=query.get("sort", "variance"), **thresholds)
+    report['version'] = store.version
+    return report
+
+
+@async_login_required
+async def variance(request, store_id):
+
+    # check for valid store
+    store = await sync_to_async(get_object_or_404)(Store, user=request.user, pk=store_id)
+
+    if request.method == 'GET':
+        try:
+            report = await sync_to_async(variance_report_data)(store, request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        return JsonResponse(report)
+
+    return JsonResponse({"error": "GET request Required."}, status=400)
+
+
+def search_data(store, query):
+    '''
+    Searches a Store's Items with the search's query parameters.
+
+    Return: dict
+    Raises: Http404 for an invalid List, ValueError for invalid parameters
+    '''
+    lists = {}
+    for name in ["list", "uncounted"]:
+        if query.get(name, "") != '':
+            lists[name] = get_object_or_404(List, store=store, pk=query[name])
+
+    return search_items(
+        store,
+        query.get("q", "").strip(),
+        mode=query.get("match", "substring"),
+        in_list=lists.get("list"),
+        not_in_list=lists.get("uncounted"),
+        cursor=query.get("cursor", ""),
+        limit=parse_limit(query.get("limit", "")),
+    )
+
+
+@async_login_required
+async def search(request, store_id):
+
+    # check for valid store
+    store = await sync_to_async(get_object_or_404)(Store, user=request.user, pk=store_id)
+
+    if request.method == 'GET':
+        try:
+            results = await sync_to_async(search_data)(store, request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        return JsonResponse(results)
+
+    return JsonResponse({"error": "GET request Required."}, status=400)
 
 
 @login_required
@@ -279,14 +555,36 @@ def create_item(request, store_id): #item
     return JsonResponse({"error": "POST request Required."}, status=400)
 
 
-@login_required
-def create_list_item(request, list_id, item_id): #list_item
+def count_list_item(list, item, amount):
+    '''
+    Creates or updates the ListItem for an Item in a List, counted now.
+
+    Raises: ValidationError
+    Return: bool - True if the ListItem was created
+    '''
+    created = False
+    try:
+        list_item = ListItem.objects.get(item=item, list=list)
+        # the List is used again to save, and for its balances
+        list_item.list = list
+        list_item.amount = amount
+    except ListItem.DoesNotExist:
+        list_item = ListItem(item=item, list=list, amount=amount)
+        created = True
+    list_item.date_counted = timezone.now()
+    list_item.op_id = ''
+    clean_and_save(list_item)
+    return created
+
+
+@async_login_required
+async def create_list_item(request, list_id, item_id): #list_item
 
     # check for valid List
-    list = get_object_or_404(List, pk=list_id)
+    list = await sync_to_async(get_object_or_404)(List, pk=list_id)
 
     # check for valid Item
-    item = get_object_or_404(Item, pk=item_id)
+    item = await sync_to_async(get_object_or_404)(Item, pk=item_id)
     # create item?
 
     # save Item amount: create ListItem
@@ -294,16 +592,8 @@ def create_list_item(request, list_id, item_id): #list_item
         data = json.loads(request.body)
         item_amount = data.get("amount", "")
 
-        created = False
-        try:
-            list_item = ListItem.objects.get(item=item, list=list)
-            list_item.amount = item_amount
-        except ListItem.DoesNotExist:
-            list_item = ListItem(item=item, list=list, amount=item_amount)
-            created = True
         try:
-            list_item.full_clean()
-            list_item.save()
+            created = await sync_to_async(count_list_item)(list, item, item_amount)
         except ValidationError as e:
             return JsonResponse({"error": e.messages}, status=400)
 
@@ -314,6 +604,70 @@ def create_list_item(request, list_id, item_id): #list_item
 
 
 
+@login_required
+def update_list_items(request, list_id):
+
+    # check for valid List
+    count_list = get_object_or_404(List, store__user=request.user, pk=list_id)
+
+    # save Item amounts: create or update ListItems
+    if request.method == 'POST':
+        data = json.loads(request.body)
+        if not isinstance(data, list):
+            return JsonResponse({"error": "List of item_id & amount Required."}, status=400)
+
+        # validate all, then upsert in batches
+        try:
+            amounts = clean_list_item_amounts(count_list, data)
+        except ImportValidationError as e:
+            return JsonResponse({"error": e.messages, "errors": e.report, "error_count": e.error_count}, status=400)
+        version = upsert_list_items(count_list, amounts)
+
+        return JsonResponse({"message": "Update successful.", "updated": len(amounts), "version": version}, status=201)
+
+    return JsonResponse({"error": "POST request Required."}, status=400)
+
+@login_required
+def sync(request, store_id):
+
+    # check for valid store
+    store = get_object_or_404(Store, user=request.user, pk=store_id)
+
+    # apply counts queued by a client while offline
+    if request.method == 'POST':
+        data = json.loads(request.body)
+        if not isinstance(data, list):
+            return JsonResponse({"error": "List of operations Required."}, status=400)
+        if len(data) > MAX_SYNC_OPERATIONS:
+            return JsonResponse({"error": "Send at most {} operations at once.".format(MAX_SYNC_OPERATIONS)}, status=400)
+
+        results, version = apply_operations(store, data)
+
+        return JsonResponse({"message": "Sync successful.", "results": results, "version": version}, status=201)
+
+    return JsonResponse({"error": "POST request Required."}, status=400)
+
+@login_required
+def events(request, store_id):
+
+    # check for valid store
+    store = get_object_or_404(Store, user=request.user, pk=store_id)
+
+    # events are streamed by capstone/asgi.py, 204 tells an EventSource not to reconnect
+    return HttpResponse(status=204)
+
+
+def metrics(request):
+
+    # for the metrics scraper only
+    if not settings.METRICS or request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS:
+        raise Http404
+
+    if request.method == 'GET':
+        return HttpResponse(REGISTRY.exposition(), content_type=METRICS_CONTENT_TYPE)
+
+    return JsonResponse({"error": "GET request Required."}, status=400)
+
 
 def login_view(request):
     if request.method == "POST":